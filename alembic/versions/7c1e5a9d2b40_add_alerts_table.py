@@ -0,0 +1,50 @@
+"""Add alerts table
+
+Revision ID: 7c1e5a9d2b40
+Revises: 4302d349667d
+Create Date: 2026-10-17 19:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1e5a9d2b40'
+down_revision: Union[str, None] = '4302d349667d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'alerts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('secid', sa.String(length=30), nullable=False),
+        sa.Column('code', sa.String(length=20), nullable=False),
+        sa.Column('field', sa.String(length=10), nullable=False),
+        sa.Column('operator', sa.String(length=20), nullable=False),
+        sa.Column('threshold', sa.Float(), nullable=False),
+        sa.Column('cooldown_seconds', sa.Integer(), nullable=False),
+        sa.Column('notify_email', sa.String(length=100), nullable=True),
+        sa.Column('note', sa.String(length=200), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('trigger_count', sa.Integer(), nullable=False),
+        sa.Column('last_triggered_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_alerts_id'), 'alerts', ['id'], unique=False)
+    op.create_index(op.f('ix_alerts_user_id'), 'alerts', ['user_id'], unique=False)
+    op.create_index(op.f('ix_alerts_secid'), 'alerts', ['secid'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_alerts_secid'), table_name='alerts')
+    op.drop_index(op.f('ix_alerts_user_id'), table_name='alerts')
+    op.drop_index(op.f('ix_alerts_id'), table_name='alerts')
+    op.drop_table('alerts')
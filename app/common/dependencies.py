@@ -2,16 +2,19 @@
 
 from fastapi import Depends, HTTPException, status, Query, Request
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+import dataclasses
 import datetime
 import os
 
-from ..database import get_db
+from ..database import get_async_db, AsyncSessionLocal
 from .. import models, crud, plans
 from .response_model import APIException
+from .principal import Principal, principal_cache
 
 # --- 配置 ---
 SECRET_KEY = os.getenv("SECRET_KEY", "a_very_secret_key_if_not_in_env")
@@ -52,14 +55,64 @@ def decode_token(token: str):
         return None
 
 
+# ==========================================================
+#                  已认证用户缓存
+# ==========================================================
+# 认证依赖返回只读的 Principal 快照，并按 user_id / API Token 缓存，缓存命中时不访问数据库
+# (会话在首次查询时才占用连接)。需要修改用户的路由使用 load_user / load_user_async 重新加载 ORM 实例。
+# 认证依赖全部为 async def 并使用异步会话，不占用线程池。
+def _to_principal(user: models.User) -> Principal:
+    principal = Principal.from_user(user, plans.effective_plan(user.plan, user.is_superuser, user.expires_at))
+    principal_cache.put(principal)
+    return principal
+
+
+def _apply_plan_limits(principal: Principal) -> Principal:
+    """缓存期间套餐可能到期，取用时按当前时间重新计算有效套餐。"""
+    plan = plans.effective_plan(principal.plan, principal.is_superuser, principal.expires_at)
+    return principal if plan == principal.plan else dataclasses.replace(principal, plan=plan)
+
+
+async def _principal_by_id(db: AsyncSession, user_id: int) -> Optional[Principal]:
+    principal = principal_cache.get_by_id(user_id)
+    if principal is None:
+        user = await crud.get_user_by_id_async(db, user_id=user_id)
+        principal = _to_principal(user) if user is not None else None
+    return _apply_plan_limits(principal) if principal is not None else None
+
+
+async def _principal_by_token(db: AsyncSession, api_token: str) -> Optional[Principal]:
+    principal = principal_cache.get_by_token(api_token)
+    if principal is None:
+        user = await crud.get_user_by_api_token_async(db, api_token=api_token)
+        principal = _to_principal(user) if user is not None else None
+    return _apply_plan_limits(principal) if principal is not None else None
+
+
+def load_user(db: Session, principal: Principal) -> models.User:
+    """按 Principal 重新加载 ORM 用户 (已应用套餐限制)，供需要修改用户的路由使用。"""
+    user = crud.get_user_by_id(db, user_id=principal.id)
+    if user is None:
+        raise APIException(code=status.HTTP_404_NOT_FOUND, msg="User not found")
+    return plans.apply_plan_limits(user)
+
+
+async def load_user_async(db: AsyncSession, principal: Principal) -> models.User:
+    """load_user 的异步版本。"""
+    user = await crud.get_user_by_id_async(db, user_id=principal.id)
+    if user is None:
+        raise APIException(code=status.HTTP_404_NOT_FOUND, msg="User not found")
+    return plans.apply_plan_limits(user)
+
+
 # ==========================================================
 #                  Web App JWT 认证
 # ==========================================================
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/token", auto_error=False)
 
 
-def get_current_user_from_jwt(token: Optional[str] = Depends(oauth2_scheme),
-                              db: Session = Depends(get_db)) -> models.User:
+async def get_current_user_from_jwt(token: Optional[str] = Depends(oauth2_scheme),
+                                    db: AsyncSession = Depends(get_async_db)) -> Principal:
     """依赖项：通过 JWT (Bearer Token) 获取用户，这是Web App认证的基础。"""
     if token is None:
         raise APIException(code=status.HTTP_401_UNAUTHORIZED, msg="Authorization token is missing")
@@ -72,7 +125,7 @@ def get_current_user_from_jwt(token: Optional[str] = Depends(oauth2_scheme),
     if user_id is None:
         raise APIException(code=status.HTTP_401_UNAUTHORIZED, msg="Invalid token payload")
 
-    user = crud.get_user_by_id(db, user_id=user_id)
+    user = await _principal_by_id(db, user_id)
     if user is None:
         raise APIException(code=status.HTTP_404_NOT_FOUND, msg="User not found")
 
@@ -82,14 +135,14 @@ def get_current_user_from_jwt(token: Optional[str] = Depends(oauth2_scheme),
 # ==========================================================
 #                   SaaS 静态 Token 认证
 # ==========================================================
-def get_user_by_api_token(
+async def get_user_by_api_token(
         token: Optional[str] = Query(None, description="用户的静态 API Token"),
-        db: Session = Depends(get_db)
-) -> models.User:
+        db: AsyncSession = Depends(get_async_db)
+) -> Principal:
     """依赖项：通过静态 API Token (URL查询参数) 获取用户，用于SaaS服务。"""
     if token is None:
         raise APIException(code=status.HTTP_401_UNAUTHORIZED, msg="API Token is missing in query parameters.")
-    user = crud.get_user_by_api_token(db, api_token=token)
+    user = await _principal_by_token(db, token)
     if user is None:
         raise APIException(code=status.HTTP_401_UNAUTHORIZED, msg="Invalid API Token.")
     return user
@@ -98,14 +151,14 @@ def get_user_by_api_token(
 # ==========================================================
 #                   权限检查依赖
 # ==========================================================
-def get_current_active_user(current_user: models.User = Depends(get_current_user_from_jwt)) -> models.User:
-    """依赖项：确保通过 JWT 登录的用户是激活状态并应用套餐限制。"""
+async def get_current_active_user(current_user: Principal = Depends(get_current_user_from_jwt)) -> Principal:
+    """依赖项：确保通过 JWT 登录的用户是激活状态 (套餐限制已在取用时应用)。"""
     if not current_user.is_active:
         raise APIException(code=status.HTTP_403_FORBIDDEN, msg="Inactive user")
-    return plans.apply_plan_limits(current_user)
+    return current_user
 
 
-def get_current_active_superuser(current_user: models.User = Depends(get_current_active_user)) -> models.User:
+async def get_current_active_superuser(current_user: Principal = Depends(get_current_active_user)) -> Principal:
     """依赖项：确保通过 JWT 登录的用户是超级管理员。"""
     if not current_user.is_superuser:
         raise APIException(code=status.HTTP_403_FORBIDDEN, msg="Admin privileges required")
@@ -113,10 +166,10 @@ def get_current_active_superuser(current_user: models.User = Depends(get_current
 
 
 # --- 混合认证模式 (用于 Monitor, AI 等接口) ---
-def get_user_from_header_or_query(
+async def get_user_from_header_or_query(
         request: Request,
-        db: Session = Depends(get_db)
-) -> models.User:
+        db: AsyncSession = Depends(get_async_db)
+) -> Principal:
     """
     一个灵活的依赖，自动检测使用 JWT 还是静态 Token 进行认证。
     优先检查 Authorization Header (JWT)，如果不存在，则检查 token 查询参数 (静态 Token)。
@@ -127,9 +180,9 @@ def get_user_from_header_or_query(
     user = None
     if auth_header and auth_header.lower().startswith("bearer "):
         jwt_token = auth_header.split(" ")[1]
-        user = get_current_user_from_jwt(jwt_token, db)
+        user = await get_current_user_from_jwt(jwt_token, db)
     elif token_query:
-        user = get_user_by_api_token(token_query, db)
+        user = await get_user_by_api_token(token_query, db)
     else:
         raise APIException(code=status.HTTP_401_UNAUTHORIZED,
                            msg="Authentication required. Provide Bearer token or API token in query.")
@@ -138,23 +191,42 @@ def get_user_from_header_or_query(
     if not user.is_active:
         raise APIException(code=status.HTTP_403_FORBIDDEN, msg="Inactive user")
 
-    return plans.apply_plan_limits(user)
+    return user
 
 
-def get_user_by_token_query(
+async def get_user_by_token_query(
     token: str = Query(..., description="API Token for authenticating the SSE connection"),
-    db: Session = Depends(get_db)
-) -> models.User:
+    db: AsyncSession = Depends(get_async_db)
+) -> Principal:
     """
     这是一个专用于SSE连接的依赖项，通过URL查询参数中必需的token进行认证。
     """
     if not token:
         raise APIException(code=status.HTTP_401_UNAUTHORIZED, msg="API Token is missing for the stream.")
 
-    user = crud.user.get_user_by_api_token(db, api_token=token)
+    user = await _principal_by_token(db, token)
     if not user:
         raise APIException(code=status.HTTP_401_UNAUTHORIZED, msg="Invalid API Token for the stream.")
     if not user.is_active:
         raise APIException(code=status.HTTP_403_FORBIDDEN, msg="User is inactive.")
 
-    return plans.apply_plan_limits(user)
+    return user
+
+
+# ==========================================================
+#                   长连接 (SSE / 流式导出) 认证
+# ==========================================================
+# 流式路由不使用请求级会话 (get_async_db)：依赖自行开启短会话，解析出 Principal 后立即关闭会话、归还连接，
+# 推流期间不持有任何数据库资源 (缓存命中时根本不占用连接)，长连接数不受连接池大小限制。
+async def get_stream_user_from_header_or_query(request: Request) -> Principal:
+    """get_user_from_header_or_query 的长连接版本。"""
+    async with AsyncSessionLocal() as db:
+        return await get_user_from_header_or_query(request, db)
+
+
+async def get_stream_user_by_token_query(
+    token: str = Query(..., description="API Token for authenticating the SSE connection")
+) -> Principal:
+    """get_user_by_token_query 的长连接版本。"""
+    async with AsyncSessionLocal() as db:
+        return await get_user_by_token_query(token, db)
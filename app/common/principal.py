@@ -0,0 +1,97 @@
+# 文件: app/common/principal.py
+
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# 已认证用户的缓存时间 (秒)。本进程内的修改会立即失效缓存；多 worker 部署时其他 worker 最多滞后这么久
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", 30.0))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", 10000))
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    已认证用户的只读快照，由认证依赖返回。
+    不持有 ORM 实例与数据库会话，长连接 (SSE) 可以放心持有；需要修改用户时由路由按 id 重新加载。
+    plan 为已应用套餐限制后的有效套餐 (管理员为 admin，过期降级为 freemium)。
+    """
+    id: int
+    email: str
+    username: str
+    nickname: Optional[str]
+    is_active: bool
+    is_superuser: bool
+    plan: str
+    expires_at: Optional[datetime.datetime]
+    api_token: Optional[str]
+
+    @classmethod
+    def from_user(cls, user, plan: str) -> "Principal":
+        return cls(id=user.id, email=user.email, username=user.username, nickname=getattr(user, 'nickname', None),
+                   is_active=bool(user.is_active), is_superuser=bool(user.is_superuser), plan=plan,
+                   expires_at=user.expires_at, api_token=user.api_token)
+
+
+class PrincipalCache:
+    """
+    按 API Token 与 user_id 索引的进程内用户缓存 (TTL + 条目上限)。
+    用户的套餐、Token、状态或权限变化时调用 invalidate_user，两个索引同时失效。
+    """
+
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # user_id -> (Principal, 过期时间)
+        self._by_id: "OrderedDict[int, Tuple[Principal, float]]" = OrderedDict()
+        self._id_by_token: dict = {}
+
+    def get_by_id(self, user_id: int) -> Optional[Principal]:
+        with self._lock:
+            entry = self._by_id.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                self._drop(user_id)
+                return None
+            return entry[0]
+
+    def get_by_token(self, api_token: str) -> Optional[Principal]:
+        with self._lock:
+            user_id = self._id_by_token.get(api_token)
+        return self.get_by_id(user_id) if user_id is not None else None
+
+    def put(self, principal: Principal):
+        with self._lock:
+            self._drop(principal.id)
+            self._by_id[principal.id] = (principal, time.monotonic() + self.ttl)
+            if principal.api_token:
+                self._id_by_token[principal.api_token] = principal.id
+            while len(self._by_id) > self.max_entries:
+                self._drop(next(iter(self._by_id)))
+
+    def invalidate_user(self, user_id: Optional[int]):
+        if user_id is None:
+            return
+        with self._lock:
+            self._drop(user_id)
+
+    def _drop(self, user_id: int):
+        entry = self._by_id.pop(user_id, None)
+        if entry is not None and entry[0].api_token:
+            if self._id_by_token.get(entry[0].api_token) == user_id:
+                del self._id_by_token[entry[0].api_token]
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._id_by_token.clear()
+
+
+# 进程级单例
+principal_cache = PrincipalCache()
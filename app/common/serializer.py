@@ -0,0 +1,73 @@
+# 文件: app/common/serializer.py
+
+import datetime
+import decimal
+import json
+from typing import Any, Optional
+
+from starlette.responses import JSONResponse
+
+# --- 编码器选择：orjson > msgspec > 标准库 json ---
+try:
+    import orjson
+
+    JSON_BACKEND = "orjson"
+except ImportError:  # pragma: no cover - 取决于部署环境
+    orjson = None
+    try:
+        import msgspec
+
+        JSON_BACKEND = "msgspec"
+    except ImportError:
+        msgspec = None
+        JSON_BACKEND = "json"
+
+
+def _default(obj: Any) -> Any:
+    """处理快速编码器不直接支持的类型 (numpy/pandas 标量、Decimal、集合等)。"""
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if hasattr(obj, "tolist"):  # numpy 数组 / 标量
+        return obj.tolist()
+    if hasattr(obj, "isoformat"):  # pandas.Timestamp 等
+        return obj.isoformat()
+    return str(obj)
+
+
+if JSON_BACKEND == "orjson":
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+elif JSON_BACKEND == "msgspec":
+    _msgspec_encoder = msgspec.json.Encoder(enc_hook=_default)
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return _msgspec_encoder.encode(obj)
+else:
+    def dumps_bytes(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """编码为 str (不转义中文)，用于日志或需要字符串的场合。"""
+    return dumps_bytes(obj).decode("utf-8")
+
+
+def sse_event(payload: Any, event: Optional[str] = None) -> bytes:
+    """把载荷编码为一条完整的 SSE 消息 (bytes)。"""
+    body = b"data: " + dumps_bytes(payload) + b"\n\n"
+    if event:
+        return b"event: " + event.encode("utf-8") + b"\n" + body
+    return body
+
+
+class FastJSONResponse(JSONResponse):
+    """使用上面选定编码器的 JSON 响应类，作为 FastAPI 的默认响应类。"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
@@ -0,0 +1,377 @@
+# 文件: app/common/state_backend.py
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+from ..globals import logger
+
+# 可选依赖：只有 STATE_BACKEND=redis 时才需要
+try:
+    import redis
+except ImportError:  # pragma: no cover - 取决于部署环境
+    redis = None
+
+# 状态后端: memory (单进程)、sqlite (同机多 worker，WAL 文件共享) 或 redis (任意 Redis 协议服务器)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_BACKEND_PATH = os.getenv("STATE_BACKEND_PATH", os.path.join("cache", "state.sqlite3"))
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL", "redis://localhost:6379/0")
+# 连接租约的有效期 (秒)。持有者需在到期前续约，worker 崩溃后其租约最多在这段时间后自动失效
+CONNECTION_LEASE_TTL = float(os.getenv("CONNECTION_LEASE_TTL", 30.0))
+
+
+class StateBackend(ABC):
+    """
+    跨 worker 共享的轻量状态：连接租约计数与令牌桶限流。
+    所有操作都是原子的；时间统一使用 time.time()，同一台机器上的 worker 之间可比较。
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def acquire_lease(self, key: str, limit: int, ttl: float) -> Optional[str]:
+        """当 key 下未过期的租约少于 limit (limit 为 -1 表示不限) 时登记一个新租约并返回其 ID，否则返回 None。"""
+        ...
+
+    @abstractmethod
+    def renew_lease(self, key: str, lease_id: str, ttl: float) -> bool:
+        """延长租约；租约已过期被清理时返回 False。"""
+        ...
+
+    @abstractmethod
+    def release_lease(self, key: str, lease_id: str):
+        ...
+
+    @abstractmethod
+    def count_leases(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    def take_token(self, key: str, capacity: float, refill_per_second: float, cost: float = 1.0) -> float:
+        """从令牌桶中取 cost 个令牌。成功返回 0，否则返回还需等待的秒数 (此时不扣减)。"""
+        ...
+
+    def close(self):
+        pass
+
+
+def _bucket_step(tokens: float, updated_at: float, now: float, capacity: float, refill: float,
+                 cost: float) -> tuple:
+    """令牌桶的纯计算部分，返回 (新令牌数, 需等待秒数)。"""
+    tokens = min(capacity, tokens + max(0.0, now - updated_at) * refill)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / refill if refill > 0 else float("inf")
+
+
+class MemoryStateBackend(StateBackend):
+    """进程内实现，适用于单 worker 部署与开发环境。"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases: Dict[str, Dict[str, float]] = {}
+        self._buckets: Dict[str, tuple] = {}
+
+    def _live_leases(self, key: str, now: float) -> Dict[str, float]:
+        leases = self._leases.setdefault(key, {})
+        for lease_id in [lid for lid, expires in leases.items() if expires <= now]:
+            del leases[lease_id]
+        return leases
+
+    def acquire_lease(self, key: str, limit: int, ttl: float) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            leases = self._live_leases(key, now)
+            if limit != -1 and len(leases) >= limit:
+                return None
+            lease_id = uuid.uuid4().hex
+            leases[lease_id] = now + ttl
+            return lease_id
+
+    def renew_lease(self, key: str, lease_id: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            leases = self._live_leases(key, now)
+            if lease_id not in leases:
+                return False
+            leases[lease_id] = now + ttl
+            return True
+
+    def release_lease(self, key: str, lease_id: str):
+        with self._lock:
+            leases = self._leases.get(key)
+            if leases is not None:
+                leases.pop(lease_id, None)
+                if not leases:
+                    del self._leases[key]
+
+    def count_leases(self, key: str) -> int:
+        with self._lock:
+            return len(self._live_leases(key, time.time()))
+
+    def take_token(self, key: str, capacity: float, refill_per_second: float, cost: float = 1.0) -> float:
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens, wait = _bucket_step(tokens, updated_at, now, capacity, refill_per_second, cost)
+            self._buckets[key] = (tokens, now)
+            return wait
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    基于 SQLite WAL 的共享实现，同一台机器上的多个 worker 共用一个文件。
+    每个复合操作在 BEGIN IMMEDIATE 事务中完成，跨进程串行化；过期行在访问时顺带清理。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = STATE_BACKEND_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS state_leases ("
+                         " key TEXT NOT NULL, lease_id TEXT NOT NULL, expires_at REAL NOT NULL,"
+                         " PRIMARY KEY (key, lease_id)) WITHOUT ROWID")
+            conn.execute("CREATE TABLE IF NOT EXISTS state_buckets ("
+                         " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL) WITHOUT ROWID")
+            self._conn = conn
+        return self._conn
+
+    def _transaction(self, work):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    def acquire_lease(self, key: str, limit: int, ttl: float) -> Optional[str]:
+        now = time.time()
+
+        def work(conn):
+            conn.execute("DELETE FROM state_leases WHERE key=? AND expires_at<=?", (key, now))
+            count = conn.execute("SELECT COUNT(*) FROM state_leases WHERE key=?", (key,)).fetchone()[0]
+            if limit != -1 and count >= limit:
+                return None
+            lease_id = uuid.uuid4().hex
+            conn.execute("INSERT INTO state_leases (key, lease_id, expires_at) VALUES (?, ?, ?)",
+                         (key, lease_id, now + ttl))
+            return lease_id
+
+        return self._transaction(work)
+
+    def renew_lease(self, key: str, lease_id: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                "UPDATE state_leases SET expires_at=? WHERE key=? AND lease_id=? AND expires_at>?",
+                (now + ttl, key, lease_id, now))
+            return cursor.rowcount > 0
+
+    def release_lease(self, key: str, lease_id: str):
+        with self._lock:
+            self._connect().execute("DELETE FROM state_leases WHERE key=? AND lease_id=?", (key, lease_id))
+
+    def count_leases(self, key: str) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM state_leases WHERE key=? AND expires_at>?",
+                                           (key, time.time())).fetchone()[0]
+
+    def take_token(self, key: str, capacity: float, refill_per_second: float, cost: float = 1.0) -> float:
+        now = time.time()
+
+        def work(conn):
+            row = conn.execute("SELECT tokens, updated_at FROM state_buckets WHERE key=?", (key,)).fetchone()
+            tokens, updated_at = row if row is not None else (capacity, now)
+            tokens, wait = _bucket_step(tokens, updated_at, now, capacity, refill_per_second, cost)
+            conn.execute("INSERT OR REPLACE INTO state_buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            return wait
+
+        return self._transaction(work)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 租约: ZSET (成员为租约ID，分值为到期时间)。先清理过期成员再判断数量，整个脚本在服务端原子执行
+_REDIS_ACQUIRE = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local limit = tonumber(ARGV[3])
+if limit ~= -1 and redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[4])
+redis.call('PEXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+_REDIS_RENEW = """
+if (tonumber(redis.call('ZSCORE', KEYS[1], ARGV[3]) or '0')) <= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+# 令牌桶: HASH {tokens, ts}；返回需等待的秒数 (字符串，避免 Lua 把小数截断为整数)
+_REDIS_TAKE = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+elseif refill > 0 then
+    wait = (cost - tokens) / refill
+else
+    wait = -1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+if refill > 0 then
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / refill * 1000) + 1000)
+end
+return tostring(wait)
+"""
+
+
+class RedisStateBackend(StateBackend):
+    """基于 Redis 协议服务器 (Redis/Valkey/KeyDB 等) 的共享实现，复合操作用 Lua 脚本保证原子性。"""
+
+    name = "redis"
+
+    def __init__(self, url: str = STATE_BACKEND_URL, prefix: str = "ldgy:"):
+        if redis is None:
+            raise RuntimeError("STATE_BACKEND=redis 需要安装 redis 包 (pip install redis)")
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._acquire = self._client.register_script(_REDIS_ACQUIRE)
+        self._renew = self._client.register_script(_REDIS_RENEW)
+        self._take = self._client.register_script(_REDIS_TAKE)
+
+    def acquire_lease(self, key: str, limit: int, ttl: float) -> Optional[str]:
+        now, lease_id = time.time(), uuid.uuid4().hex
+        ok = self._acquire(keys=[self.prefix + "lease:" + key],
+                           args=[now, now + ttl, limit, lease_id, int(ttl * 1000) + 1000])
+        return lease_id if ok else None
+
+    def renew_lease(self, key: str, lease_id: str, ttl: float) -> bool:
+        now = time.time()
+        return bool(self._renew(keys=[self.prefix + "lease:" + key],
+                                args=[now, now + ttl, lease_id, int(ttl * 1000) + 1000]))
+
+    def release_lease(self, key: str, lease_id: str):
+        self._client.zrem(self.prefix + "lease:" + key, lease_id)
+
+    def count_leases(self, key: str) -> int:
+        return self._client.zcount(self.prefix + "lease:" + key, f"({time.time()}", "+inf")
+
+    def take_token(self, key: str, capacity: float, refill_per_second: float, cost: float = 1.0) -> float:
+        wait = float(self._take(keys=[self.prefix + "bucket:" + key],
+                                args=[capacity, refill_per_second, cost, time.time()]))
+        return float("inf") if wait < 0 else wait
+
+    def close(self):
+        self._client.close()
+
+
+class Lease:
+    """
+    一个已登记的连接租约。推流开始时调用 start()，由后台任务每隔 ttl/3 续约一次，与推流循环的节拍无关
+    (interval 可以大于 ttl)；worker 崩溃而未能 release 时，租约在 ttl 之后自动失效，不会永久占用配额。
+    续约时发现租约已过期被清理，按原上限重新登记；名额已被其他连接占用时 lost 置为 True，推流循环应结束连接。
+    后端调用可能是同步的磁盘/网络 I/O，一律在线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, backend: StateBackend, key: str, lease_id: str, limit: int, ttl: float):
+        self.backend = backend
+        self.key = key
+        self.lease_id = lease_id
+        self.limit = limit
+        self.ttl = ttl
+        self.lost = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.lease_id is not None:
+            self._task = asyncio.create_task(self._renew_loop(), name=f"lease-{self.key}")
+
+    async def _renew_loop(self):
+        while self.lease_id is not None:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if await asyncio.to_thread(self.backend.renew_lease, self.key, self.lease_id, self.ttl):
+                    continue
+                self.lease_id = await asyncio.to_thread(self.backend.acquire_lease, self.key, self.limit, self.ttl)
+                if self.lease_id is None:
+                    logger.warning(f"连接租约 {self.key} 已过期且名额已被占用，连接将被关闭。")
+                    self.lost = True
+            except Exception as e:
+                # 后端暂时不可用：保留租约 ID，下个周期重试
+                logger.warning(f"连接租约 {self.key} 续约失败: {type(e).__name__} - {e}")
+
+    def release(self):
+        """结束续约并在线程中释放租约；不等待结果，可在被取消的推流生成器的 finally 中安全调用。"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        lease_id, self.lease_id = self.lease_id, None
+        if lease_id is None:
+            return
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self.backend.release_lease, self.key, lease_id)
+        except RuntimeError:
+            self.backend.release_lease(self.key, lease_id)
+
+
+async def acquire_connection(user_id: int, limit: int, ttl: float = CONNECTION_LEASE_TTL) -> Optional[Lease]:
+    """为用户登记一个长连接；超过 limit (-1 为不限) 时返回 None。"""
+    key = f"conn:USER_{user_id}"
+    lease_id = await asyncio.to_thread(state_backend.acquire_lease, key, limit, ttl)
+    return Lease(state_backend, key, lease_id, limit, ttl) if lease_id is not None else None
+
+
+async def active_connections(user_id: int) -> int:
+    return await asyncio.to_thread(state_backend.count_leases, f"conn:USER_{user_id}")
+
+
+def create_state_backend(kind: str = STATE_BACKEND) -> StateBackend:
+    if kind == "sqlite":
+        return SQLiteStateBackend()
+    if kind == "redis":
+        return RedisStateBackend()
+    if kind != "memory":
+        raise ValueError(f"未知的 STATE_BACKEND: {kind} (可选 memory / sqlite / redis)")
+    return MemoryStateBackend()
+
+
+# 进程级单例；多 worker 部署时配置 STATE_BACKEND=sqlite 或 redis，各 worker 共享同一份状态
+state_backend = create_state_backend()
@@ -1,2 +1,3 @@
 from .user import *
 from . import workspace
+from . import alert
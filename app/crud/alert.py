@@ -0,0 +1,85 @@
+# 文件: app/crud/alert.py
+
+import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .. import models
+
+
+def get_active_alerts_with_email(db: Session) -> List[Tuple[models.Alert, str]]:
+    """启动时加载全部启用的警报及其所属用户的邮箱。"""
+    return db.query(models.Alert, models.User.email).join(models.User, models.Alert.user_id == models.User.id).filter(
+        models.Alert.is_active == True,  # noqa: E712
+        models.User.is_active == True  # noqa: E712
+    ).all()
+
+
+def record_triggers(db: Session, alert_ids: Sequence[int], triggered_at: datetime.datetime):
+    """批量记录触发时间与次数。"""
+    if not alert_ids:
+        return
+    db.query(models.Alert).filter(models.Alert.id.in_(list(alert_ids))).update(
+        {models.Alert.trigger_count: models.Alert.trigger_count + 1,
+         models.Alert.last_triggered_at: triggered_at},
+        synchronize_session=False
+    )
+    db.commit()
+
+
+# ==========================================================
+#                  异步版本 (AsyncSession)
+# ==========================================================
+# 供 async def 路由使用；上面的同步函数只由警报引擎在线程中调用。
+async def get_alert_async(db: AsyncSession, alert_id: int, user_id: int) -> Optional[models.Alert]:
+    return await db.scalar(select(models.Alert).where(
+        models.Alert.id == alert_id,
+        models.Alert.user_id == user_id
+    ))
+
+
+async def get_alerts_by_user_async(db: AsyncSession, user_id: int) -> List[models.Alert]:
+    result = await db.scalars(select(models.Alert).where(models.Alert.user_id == user_id).order_by(models.Alert.id))
+    return list(result)
+
+
+async def count_active_alerts_async(db: AsyncSession, user_id: int) -> int:
+    return await db.scalar(select(func.count(models.Alert.id)).where(
+        models.Alert.user_id == user_id,
+        models.Alert.is_active == True  # noqa: E712
+    )) or 0
+
+
+async def create_alert_async(db: AsyncSession, user_id: int, secid: str, code: str, field: str, operator: str,
+                             threshold: float, cooldown_seconds: int, notify_email: Optional[str],
+                             note: Optional[str]) -> models.Alert:
+    db_alert = models.Alert(
+        user_id=user_id, secid=secid, code=code, field=field, operator=operator, threshold=threshold,
+        cooldown_seconds=cooldown_seconds, notify_email=notify_email, note=note, is_active=True, trigger_count=0
+    )
+    db.add(db_alert)
+    await db.commit()
+    await db.refresh(db_alert)
+    return db_alert
+
+
+async def update_alert_async(db: AsyncSession, alert_id: int, user_id: int, changes: Dict) -> Optional[models.Alert]:
+    db_alert = await get_alert_async(db, alert_id=alert_id, user_id=user_id)
+    if db_alert:
+        for key, value in changes.items():
+            setattr(db_alert, key, value)
+        await db.commit()
+        await db.refresh(db_alert)
+    return db_alert
+
+
+async def delete_alert_async(db: AsyncSession, alert_id: int, user_id: int) -> bool:
+    db_alert = await get_alert_async(db, alert_id=alert_id, user_id=user_id)
+    if db_alert:
+        await db.delete(db_alert)
+        await db.commit()
+        return True
+    return False
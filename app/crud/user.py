@@ -1,12 +1,16 @@
 # 文件: app/crud/user.py (最终清理版)
 from typing import Optional
 
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+import asyncio
 import datetime
 import secrets
 
 from .. import models, schemas
 from ..common.dependencies import get_password_hash, verify_password
+from ..common.principal import principal_cache
 
 
 # from ..plans import grant_subscription # <- 已移除未使用的 import
@@ -59,6 +63,8 @@ def create_user(db: Session, user_data: schemas.UserCreate) -> models.User:
 def update_user(db: Session, user: models.User):
     db.add(user)
     db.commit()
+    # 提交之后再失效一次，避免提交前的并发请求把旧数据重新放回缓存
+    principal_cache.invalidate_user(user.id)
     db.refresh(user)
     return user
 
@@ -68,6 +74,7 @@ def delete_user(db: Session, user_id: int):
     if db_obj:
         db.delete(db_obj)
         db.commit()
+        principal_cache.invalidate_user(user_id)
     return db_obj
 
 
@@ -102,3 +109,81 @@ def delete_verification_code(db: Session, email: str):
 def get_user_by_api_token(db: Session, api_token: str) -> Optional[models.User]:
     """通过 API Token 查找用户。"""
     return db.query(models.User).filter(models.User.api_token == api_token).first()
+
+
+# ==========================================================
+#                  异步版本 (AsyncSession)
+# ==========================================================
+# 与上面的同步函数一一对应，供 async def 路由使用。密码哈希/校验 (bcrypt) 是 CPU 密集操作，放到线程中执行，
+# 不阻塞事件循环。
+async def get_user_by_id_async(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    return await db.scalar(select(models.User).where(models.User.id == user_id))
+
+
+async def get_user_by_email_async(db: AsyncSession, email: str) -> Optional[models.User]:
+    return await db.scalar(select(models.User).where(models.User.email == email))
+
+
+async def get_user_by_username_async(db: AsyncSession, username: str) -> Optional[models.User]:
+    return await db.scalar(select(models.User).where(models.User.username == username))
+
+
+async def get_user_by_api_token_async(db: AsyncSession, api_token: str) -> Optional[models.User]:
+    return await db.scalar(select(models.User).where(models.User.api_token == api_token))
+
+
+async def create_user_async(db: AsyncSession, user_data: schemas.UserCreate) -> models.User:
+    hashed_password = await asyncio.to_thread(get_password_hash, user_data.password)
+    db_user = models.User(
+        username=user_data.username or user_data.email,
+        email=user_data.email,
+        hashed_password=hashed_password,
+        api_token=f"ldst_free_{secrets.token_urlsafe(24)}",
+        plan="freemium"
+    )
+    db.add(db_user)
+    return db_user
+
+
+async def update_user_async(db: AsyncSession, user: models.User) -> models.User:
+    db.add(user)
+    await db.commit()
+    principal_cache.invalidate_user(user.id)
+    await db.refresh(user)
+    return user
+
+
+async def delete_user_async(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    db_obj = await db.get(models.User, user_id)
+    if db_obj:
+        await db.delete(db_obj)
+        await db.commit()
+        principal_cache.invalidate_user(user_id)
+    return db_obj
+
+
+async def authenticate_user_async(db: AsyncSession, email: str, password: str) -> Optional[models.User]:
+    user = await get_user_by_email_async(db, email=email)
+    if not user or not await asyncio.to_thread(verify_password, password, user.hashed_password):
+        return None
+    return user
+
+
+async def create_or_update_verification_code_async(db: AsyncSession, email: str, code: str,
+                                                   expires: datetime.datetime) -> models.VerificationCode:
+    code_obj = await get_verification_code_async(db, email=email)
+    if code_obj:
+        code_obj.code = code
+        code_obj.expires_at = expires
+    else:
+        code_obj = models.VerificationCode(email=email, code=code, expires_at=expires)
+    db.add(code_obj)
+    return code_obj
+
+
+async def get_verification_code_async(db: AsyncSession, email: str) -> Optional[models.VerificationCode]:
+    return await db.scalar(select(models.VerificationCode).where(models.VerificationCode.email == email))
+
+
+async def delete_verification_code_async(db: AsyncSession, email: str):
+    await db.execute(delete(models.VerificationCode).where(models.VerificationCode.email == email))
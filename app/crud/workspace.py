@@ -1,97 +1,129 @@
 # 文件: app/crud/workspace.py (最终版)
 
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
 from .. import models
 from typing import List, Optional
 from ..services import stock_data
-import asyncio
+from ..services.indicator_service import validate_custom_definition
+from ..services.workspace_stream import validate_group_definition, workspace_streams
 
-def get_workspace(db: Session, workspace_id: int, user_id: int) -> Optional[models.MonitorWorkspace]:
-    return db.query(models.MonitorWorkspace).filter(
+def definition_formula_count(definition) -> int:
+    formulas = definition.get('formulas') if isinstance(definition, dict) else None
+    return len(formulas) if isinstance(formulas, dict) else 0
+
+# 工作区 CRUD 均基于 AsyncSession。异步会话不能隐式懒加载，工作区查询一律用 selectinload 预加载 entities。
+def _workspace_query(workspace_id: int, user_id: int):
+    return select(models.MonitorWorkspace).options(selectinload(models.MonitorWorkspace.entities)).where(
         models.MonitorWorkspace.id == workspace_id,
         models.MonitorWorkspace.user_id == user_id
-    ).first()
+    )
+
+async def get_workspace_async(db: AsyncSession, workspace_id: int, user_id: int) -> Optional[models.MonitorWorkspace]:
+    return await db.scalar(_workspace_query(workspace_id, user_id))
+
+async def get_workspaces_by_user_async(db: AsyncSession, user_id: int) -> List[models.MonitorWorkspace]:
+    result = await db.scalars(
+        select(models.MonitorWorkspace).options(selectinload(models.MonitorWorkspace.entities))
+        .where(models.MonitorWorkspace.user_id == user_id).order_by(models.MonitorWorkspace.id))
+    return list(result)
 
-def get_workspaces_by_user(db: Session, user_id: int) -> List[models.MonitorWorkspace]:
-    return db.query(models.MonitorWorkspace).filter(models.MonitorWorkspace.user_id == user_id).order_by(
-        models.MonitorWorkspace.id).all()
+async def count_workspaces_async(db: AsyncSession, user_id: int) -> int:
+    return await db.scalar(
+        select(func.count(models.MonitorWorkspace.id)).where(models.MonitorWorkspace.user_id == user_id)) or 0
 
-def create_workspace(db: Session, name: str, user_id: int) -> models.MonitorWorkspace:
+async def create_workspace_async(db: AsyncSession, name: str, user_id: int) -> models.MonitorWorkspace:
     db_workspace = models.MonitorWorkspace(name=name, user_id=user_id)
     db.add(db_workspace)
-    db.commit()
-    db.refresh(db_workspace)
-    return db_workspace
+    await db.commit()
+    # 重新查询一次，带上 (空的) entities 供响应序列化
+    return await get_workspace_async(db, workspace_id=db_workspace.id, user_id=user_id)
 
-def update_workspace_name(db: Session, workspace_id: int, user_id: int, new_name: str) -> Optional[models.MonitorWorkspace]:
-    db_workspace = get_workspace(db, workspace_id=workspace_id, user_id=user_id)
+async def update_workspace_name_async(db: AsyncSession, workspace_id: int, user_id: int,
+                                      new_name: str) -> Optional[models.MonitorWorkspace]:
+    db_workspace = await get_workspace_async(db, workspace_id=workspace_id, user_id=user_id)
     if db_workspace:
         db_workspace.name = new_name
-        db.commit()
-        db.refresh(db_workspace)
+        await db.commit()
     return db_workspace
 
-def delete_workspace(db: Session, workspace_id: int, user_id: int) -> bool:
-    db_workspace = get_workspace(db, workspace_id=workspace_id, user_id=user_id)
+async def delete_workspace_async(db: AsyncSession, workspace_id: int, user_id: int) -> bool:
+    db_workspace = await get_workspace_async(db, workspace_id=workspace_id, user_id=user_id)
     if db_workspace:
-        db.delete(db_workspace)
-        db.commit()
+        await db.delete(db_workspace)
+        await db.commit()
+        workspace_streams.invalidate(workspace_id)
         return True
     return False
 
-def create_workspace_entity(
-    db: Session, workspace_id: int, entity_type: str, name: str, definition: dict
+async def count_custom_formulas_async(db: AsyncSession, user_id: int, exclude_entity_id: Optional[int] = None) -> int:
+    """用户所有 CUSTOM 实体中自定义公式的总数 (套餐的 max_custom_indicators 按公式计)。"""
+    query = select(models.WorkspaceEntity.definition).join(models.MonitorWorkspace).where(
+        models.MonitorWorkspace.user_id == user_id,
+        models.WorkspaceEntity.entity_type == 'CUSTOM'
+    )
+    if exclude_entity_id is not None:
+        query = query.where(models.WorkspaceEntity.id != exclude_entity_id)
+    return sum(definition_formula_count(definition) for definition in await db.scalars(query))
+
+async def get_entity_async(db: AsyncSession, entity_id: int, workspace_id: int) -> Optional[models.WorkspaceEntity]:
+    return await db.scalar(select(models.WorkspaceEntity).where(
+        models.WorkspaceEntity.id == entity_id,
+        models.WorkspaceEntity.workspace_id == workspace_id
+    ))
+
+async def create_workspace_entity_async(
+    db: AsyncSession, workspace_id: int, entity_type: str, name: str, definition: dict
 ) -> models.WorkspaceEntity:
     final_name = name
     final_definition = definition.copy()
     if entity_type == 'BASE':
         stock_code = final_definition.get('code')
         if not stock_code: raise ValueError("BASE 类型的实体必须在 definition 中提供 'code'")
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        stock_details = loop.run_until_complete(stock_data.get_stock_details_async(stock_code))
+        stock_details = await stock_data.get_stock_details_async(stock_code)
         if stock_details:
             final_name = stock_details.get('a2', stock_code)
             final_definition['code'] = stock_details.get('a1', stock_code)
         else:
             raise ValueError(f"无法找到股票代码 '{stock_code}' 的有效信息。")
-    max_order = db.query(func.max(models.WorkspaceEntity.display_order)).filter(
-        models.WorkspaceEntity.workspace_id == workspace_id).scalar()
-    display_order = (max_order or 0) + 1
+    elif entity_type == 'GROUP':
+        validate_group_definition(final_definition)
+    elif entity_type == 'CUSTOM':
+        validate_custom_definition(final_definition)
+    max_order = await db.scalar(select(func.max(models.WorkspaceEntity.display_order)).where(
+        models.WorkspaceEntity.workspace_id == workspace_id))
     db_entity = models.WorkspaceEntity(
         workspace_id=workspace_id, entity_type=entity_type, name=final_name,
-        definition=final_definition, display_order=display_order
+        definition=final_definition, display_order=(max_order or 0) + 1
     )
     db.add(db_entity)
-    db.commit()
-    db.refresh(db_entity)
+    await db.commit()
+    await db.refresh(db_entity)
+    workspace_streams.invalidate(workspace_id)
     return db_entity
 
-def update_entity_definition(
-    db: Session, entity_id: int, workspace_id: int, new_name: str, new_definition: dict
+async def update_entity_definition_async(
+    db: AsyncSession, entity_id: int, workspace_id: int, new_name: str, new_definition: dict
 ) -> Optional[models.WorkspaceEntity]:
-    db_entity = db.query(models.WorkspaceEntity).filter(
-        models.WorkspaceEntity.id == entity_id,
-        models.WorkspaceEntity.workspace_id == workspace_id
-    ).first()
+    db_entity = await get_entity_async(db, entity_id=entity_id, workspace_id=workspace_id)
     if db_entity:
+        if db_entity.entity_type == 'GROUP':
+            validate_group_definition(new_definition)
+        elif db_entity.entity_type == 'CUSTOM':
+            validate_custom_definition(new_definition)
         db_entity.name = new_name
         db_entity.definition = new_definition
-        db.commit()
-        db.refresh(db_entity)
+        await db.commit()
+        await db.refresh(db_entity)
+        workspace_streams.invalidate(workspace_id)
     return db_entity
 
-def delete_entity(db: Session, entity_id: int, workspace_id: int) -> bool:
-    db_entity = db.query(models.WorkspaceEntity).filter(
-        models.WorkspaceEntity.id == entity_id,
-        models.WorkspaceEntity.workspace_id == workspace_id
-    ).first()
+async def delete_entity_async(db: AsyncSession, entity_id: int, workspace_id: int) -> bool:
+    db_entity = await get_entity_async(db, entity_id=entity_id, workspace_id=workspace_id)
     if db_entity:
-        db.delete(db_entity)
-        db.commit()
+        await db.delete(db_entity)
+        await db.commit()
+        workspace_streams.invalidate(workspace_id)
         return True
     return False
\ No newline at end of file
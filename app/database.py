@@ -1,6 +1,7 @@
 # 文件: app/database.py (最终修正完整版)
 
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 import os
 from dotenv import load_dotenv
@@ -22,8 +23,29 @@ connect_args = {}
 if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
     connect_args = {"check_same_thread": False}
 
-# 5. 使用加载到的 URL 创建 SQLAlchemy 引擎
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
+# 5. 连接池参数 (MySQL/PostgreSQL 等服务端数据库)。SSE 长连接不占用连接池，
+#    池大小只需覆盖并发的普通 REST 请求；pre_ping 与 recycle 避免使用被服务端断开的空闲连接。
+#    同步与异步引擎各有一个连接池，两者之和为本进程占用数据库连接的上限
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", 5))
+DB_ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+engine_kwargs = {}
+if not SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    engine_kwargs = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+# 6. 使用加载到的 URL 创建 SQLAlchemy 引擎
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args, **engine_kwargs)
 
 # 后续部分保持不变
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -36,4 +58,31 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# 7. 异步引擎 (SQLAlchemy asyncio)，与同步引擎并存，供 async def 路由使用，不占用线程池。
+#    ASYNC_DATABASE_URL 未设置时按 DATABASE_URL 换成对应的异步驱动: SQLite -> aiosqlite, MySQL -> asyncmy
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "mysql": "mysql+asyncmy", "postgresql": "postgresql+asyncpg"}
+
+
+def to_async_url(url: str) -> str:
+    scheme, separator, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme.split("+")[0], scheme) + separator + rest
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(SQLALCHEMY_DATABASE_URL)
+
+async_engine_kwargs = {}
+if engine_kwargs:
+    async_engine_kwargs = {**engine_kwargs, "pool_size": DB_ASYNC_POOL_SIZE, "max_overflow": DB_ASYNC_MAX_OVERFLOW}
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **async_engine_kwargs)
+
+# expire_on_commit=False: 提交后仍可直接读取对象属性 (异步会话中不能隐式懒加载)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
\ No newline at end of file
@@ -3,25 +3,40 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.requests import Request
-from starlette.responses import JSONResponse
 import json
+import os
+import asyncio
 
-from .database import engine, Base
+from .database import engine, async_engine, Base
 from .common.response_model import APIException, ResponseModel
-from .routers import auth, admin, data, monitor, subscription, ai_stock, workspace, stream, notifications
+from .common.serializer import FastJSONResponse
+from .routers import auth, admin, data, monitor, subscription, ai_stock, workspace, stream, notifications, alerts
+from .services.market_hub import market_hub
+from .services.alert_engine import alert_engine
+from .services.workspace_stream import workspace_streams
+from .services.http_client import http_pool
+from .services.hexin_token import hexin_token_provider
+from .services.iwencai_scraper import wencai_scraper
+from .services.iwencai_cache import iwencai_result_cache
+from .services.upstream_limiter import upstream_limiter
+from .common.state_backend import state_backend
+from .services.stock_data import prewarm_secid_cache_async
+from .globals import logger
 
 Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="雷达股眼 (LDSTOCK) API - 最终版",
     version="5.0.0",
-    description="提供了用户认证、数据监控、AI选股以及高级工作区管理等功能。"
+    description="提供了用户认证、数据监控、AI选股以及高级工作区管理等功能。",
+    # 所有 JSON 响应统一走快速编码器 (orjson/msgspec，缺失时回退标准库)
+    default_response_class=FastJSONResponse
 )
 
 @app.exception_handler(APIException)
 async def api_exception_handler(request: Request, exc: APIException):
     content_dict = ResponseModel(code=exc.code, msg=exc.msg, data=None).model_dump()
-    return JSONResponse(status_code=exc.code, content=content_dict)
+    return FastJSONResponse(status_code=exc.code, content=content_dict)
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,6 +56,7 @@ app.include_router(workspace.router, prefix="/api/workspaces", tags=["Workspaces
 app.include_router(stream.router, prefix="/api/stream", tags=["Streaming"])
 
 app.include_router(notifications.router, prefix="/api", tags=["Notifications"])
+app.include_router(alerts.router, prefix="/api/alerts", tags=["Alerts"])
 
 
 @app.get("/", tags=["Default"], response_model=ResponseModel[str])
@@ -57,4 +73,27 @@ async def startup_event():
         if hasattr(route, "methods"):
             route_list.append({"path": route.path, "name": route.name, "methods": sorted(list(route.methods))})
     print(json.dumps(route_list, indent=2))
-    print("="*50 + "\n")
\ No newline at end of file
+    print("="*50 + "\n")
+    await http_pool.start()
+    await market_hub.start()
+    await alert_engine.start()
+    await hexin_token_provider.start()
+    await wencai_scraper.start()
+    if os.getenv("SECID_CACHE_PREWARM", "false").lower() == "true":
+        # 后台预热代码解析缓存，不阻塞启动
+        app.state.secid_prewarm_task = asyncio.create_task(prewarm_secid_cache_async())
+        logger.info("已在后台开始预热代码解析缓存。")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await iwencai_result_cache.close()
+    await wencai_scraper.close()
+    await hexin_token_provider.stop()
+    await alert_engine.stop()
+    await workspace_streams.stop()
+    await market_hub.stop()
+    await http_pool.close()
+    upstream_limiter.shutdown()
+    state_backend.close()
+    await async_engine.dispose()
@@ -1,6 +1,6 @@
 # 文件: app/models.py (最终修正版 - 添加ForeignKey)
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, JSON, ForeignKey  # 导入 ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, JSON, ForeignKey, Float  # 导入 ForeignKey
 from sqlalchemy.orm import relationship
 from .database import Base
 import datetime
@@ -21,6 +21,8 @@ class User(Base):
 
     # 定义关系：一个用户可以拥有多个工作区
     workspaces = relationship("MonitorWorkspace", back_populates="owner")
+    # 删除用户时一并删除其警报
+    alerts = relationship("Alert", back_populates="owner", cascade="all, delete-orphan")
 
 
 class VerificationCode(Base):
@@ -56,4 +58,29 @@ class WorkspaceEntity(Base):
     definition = Column(JSON, nullable=False)
     display_order = Column(Integer, default=0)
 
-    workspace = relationship("MonitorWorkspace", back_populates="entities")
\ No newline at end of file
+    workspace = relationship("MonitorWorkspace", back_populates="entities")
+
+
+class Alert(Base):
+    __tablename__ = "alerts"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    # 东方财富 secid (如 '1.600519')，与行情订阅中心使用的代码一致
+    secid = Column(String(30), index=True, nullable=False)
+    code = Column(String(20), nullable=False)
+    # 标准化行情字段名 (a1..aN，见 /api/data/field-mappings)
+    field = Column(String(10), nullable=False)
+    # 比较方式: > >= < <= crosses crosses_up crosses_down
+    operator = Column(String(20), nullable=False)
+    threshold = Column(Float, nullable=False)
+    # 同一条警报两次触发之间的最短间隔 (秒)
+    cooldown_seconds = Column(Integer, default=300, nullable=False)
+    # 为空时发送到用户的注册邮箱
+    notify_email = Column(String(100), nullable=True)
+    note = Column(String(200), nullable=True)
+    is_active = Column(Boolean, default=True)
+    trigger_count = Column(Integer, default=0, nullable=False)
+    last_triggered_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    owner = relationship("User", back_populates="alerts")
@@ -4,6 +4,7 @@ import datetime
 import secrets
 from typing import Optional
 from . import models
+from .common.principal import principal_cache
 
 UNLIMITED = -1
 
@@ -73,6 +74,7 @@ def grant_subscription(user: models.User, plan_name: str, duration_days: Optiona
         raise ValueError(f"Invalid plan name: {plan_name}")
 
     user.plan = plan_name
+    principal_cache.invalidate_user(user.id)
 
     if duration_days is None:
         user.expires_at = None
@@ -88,20 +90,26 @@ def reset_api_token(user: models.User) -> models.User:
     专门为用户生成一个新的、与其当前套餐匹配的 API Token。
     """
     plan_prefix = "adm" if user.is_superuser else user.plan[:4]
+    # 旧 Token 必须立即失效，不能等缓存过期
+    principal_cache.invalidate_user(user.id)
     user.api_token = f"ldst_{plan_prefix}_{secrets.token_urlsafe(24)}"
     return user
 
 
+def effective_plan(plan: str, is_superuser: bool, expires_at: Optional[datetime.datetime]) -> str:
+    """应用套餐限制后的有效套餐：管理员为 admin，过期的付费套餐降级为 freemium。"""
+    if is_superuser:
+        return "admin"
+    if expires_at and expires_at < datetime.datetime.utcnow():
+        return "freemium"
+    return plan
+
+
 def apply_plan_limits(user: models.User) -> models.User:
     """
     检查并应用用户的套餐限制。
     如果套餐过期，只更新 plan 字段，不再触碰 token。
     """
-    if user.is_superuser and user.plan != "admin":
-        user.plan = "admin"
-
-    if user.expires_at and user.expires_at < datetime.datetime.utcnow() and not user.is_superuser:
-        # 套餐过期，降级到免费版
-        user.plan = "freemium"
-
+    # 管理员统一为 admin；套餐过期降级到免费版
+    user.plan = effective_plan(user.plan, user.is_superuser, user.expires_at)
     return user
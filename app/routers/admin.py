@@ -1,16 +1,22 @@
 # 文件: app/routers/admin.py (最终修正版 - 兼容原有代码)
 
+import asyncio
 from fastapi import APIRouter, Depends, status
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Set
 
 from .. import schemas, crud, models, plans  # 确保导入了 plans
 from ..database import get_db
 from ..common.dependencies import get_current_active_superuser
 from ..common.response_model import ResponseModel, APIException
+from ..services.alert_engine import alert_engine
+from ..services.history_fetcher import backfill_history
 
 router = APIRouter(dependencies=[Depends(get_current_active_superuser)])
 
+# 进行中的历史K线回填任务 (保留引用，避免任务被垃圾回收)
+_backfill_tasks: Set[asyncio.Task] = set()
+
 
 # 定义一个辅助函数，专门用于为用户对象附加完整的权限信息
 # 这是一个好的实践，可以避免在多个地方重复代码
@@ -81,6 +87,9 @@ def update_user_status(user_id: int, user_in: schemas.UserStatusUpdate, db: Sess
 
     user.is_active = user_in.is_active
     updated_user = crud.update_user(db, user)
+    if not updated_user.is_active:
+        # 停用用户的警报立即停止；重新启用后由警报引擎的定期重新加载恢复
+        alert_engine.remove_user(user_id)
 
     return ResponseModel(data=enrich_user_with_permissions(updated_user))
 
@@ -96,4 +105,18 @@ def delete_user_route(user_id: int, db: Session = Depends(get_db)):
         raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="不能删除管理员账户")
 
     crud.delete_user(db, user_id=user_id)
-    return ResponseModel(msg=f"User (ID: {user_id}) deleted successfully")
\ No newline at end of file
+    alert_engine.remove_user(user_id)
+    return ResponseModel(msg=f"User (ID: {user_id}) deleted successfully")
+
+
+@router.post("/history/backfill", response_model=ResponseModel)
+async def start_history_backfill(request: schemas.HistoryBackfillRequest):
+    """在后台回填本地K线库 (日线)，与下载接口共享同一套按市场限流；完成情况见服务日志。"""
+    codes = list(dict.fromkeys(code.strip() for code in request.codes if code.strip()))
+    if not codes:
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="请至少提供一个股票代码")
+
+    task = asyncio.create_task(backfill_history(codes, request.start_date, request.end_date, request.adjust))
+    _backfill_tasks.add(task)
+    task.add_done_callback(_backfill_tasks.discard)
+    return ResponseModel(msg=f"已在后台开始回填 {len(codes)} 个代码的历史K线")
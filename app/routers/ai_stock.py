@@ -1,15 +1,18 @@
 # 文件: app/routers/ai_stock.py (最终修复版)
 
-from fastapi import APIRouter, Request, Depends, status
+import asyncio
+from fastapi import APIRouter, Request, Depends, Query, status
 from fastapi.responses import StreamingResponse, Response
-import json
-import time
-from typing import Dict
+from typing import Optional
 
-from ..models import User
-from ..common.dependencies import get_user_from_header_or_query
-from ..services.iwencai_scraper import IWenCaiScraper, ScraperException
+from ..common.dependencies import get_stream_user_from_header_or_query
+from ..common.principal import Principal
+from ..services.iwencai_scraper import wencai_scraper, ScraperException
+from ..services.iwencai_cache import iwencai_result_cache
+from ..services.iwencai_columnar import ColumnarEncoder, parse_fields, project_rows
 from ..common.response_model import APIException
+from ..common.serializer import sse_event
+from ..common.state_backend import state_backend
 from ..globals import logger
 
 # ==========================================================
@@ -22,44 +25,30 @@ router = APIRouter()
 
 
 # --- 权限与速率限制逻辑 ---
-user_last_request: Dict[int, float] = {}
+# 每个套餐两次请求之间的最短间隔 (秒)，以容量为 1 的令牌桶实现，经状态后端在各 worker 之间共享
+RATE_LIMIT_SECONDS = {"pro": 5, "master": 5, "freemium": 500}
+RATE_LIMIT_MESSAGES = {
+    "freemium": "免费版用户请求频率受限，请在 {seconds} 秒后重试。",
+}
 
 
-def check_permissions(user: User):
+async def check_permissions(user: Principal):
     """
     检查用户的AI选股权限和速率限制。
     """
     if user.is_superuser:
         return
 
-    if user.plan in ["pro", "master"]:
-        # 对 Pro 和 Master 用户应用一个宽松的速率限制
-        RATE_LIMIT_SECONDS = 5
-        user_id = user.id
-        current_time = time.time()
-        last_request_time = user_last_request.get(user_id, 0)
-        if current_time - last_request_time < RATE_LIMIT_SECONDS:
-            seconds_to_wait = int(RATE_LIMIT_SECONDS - (current_time - last_request_time))
+    rate_limit_seconds = RATE_LIMIT_SECONDS.get(user.plan)
+    if rate_limit_seconds is not None:
+        wait = await asyncio.to_thread(state_backend.take_token, f"ai_stock:{user.id}",
+                                       capacity=1, refill_per_second=1 / rate_limit_seconds)
+        if wait > 0:
+            template = RATE_LIMIT_MESSAGES.get(user.plan, "请求过于频繁，请在 {seconds} 秒后重试。")
             raise APIException(
                 code=status.HTTP_429_TOO_MANY_REQUESTS,
-                msg=f"请求过于频繁，请在 {seconds_to_wait} 秒后重试。"
+                msg=template.format(seconds=int(wait))
             )
-        user_last_request[user_id] = current_time
-        return
-
-    elif user.plan == "freemium":
-        # 对免费版用户应用严格的速率限制
-        RATE_LIMIT_SECONDS = 500
-        user_id = user.id
-        current_time = time.time()
-        last_request_time = user_last_request.get(user_id, 0)
-        if current_time - last_request_time < RATE_LIMIT_SECONDS:
-            seconds_to_wait = int(RATE_LIMIT_SECONDS - (current_time - last_request_time))
-            raise APIException(
-                code=status.HTTP_429_TOO_MANY_REQUESTS,
-                msg=f"免费版用户请求频率受限，请在 {seconds_to_wait} 秒后重试。"
-            )
-        user_last_request[user_id] = current_time
         return
 
     raise APIException(
@@ -79,40 +68,60 @@ async def stream_query(
         request: Request,
         question: str,
         secondary_intent: str,
-        current_user: User = Depends(get_user_from_header_or_query)
+        limit: Optional[int] = Query(None, ge=1, description="只返回前 N 行，凑够后不再抓取后续分页"),
+        output_format: str = Query("rows", alias="format",
+                                   description="输出格式: rows(每行一个对象) 或 columnar(表头帧+值数组)"),
+        fields: Optional[str] = Query(None, description="只返回这些列，逗号分隔；可用原始列名或去掉日期后的列名"),
+        current_user: Principal = Depends(get_stream_user_from_header_or_query)
 ):
+    """
+    以 SSE 流返回问财选股结果。
+
+    format=columnar 时先发送 type=header 帧 (规范化列名、原始列名与类型)，
+    之后每页发送 type=rows 帧，行为按 header 列顺序排列的值数组，可显著减小大结果集的体积。
+    """
+    if output_format not in ("rows", "columnar"):
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="format 只能是 rows 或 columnar。")
+    projection = parse_fields(fields)
+
     try:
-        check_permissions(current_user)
+        await check_permissions(current_user)
     except APIException as e:
         async def error_stream(error_message: str):
-            error_payload = json.dumps({'message': error_message})
-            yield f"event: error\ndata: {error_payload}\n\n"
+            yield sse_event({'message': error_message}, event="error")
 
         return StreamingResponse(error_stream(e.detail), media_type="text/event-stream")
 
-    scraper = IWenCaiScraper()
+    scraper = wencai_scraper
 
     async def event_generator():
+        columnar = ColumnarEncoder(projection) if output_format == "columnar" else None
         try:
             data_found = False
-            async for data_chunk in scraper.fetch_data_stream(question, secondary_intent):
+            # 相同查询共享一次抓取，命中缓存时按原分页顺序重放
+            results = iwencai_result_cache.stream(
+                question, secondary_intent,
+                lambda: scraper.fetch_data_stream(question, secondary_intent, limit=limit), limit=limit)
+            async for data_chunk in results:
                 if await request.is_disconnected():
                     logger.warning(f"客户端 {current_user.email} 断开连接，停止发送 AI 数据流。")
                     break
                 if data_chunk:
                     data_found = True
-                    yield f"data: {json.dumps(data_chunk, ensure_ascii=False)}\n\n"
+                    if columnar is not None:
+                        for frame in columnar.encode(data_chunk):
+                            yield sse_event(frame)
+                    else:
+                        yield sse_event(project_rows(data_chunk, projection))
 
             done_message = "Stream completed successfully." if data_found else "抱歉，未能根据您的条件找到匹配结果。"
-            yield f"event: done\ndata: {json.dumps({'message': done_message})}\n\n"
+            yield sse_event({'message': done_message}, event="done")
 
         except ScraperException as e:
             logger.error(f"AI 选股服务失败: {e.message}")
-            error_payload = json.dumps({'message': e.message})
-            yield f"event: error\ndata: {error_payload}\n\n"
+            yield sse_event({'message': e.message}, event="error")
         except Exception as e:
             logger.error(f"AI 选股流式查询时发生未知错误: {e}", exc_info=True)
-            error_payload = json.dumps({'message': "查询时发生未知服务器内部错误，请稍后重试。"})
-            yield f"event: error\ndata: {error_payload}\n\n"
+            yield sse_event({'message': "查询时发生未知服务器内部错误，请稍后重试。"}, event="error")
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
\ No newline at end of file
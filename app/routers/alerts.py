@@ -0,0 +1,111 @@
+# 文件: app/routers/alerts.py
+
+from fastapi import APIRouter, Depends, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+
+from .. import schemas, crud, models, plans
+from ..database import get_async_db
+from ..common.dependencies import get_user_from_header_or_query
+from ..common.principal import Principal
+from ..common.response_model import ResponseModel, APIException
+from ..services.alert_engine import alert_engine, AlertRule, ALERT_OPERATORS, NUMERIC_FIELDS
+from ..services.stock_data import find_market_info_async
+
+router = APIRouter(
+    tags=["Alerts"],
+    dependencies=[Depends(get_user_from_header_or_query)]
+)
+
+
+def _check_rule(operator: str = None, field: str = None, cooldown_seconds: int = None):
+    if operator is not None and operator not in ALERT_OPERATORS:
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg=f"operator 只能是: {', '.join(ALERT_OPERATORS)}")
+    if field is not None and field not in NUMERIC_FIELDS:
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg=f"字段 {field} 不存在或不是数值字段")
+    if cooldown_seconds is not None and cooldown_seconds < 0:
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="cooldown_seconds 不能为负数")
+
+
+# 这些列不可为空；PUT 中显式传 null 视为非法而不是“清空”
+NON_NULLABLE_UPDATE_FIELDS = ("operator", "threshold", "cooldown_seconds", "is_active")
+
+
+async def _check_quota(db: AsyncSession, user: Principal):
+    user_plan_config = plans.PLANS_CONFIG.get(user.plan, plans.PLANS_CONFIG["freemium"])
+    max_alerts = user_plan_config.get('max_alerts', 1)
+    if max_alerts != plans.UNLIMITED and await crud.alert.count_active_alerts_async(db, user_id=user.id) >= max_alerts:
+        raise APIException(code=status.HTTP_403_FORBIDDEN, msg=f"已达到最大警报数量限制 ({max_alerts}个)。")
+
+
+def _sync_engine(alert: models.Alert, user: Principal):
+    # 引擎的订阅变更必须在事件循环线程中进行，因此修改警报的路由都是 async 的
+    if alert.is_active:
+        alert_engine.upsert(AlertRule.from_model(alert, user.email))
+    else:
+        alert_engine.remove(alert.id)
+
+
+@router.post("/", response_model=ResponseModel[schemas.AlertOut])
+async def create_alert(
+    alert_in: schemas.AlertCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
+):
+    """创建一条行情警报，如 a3 > 5 (最新价高于 5) 或 a3 crosses 1800。"""
+    _check_rule(alert_in.operator, alert_in.field, alert_in.cooldown_seconds)
+    await _check_quota(db, current_user)
+    code = alert_in.code.strip().upper()
+    secid = await find_market_info_async(code)
+    if not secid:
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg=f"无法找到股票代码 '{code}' 的有效信息。")
+    alert = await crud.alert.create_alert_async(
+        db, user_id=current_user.id, secid=secid, code=code, field=alert_in.field, operator=alert_in.operator,
+        threshold=alert_in.threshold, cooldown_seconds=alert_in.cooldown_seconds,
+        notify_email=alert_in.notify_email, note=alert_in.note
+    )
+    _sync_engine(alert, current_user)
+    return ResponseModel(data=alert, msg="警报创建成功")
+
+
+@router.get("/", response_model=ResponseModel[List[schemas.AlertOut]])
+async def list_alerts(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
+):
+    return ResponseModel(data=await crud.alert.get_alerts_by_user_async(db, user_id=current_user.id))
+
+
+@router.put("/{alert_id}", response_model=ResponseModel[schemas.AlertOut])
+async def update_alert(
+    alert_id: int,
+    alert_in: schemas.AlertUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
+):
+    """修改阈值、比较方式、去抖间隔或启用状态。"""
+    alert = await crud.alert.get_alert_async(db, alert_id=alert_id, user_id=current_user.id)
+    if not alert:
+        raise APIException(code=status.HTTP_404_NOT_FOUND, msg="警报不存在或无权访问")
+    changes = alert_in.model_dump(exclude_unset=True)
+    null_fields = [key for key in NON_NULLABLE_UPDATE_FIELDS if key in changes and changes[key] is None]
+    if null_fields:
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg=f"{', '.join(null_fields)} 不能为 null")
+    _check_rule(changes.get('operator'), None, changes.get('cooldown_seconds'))
+    if changes.get('is_active') and not alert.is_active:
+        await _check_quota(db, current_user)
+    alert = await crud.alert.update_alert_async(db, alert_id=alert_id, user_id=current_user.id, changes=changes)
+    _sync_engine(alert, current_user)
+    return ResponseModel(data=alert, msg="警报更新成功")
+
+
+@router.delete("/{alert_id}", response_model=ResponseModel)
+async def delete_alert(
+    alert_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
+):
+    if not await crud.alert.delete_alert_async(db, alert_id=alert_id, user_id=current_user.id):
+        raise APIException(code=status.HTTP_404_NOT_FOUND, msg="警报不存在或无权访问")
+    alert_engine.remove(alert_id)
+    return ResponseModel(msg="警报已删除")
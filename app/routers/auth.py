@@ -2,19 +2,20 @@
 
 from fastapi import APIRouter, Depends, status, BackgroundTasks
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import random
 import datetime
 
 from .. import schemas, crud, models, plans
-from ..database import get_db
+from ..database import get_async_db
 # 确保导入了正确的依赖
 from ..common.dependencies import create_access_token, create_refresh_token, get_current_active_user, \
-    get_user_from_header_or_query
+    get_user_from_header_or_query, load_user_async
+from ..common.principal import Principal
 from ..common.response_model import ResponseModel, APIException
-from ..globals import fm, logger
+from ..globals import logger
+from ..services.mailer import send_email_task
 from fastapi_mail import MessageSchema
-from aiosmtplib.errors import SMTPResponseException
 
 router = APIRouter()
 
@@ -44,26 +45,16 @@ def get_full_user_response_data(user: models.User) -> dict:
     return response_data
 
 
-async def send_email_task(message: MessageSchema):
-    """后台发送邮件的任务"""
-    try:
-        await fm.send_message(message)
-        logger.info(f"邮件已成功投递到 SMTP 服务器: 主题='{message.subject}', 收件人={message.recipients}")
-    except SMTPResponseException as e:
-        logger.warning(f"邮件发送后关闭连接时出现SMTP响应异常 (通常无害): {e}")
-    except Exception as e:
-        logger.error(f"发送邮件时发生严重错误: {e}", exc_info=True)
-
-
 @router.post("/send-registration-code", response_model=ResponseModel)
-async def send_code(req: schemas.SendCodeRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+async def send_code(req: schemas.SendCodeRequest, background_tasks: BackgroundTasks,
+                    db: AsyncSession = Depends(get_async_db)):
     """发送注册验证码"""
-    if crud.get_user_by_email(db, email=req.email):
+    if await crud.get_user_by_email_async(db, email=req.email):
         raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="该邮箱已注册")
     code = f"{random.randint(0, 999999):06d}"
     expires = datetime.datetime.utcnow() + datetime.timedelta(minutes=10)
-    crud.create_or_update_verification_code(db, req.email, code, expires)
-    db.commit()
+    await crud.create_or_update_verification_code_async(db, req.email, code, expires)
+    await db.commit()
     message = MessageSchema(
         subject="【雷达股眼】您的注册验证码",
         recipients=[req.email],
@@ -76,30 +67,30 @@ async def send_code(req: schemas.SendCodeRequest, background_tasks: BackgroundTa
 
 
 @router.post("/register", response_model=ResponseModel[schemas.UserInfo])
-def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
     """用户注册 (返回基础信息即可，无需修改)"""
-    code_obj = crud.get_verification_code(db, email=user_data.email)
+    code_obj = await crud.get_verification_code_async(db, email=user_data.email)
     if not code_obj or code_obj.code != user_data.verification_code or code_obj.expires_at < datetime.datetime.utcnow():
         raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="验证码错误或已过期")
-    if crud.get_user_by_username(db, username=user_data.email):
+    if await crud.get_user_by_username_async(db, username=user_data.email):
         raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="该邮箱已被注册")
-    new_user = crud.create_user(db, user_data)
-    crud.delete_verification_code(db, user_data.email)
-    db.commit()
-    db.refresh(new_user)
+    new_user = await crud.create_user_async(db, user_data)
+    await crud.delete_verification_code_async(db, user_data.email)
+    await db.commit()
+    await db.refresh(new_user)
     return ResponseModel(data=new_user)
 
 
 @router.post("/token", response_model=ResponseModel[schemas.Token])
-def login_for_token(db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_for_token(db: AsyncSession = Depends(get_async_db), form_data: OAuth2PasswordRequestForm = Depends()):
     """用户登录获取Token"""
-    user = crud.authenticate_user(db, email=form_data.username, password=form_data.password)
+    user = await crud.authenticate_user_async(db, email=form_data.username, password=form_data.password)
     if not user: raise APIException(code=status.HTTP_401_UNAUTHORIZED, msg="邮箱或密码错误")
     if not user.is_active: raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="账户已被禁用")
 
     # 确保 apply_plan_limits 被调用，以获得最新plan（处理管理员和过期降级）
     user = plans.apply_plan_limits(user)
-    crud.update_user(db, user=user)  # 更新数据库中的plan（如果已降级）
+    await crud.update_user_async(db, user=user)  # 更新数据库中的plan（如果已降级）
 
     token_data = {"user_id": user.id}
     access_token = create_access_token(data=token_data)
@@ -117,7 +108,7 @@ def login_for_token(db: Session = Depends(get_db), form_data: OAuth2PasswordRequ
 
 
 @router.get("/me", response_model=ResponseModel[schemas.UserOut])
-def read_me(current_user: models.User = Depends(get_user_from_header_or_query)):
+async def read_me(current_user: Principal = Depends(get_user_from_header_or_query)):
     """获取当前登录用户的完整信息（包括权限）"""
     # 【重要修改】使用辅助函数创建完整的响应数据，并用 UserOut 模型进行验证和序列化
     full_user_info = get_full_user_response_data(current_user)
@@ -125,10 +116,11 @@ def read_me(current_user: models.User = Depends(get_user_from_header_or_query)):
 
 
 @router.post("/me/reset-api-token", response_model=ResponseModel[schemas.UserOut])
-def reset_api_token_route(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)):
+async def reset_api_token_route(db: AsyncSession = Depends(get_async_db),
+                                current_user: Principal = Depends(get_current_active_user)):
     """重置用户的API Token"""
-    updated_user = plans.reset_api_token(current_user)
-    crud.update_user(db, user=updated_user)
+    updated_user = plans.reset_api_token(await load_user_async(db, current_user))
+    await crud.update_user_async(db, user=updated_user)
     logger.info(f"用户 {current_user.email} 成功重置了 API Token。")
 
     # 【重要修改】确保返回的也是包含完整权限的用户信息
@@ -1,14 +1,18 @@
 # 文件: app/routers/data.py
 
 from fastapi import APIRouter, Depends, Query, status
+from fastapi.responses import StreamingResponse
 from typing import Dict, List, Any
-import asyncio
 
+from .. import plans, schemas
 from ..common.response_model import ResponseModel, APIException
-from ..common.dependencies import get_user_from_header_or_query
-from ..services import get_field_mappings, get_historical_data_as_json
+from ..common.dependencies import get_user_from_header_or_query, get_stream_user_from_header_or_query
+from ..common.principal import Principal
+from ..services import get_field_mappings
+from ..services.history_fetcher import fetch_history_batch, describe_failures
+from ..services.history_export import EXPORT_FORMATS, arrow_available, stream_history
+from ..services.indicator_service import compute_indicator_frame
 from ..globals import logger
-from ..models import User
 
 # 核心修改：APIRouter() 不再包含 prefix
 router = APIRouter()
@@ -30,21 +34,75 @@ async def download_historical_data(
         codes: str = Query(..., description="股票代码，多个用逗号分隔"),
         start_date: str = Query(..., description="开始日期 (YYYY-MM-DD)"),
         end_date: str = Query(..., description="结束日期 (YYYY-MM-DD)"),
-        period: str = Query("daily", description="数据周期: daily, weekly, monthly"),
+        period: str = Query("daily", description="数据周期: daily, weekly, monthly, quarterly, trading_weekly 或 N 分钟 (如 5、10、120)"),
         adjust: str = Query("qfq", description="复权方式: qfq(前复权), hfq(后复权), none(不复权)"),
-        current_user: User = Depends(get_user_from_header_or_query)
+        output_format: str = Query("json", alias="format",
+                                   description="输出格式: json(默认), ndjson, csv, arrow (后三者为流式导出)"),
+        current_user: Principal = Depends(get_stream_user_from_header_or_query)
 ):
-    """下载指定股票代码的历史K线数据。"""
+    """
+    下载指定股票代码的历史K线数据。
+
+    format 为 ndjson/csv/arrow 时以流的方式逐代码返回，每个代码的数据就绪后立即发送，
+    多代码长区间导出的内存占用与代码数量无关。
+    """
+    if output_format != "json":
+        if output_format not in EXPORT_FORMATS:
+            raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="format 只能是 json、ndjson、csv 或 arrow。")
+        if output_format == "arrow" and not arrow_available():
+            raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="服务器未安装 pyarrow，暂不支持 arrow 格式导出。")
+        code_list = [code.strip() for code in codes.split(',') if code.strip()]
+        media_type, extension = EXPORT_FORMATS[output_format]
+        return StreamingResponse(
+            stream_history(code_list, start_date, end_date, adjust, period, output_format),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="history.{extension}"'},
+        )
+
     try:
         code_list = [code.strip() for code in codes.split(',') if code.strip()]
-        tasks = [get_historical_data_as_json(code, start_date, end_date, adjust, period) for code in code_list]
-        results = await asyncio.gather(*tasks)
+        # 按市场限流的批量获取；个别代码失败不影响其他代码，失败明细放在 msg 中
+        frames, failures = await fetch_history_batch(code_list, start_date, end_date, adjust, period)
 
         all_data = []
-        for res in results:
-            if res and res.get('data'):
-                all_data.extend(res['data'])
+        for df in frames.values():
+            all_data.extend(df.to_dict(orient='records'))
+        if failures:
+            logger.warning(f"下载历史数据部分失败: {failures}")
+            return ResponseModel(msg=describe_failures(failures), data=all_data)
         return ResponseModel(data=all_data)
     except Exception as e:
         logger.error(f"下载历史数据失败: {e}", exc_info=True)
-        raise APIException(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg="获取历史数据失败")
\ No newline at end of file
+        raise APIException(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg="获取历史数据失败")
+
+
+def check_custom_indicator_quota(user: Principal, formula_count: int):
+    """自定义公式数量受套餐的 max_custom_indicators 限制。"""
+    plan_config = plans.PLANS_CONFIG.get(user.plan, plans.PLANS_CONFIG["freemium"])
+    limit = plan_config.get("max_custom_indicators", 1)
+    if limit != plans.UNLIMITED and formula_count > limit:
+        raise APIException(code=status.HTTP_403_FORBIDDEN, msg=f"当前套餐最多使用 {limit} 个自定义指标。")
+
+
+@router.post("/indicators", response_model=ResponseModel[Dict[str, Any]])
+async def calculate_indicators(
+        request: schemas.IndicatorRequest,
+        current_user: Principal = Depends(get_user_from_header_or_query)
+):
+    """
+    在服务端计算技术指标，返回每根K线的行情与指标值 (尚未形成的值为 null)。
+
+    内置指标: MA、EMA、MACD、RSI、KDJ、BOLL，写作 "名称:参数1:参数2"，参数可省略；
+    自定义公式可引用 OPEN/HIGH/LOW/CLOSE/VOLUME/AMOUNT 与实时字段 a1..aN。
+    同一序列的后续请求只对新增K线做增量计算。
+    """
+    check_custom_indicator_quota(current_user, len(request.formulas))
+    try:
+        rows, market, message = await compute_indicator_frame(
+            request.code, request.start_date, request.end_date, request.adjust, request.period,
+            request.indicators, request.formulas)
+    except ValueError as e:
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg=str(e))
+    if rows is None:
+        raise APIException(code=status.HTTP_404_NOT_FOUND, msg=message)
+    return ResponseModel(data={"market": market, "code": request.code.strip(), "rows": rows})
@@ -1,25 +1,22 @@
 # 文件: app/routers/monitor.py (最终修正版)
 
-import asyncio
-import json
 import datetime
-import threading
 from fastapi import APIRouter, Request, Query, Depends, status
 
 from fastapi.responses import StreamingResponse
 
-from ..models import User
-from ..common.dependencies import get_user_from_header_or_query
+from ..common.dependencies import get_stream_user_from_header_or_query
+from ..common.principal import Principal
 from ..common.response_model import ResponseModel, APIException
-from ..services.stock_data import get_field_mappings, fetch_stock_data_async, codes_to_market_list_async
+from ..common.serializer import sse_event
+from ..common.state_backend import acquire_connection, active_connections
+from ..services.stock_data import get_field_mappings, codes_to_market_list_async
+from ..services.market_hub import market_hub
+from ..services.quote_cache import quote_cache
+from ..services.market_delta import DeltaFrameEncoder, DEFAULT_KEYFRAME_INTERVAL
 from ..plans import PLANS_CONFIG
 
-# 从全局模块导入 logger 和新添加的状态管理器
-from ..globals import (
-    logger,
-    LAST_KNOWN_GOOD_DATA, LAST_GOOD_DATA_LOCK,
-    ACTIVE_CONNECTIONS, CONNECTION_LOCK
-)
+from ..globals import logger
 
 router = APIRouter()
 
@@ -29,13 +26,23 @@ async def stream_market_data(
         request: Request,
         codes: str = Query(..., description="股票代码，多个用逗号分隔"),
         interval: float = Query(5.0, ge=0.2, description="刷新间隔(秒)"),
-        current_user: User = Depends(get_user_from_header_or_query)
+        protocol: str = Query("full", description="推送协议: full(每帧全量) 或 delta(首帧快照+增量补丁)"),
+        keyframe_interval: int = Query(DEFAULT_KEYFRAME_INTERVAL, ge=1, le=1000,
+                                       description="delta 协议下每隔多少帧发送一次完整快照"),
+        current_user: Principal = Depends(get_stream_user_from_header_or_query)
 ):
-    """通过 Server-Sent Events (SSE) 实时推送市场数据 (融合了健壮性逻辑)。"""
+    """
+    通过 Server-Sent Events (SSE) 实时推送市场数据 (融合了健壮性逻辑)。
+
+    protocol=delta 时，首帧为 type=snapshot 的全量数据，之后为 type=patch 的增量帧
+    (changes: secid -> 变化的 aN 字段, removed: 消失的 secid)，每帧带连续的 seq，
+    并定期插入快照关键帧；客户端发现 seq 不连续时重连即可重新同步。
+    """
+    if protocol not in ("full", "delta"):
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="protocol 只能是 full 或 delta。")
 
     # --- 1. 权限检查升级 ---
     user_plan_config = PLANS_CONFIG.get(current_user.plan, PLANS_CONFIG["freemium"])
-    user_client_id = f"USER_{current_user.id}"
 
     # 检查套餐是否过期 (admin角色豁免)
     # **【已修正】** 使用 is_superuser 替代不存在的 role 字段
@@ -53,17 +60,16 @@ async def stream_market_data(
     if interval < min_interval:
         raise APIException(code=status.HTTP_403_FORBIDDEN, msg=f"请求间隔太快，您的套餐最低允许 {min_interval} 秒。")
 
-    # --- 2. 连接数管理 ---
+    # --- 2. 连接数管理 (租约登记在共享状态后端，多 worker 下按用户整体计数) ---
     max_connections = user_plan_config.get("max_connections", 1)
-    with CONNECTION_LOCK:
-        current_connections = ACTIVE_CONNECTIONS.get(user_client_id, 0)
-        if max_connections != -1 and current_connections >= max_connections:
-            raise APIException(code=status.HTTP_429_TOO_MANY_REQUESTS, msg=f"连接数已达上限 ({max_connections})。")
-        ACTIVE_CONNECTIONS[user_client_id] = current_connections + 1
-        logger.info(
-            f"为用户 {current_user.email} ({current_user.plan} 套餐) 建立连接。当前连接数: {ACTIVE_CONNECTIONS[user_client_id]}")
+    lease = await acquire_connection(current_user.id, max_connections)
+    if lease is None:
+        raise APIException(code=status.HTTP_429_TOO_MANY_REQUESTS, msg=f"连接数已达上限 ({max_connections})。")
+    logger.info(
+        f"为用户 {current_user.email} ({current_user.plan} 套餐) 建立连接。当前连接数: {await active_connections(current_user.id)}")
 
     async def event_generator():
+        lease.start()
         try:
             # --- 3. 增强的用户反馈：处理无效代码 ---
             conversion_result = await codes_to_market_list_async(codes, timeout=interval)
@@ -74,73 +80,92 @@ async def stream_market_data(
                 warning_message = f"注意：以下代码无效或无法识别，已被忽略: {', '.join(invalid_codes)}"
                 payload = {"timestamp": datetime.datetime.utcnow().isoformat(), "data": [], "status": "warning",
                            "message": warning_message}
-                yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                yield sse_event(payload)
 
             if not market_codes_str:
                 if not invalid_codes:
                     info_message = "未提供任何有效代码。"
                     payload = {"timestamp": datetime.datetime.utcnow().isoformat(), "data": [], "status": "info",
                                "message": info_message}
-                    yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                    yield sse_event(payload)
                 return
 
             logger.info(f"SSE 流开始为 {current_user.email} 处理, 市场代码: {market_codes_str}")
 
-            while True:
-                if await request.is_disconnected():
-                    logger.info(f"客户端 {current_user.email} 断开连接。")
-                    break
-
-                # --- 4. 核心健壮性逻辑：获取数据并使用“最后一次成功数据”缓存 ---
-                data_to_send = []
-                try:
-                    processed_data = await fetch_stock_data_async(market_codes_str, timeout=interval)
-                    if processed_data:
-                        with LAST_GOOD_DATA_LOCK:
-                            LAST_KNOWN_GOOD_DATA[market_codes_str] = processed_data
-                        data_to_send = processed_data
-                        status_msg, message = "live", "实时数据"
-                    else:
-                        with LAST_GOOD_DATA_LOCK:
-                            data_to_send = LAST_KNOWN_GOOD_DATA.get(market_codes_str, [])
-                        status_msg, message = "live", "实时数据"
-                        logger.warning(f"上游API为 {market_codes_str} 返回空数据, 已为 {current_user.email} 提供缓存。")
-
-                except Exception as e:
-                    with LAST_GOOD_DATA_LOCK:
-                        data_to_send = LAST_KNOWN_GOOD_DATA.get(market_codes_str, [])
-                    status_msg, message = f"live", f"实时数据"
-                    logger.error(f"获取 {market_codes_str} 数据时发生异常: {e}。已为 {current_user.email} 提供缓存。",
-                                 exc_info=False)
-
-                # --- 5. 丰富的SSE载荷 ---
-                payload = {
-                    "timestamp": datetime.datetime.utcnow().isoformat(),
-                    "data": data_to_send,
-                    "status": status_msg,
-                    "message": message
-                }
-                yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
-
-                await asyncio.sleep(interval)
+            # 由进程级行情中心统一轮询上游，本连接只按自己的间隔接收属于自己代码的数据
+            subscription = market_hub.subscribe(market_codes_str.split(','), interval)
+            delta_encoder = DeltaFrameEncoder(keyframe_interval) if protocol == "delta" else None
+            try:
+                while True:
+                    if await request.is_disconnected():
+                        logger.info(f"客户端 {current_user.email} 断开连接。")
+                        break
+                    if lease.lost:
+                        yield sse_event({'message': f"连接数已达上限 ({max_connections})，连接已关闭。", 'status': 'error'},
+                                        event="error")
+                        break
+
+                    # --- 4. 核心健壮性逻辑：获取数据并使用“最后一次成功数据”缓存 ---
+                    # 行情中心已按代码补齐本轮缺失的行；整帧为空 (超时或上游全部失败) 时，
+                    # 从按 secid 缓存的最后一次成功数据中逐条组装兜底帧
+                    data_to_send = []
+                    stale_fields = {"stale": False}
+                    frame = None
+                    try:
+                        frame = await subscription.next_frame()
+                        processed_data = frame.rows
+                        if processed_data:
+                            data_to_send = processed_data
+                            stale_fields = frame.stale_fields()
+                            status_msg, message = "live", "实时数据"
+                        else:
+                            data_to_send, stale_fields = _fallback_rows(subscription.secids)
+                            status_msg, message = "live", "实时数据"
+                            logger.warning(f"上游API为 {market_codes_str} 返回空数据, 已为 {current_user.email} 提供缓存。")
+
+                    except Exception as e:
+                        data_to_send, stale_fields = _fallback_rows(subscription.secids)
+                        status_msg, message = f"live", f"实时数据"
+                        logger.error(f"获取 {market_codes_str} 数据时发生异常: {e}。已为 {current_user.email} 提供缓存。",
+                                     exc_info=False)
+
+                    # --- 5. 丰富的SSE载荷 ---
+                    # 实时帧在所有相同代码列表的订阅者之间共享，只编码一次
+                    if delta_encoder is None and frame is not None and data_to_send is frame.rows:
+                        yield frame.sse_bytes(status_msg, message)
+                        continue
+
+                    payload = {
+                        "timestamp": datetime.datetime.utcnow().isoformat(),
+                        "data": data_to_send,
+                        "status": status_msg,
+                        "message": message,
+                        **stale_fields
+                    }
+                    if delta_encoder is not None:
+                        del payload["data"]
+                        payload.update(delta_encoder.encode(data_to_send))
+                    yield sse_event(payload)
+            finally:
+                market_hub.unsubscribe(subscription)
 
         except Exception as e:
             logger.error(f"SSE 流发生严重错误 for {current_user.email}: {e}", exc_info=True)
-            error_payload = json.dumps({'message': f"An error occurred in the stream: {e}", 'status': 'error'})
-            yield f"event: error\ndata: {error_payload}\n\n"
+            yield sse_event({'message': f"An error occurred in the stream: {e}", 'status': 'error'}, event="error")
         finally:
-            # 确保在任何情况下都能减少连接计数
-            with CONNECTION_LOCK:
-                if user_client_id in ACTIVE_CONNECTIONS:
-                    ACTIVE_CONNECTIONS[user_client_id] -= 1
-                    if ACTIVE_CONNECTIONS[user_client_id] <= 0:
-                        del ACTIVE_CONNECTIONS[user_client_id]
+            # 确保在任何情况下都能释放连接租约
+            lease.release()
             logger.info(
-                f"SSE 连接关闭，释放资源: {current_user.email}。剩余连接数: {ACTIVE_CONNECTIONS.get(user_client_id, 0)}")
+                f"SSE 连接关闭，释放资源: {current_user.email}。剩余连接数: {await active_connections(current_user.id)}")
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
+def _fallback_rows(secids):
+    rows, as_of = quote_cache.get_rows(secids)
+    return rows, ({"stale": True, "stale_secids": as_of} if as_of else {"stale": False})
+
+
 @router.get("/config/field-map", response_model=ResponseModel[dict])
 def get_data_field_map():
     """获取监控数据所使用的字段映射。(保持原有结构)"""
@@ -4,12 +4,12 @@ from sqlalchemy.orm import Session
 from fastapi_mail import MessageSchema
 from pydantic import BaseModel, EmailStr
 
-from .. import models
 from ..database import get_db
 from ..common.dependencies import get_current_active_user
+from ..common.principal import Principal
 from ..common.response_model import ResponseModel
 from ..globals import fm, logger
-from ..routers.auth import send_email_task  # 复用 auth.py 的后台任务
+from ..services.mailer import send_email_task
 
 router = APIRouter(
     tags=["Notifications"],
@@ -25,7 +25,7 @@ class TestEmailRequest(BaseModel):
 async def send_test_notification_email(
         req: TestEmailRequest,
         background_tasks: BackgroundTasks,
-        current_user: models.User = Depends(get_current_active_user),
+        current_user: Principal = Depends(get_current_active_user),
 ):
     """发送一封测试警报邮件到指定邮箱。"""
     subject = "【雷达股眼】这是一封测试警报邮件"
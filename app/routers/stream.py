@@ -1,21 +1,92 @@
-# 文件: app/routers/stream.py (简化占位版)
+# 文件: app/routers/stream.py
 
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from .. import models
-from ..database import get_db
-from ..common.dependencies import get_user_by_token_query
-from ..common.response_model import ResponseModel
+import datetime
+from typing import Optional, Set
+from fastapi import APIRouter, Depends, Request, Query, status
+from fastapi.responses import StreamingResponse
+
+from .. import crud
+from ..database import AsyncSessionLocal
+from ..common.dependencies import get_stream_user_by_token_query
+from ..common.principal import Principal
+from ..common.response_model import APIException
+from ..common.serializer import sse_event
+from ..common.state_backend import acquire_connection
+from ..globals import logger
+from ..plans import PLANS_CONFIG
+from ..services.workspace_stream import workspace_streams, entity_codes
 
 router = APIRouter()
 
-@router.get("/monitor/stream/{workspace_id}", response_model=ResponseModel[str])
-async def stream_workspace_data_placeholder(
+
+async def _load_workspace_codes(workspace_id: int, user_id: int) -> Optional[Set[str]]:
+    """在短会话中读取工作区涉及的股票代码，工作区不存在或无权访问时返回 None。会话在推流开始前关闭。"""
+    async with AsyncSessionLocal() as db:
+        workspace = await crud.workspace.get_workspace_async(db, workspace_id=workspace_id, user_id=user_id)
+        if not workspace:
+            return None
+        return {code for entity in workspace.entities for code in entity_codes(entity.entity_type, entity.definition)}
+
+
+@router.get("/monitor/stream/{workspace_id}")
+async def stream_workspace_data(
+    request: Request,
     workspace_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_user_by_token_query)
+    interval: float = Query(5.0, ge=0.2, description="刷新间隔(秒)"),
+    current_user: Principal = Depends(get_stream_user_by_token_query)
 ):
     """
-    监控数据流接口的占位符。
+    工作区实时数据流 (SSE)。一个连接推送工作区内全部实体的实时值：
+    BASE 为行情快照，GROUP 为分组汇总 (涨跌家数、平均/加权涨跌幅、成交额、主力净流入)，
+    CUSTOM 为实体定义中的指标与公式在 "日线历史 + 当日实时K线" 上的最新值。
+
+    事件类型:
+    - entities: 连接建立及实体增删改后推送当前实体列表 (带 version)，客户端据此重建面板，无需重连；
+    - 默认 (message): 每个节拍的数据帧，entities[i].data 为对应实体的计算结果；
+    - closed: 工作区被删除，服务器随后结束连接。
+    同一工作区的所有连接共享一次计算与编码。
     """
-    return ResponseModel(msg="实时监控功能正在开发中，敬请期待。", data=f"请求已收到，来自用户: {current_user.email}，工作区ID: {workspace_id}")
\ No newline at end of file
+    user_plan_config = PLANS_CONFIG.get(current_user.plan, PLANS_CONFIG["freemium"])
+
+    if not current_user.is_superuser and current_user.expires_at and datetime.datetime.utcnow() > current_user.expires_at:
+        raise APIException(code=status.HTTP_403_FORBIDDEN, msg="您的订阅已过期，请续费后使用。")
+
+    min_interval = user_plan_config.get("min_interval", 5)
+    if interval < min_interval:
+        raise APIException(code=status.HTTP_403_FORBIDDEN, msg=f"请求间隔太快，您的套餐最低允许 {min_interval} 秒。")
+
+    codes = await _load_workspace_codes(workspace_id, current_user.id)
+    if codes is None:
+        raise APIException(code=status.HTTP_404_NOT_FOUND, msg="工作区不存在或无权访问")
+
+    max_codes = user_plan_config.get("max_codes", -1)
+    if max_codes != -1 and len(codes) > max_codes:
+        raise APIException(code=status.HTTP_403_FORBIDDEN,
+                           msg=f"工作区涉及的股票代码 ({len(codes)}) 超出套餐允许的最大数量 ({max_codes})。")
+
+    max_connections = user_plan_config.get("max_connections", 1)
+    lease = await acquire_connection(current_user.id, max_connections)
+    if lease is None:
+        raise APIException(code=status.HTTP_429_TOO_MANY_REQUESTS, msg=f"连接数已达上限 ({max_connections})。")
+
+    async def event_generator():
+        feed, viewer = workspace_streams.attach(workspace_id, interval, max_codes)
+        logger.info(f"工作区 {workspace_id} 实时流开始为 {current_user.email} 推送。")
+        lease.start()
+        try:
+            while True:
+                if await request.is_disconnected():
+                    logger.info(f"客户端 {current_user.email} 断开工作区 {workspace_id} 的连接。")
+                    break
+                if lease.lost:
+                    yield sse_event({'message': f"连接数已达上限 ({max_connections})，连接已关闭。"}, event="error")
+                    break
+                for message in await viewer.next_messages(timeout=max(interval * 3, 10.0)):
+                    yield message
+                if viewer.closed:
+                    break
+        finally:
+            workspace_streams.detach(feed, viewer)
+            lease.release()
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
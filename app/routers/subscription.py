@@ -2,10 +2,11 @@
 
 from fastapi import APIRouter, Depends, status
 from sqlalchemy.orm import Session
-from .. import schemas, models, crud, plans
+from .. import schemas, crud, plans
 from ..database import get_db
 # 确保导入了正确的依赖
-from ..common.dependencies import get_current_active_user, get_user_from_header_or_query
+from ..common.dependencies import get_current_active_user, get_user_from_header_or_query, load_user
+from ..common.principal import Principal
 from ..common.response_model import ResponseModel, APIException
 
 router = APIRouter()
@@ -15,7 +16,7 @@ router = APIRouter()
 def upgrade_subscription(
         sub_data: schemas.SubscriptionRequest,
         db: Session = Depends(get_db),
-        current_user: models.User = Depends(get_current_active_user)
+        current_user: Principal = Depends(get_current_active_user)
 ):
     if current_user.is_superuser:
         raise APIException(
@@ -33,7 +34,7 @@ def upgrade_subscription(
     duration_days = duration_info['days']
 
     try:
-        updated_user = plans.grant_subscription(current_user, sub_data.plan, duration_days)
+        updated_user = plans.grant_subscription(load_user(db, current_user), sub_data.plan, duration_days)
         updated_user = plans.reset_api_token(updated_user)
         crud.update_user(db, user=updated_user)
         from .auth import get_full_user_response_data  # 导入辅助函数
@@ -1,13 +1,17 @@
 # 文件: app/routers/workspace.py (最终版)
 
-from fastapi import APIRouter, Depends, status, Body
-from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from fastapi import APIRouter, Depends, status, Body, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Optional
 
-from .. import schemas, crud, models, plans
-from ..database import get_db
+from .. import schemas, crud, plans
+from ..database import get_async_db
 from ..common.dependencies import get_user_from_header_or_query
+from ..common.principal import Principal
 from ..common.response_model import ResponseModel, APIException
+from ..globals import logger
+from ..services.indicator_service import compute_indicator_frame
+from .data import check_custom_indicator_quota
 
 router = APIRouter(
     tags=["Workspaces"],
@@ -15,49 +19,49 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=ResponseModel[schemas.MonitorWorkspaceOut])
-def create_new_workspace(
+async def create_new_workspace(
     workspace_in: schemas.MonitorWorkspaceCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_user_from_header_or_query)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
 ):
     user_plan_config = plans.PLANS_CONFIG.get(current_user.plan, plans.PLANS_CONFIG["freemium"])
     max_workspaces = user_plan_config.get('max_workspaces', 1)
-    current_workspaces_count = len(crud.workspace.get_workspaces_by_user(db, user_id=current_user.id))
+    current_workspaces_count = await crud.workspace.count_workspaces_async(db, user_id=current_user.id)
     if max_workspaces != -1 and current_workspaces_count >= max_workspaces:
         raise APIException(code=status.HTTP_403_FORBIDDEN, msg=f"已达到最大工作区数量限制 ({max_workspaces}个)。")
-    new_workspace = crud.workspace.create_workspace(db, name=workspace_in.name, user_id=current_user.id)
+    new_workspace = await crud.workspace.create_workspace_async(db, name=workspace_in.name, user_id=current_user.id)
     return ResponseModel(data=new_workspace)
 
 @router.get("/", response_model=ResponseModel[List[schemas.MonitorWorkspaceOut]])
-def get_user_workspaces(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_user_from_header_or_query)
+async def get_user_workspaces(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
 ):
-    workspaces = crud.workspace.get_workspaces_by_user(db, user_id=current_user.id)
+    workspaces = await crud.workspace.get_workspaces_by_user_async(db, user_id=current_user.id)
     return ResponseModel(data=workspaces)
 
 @router.get("/{workspace_id}", response_model=ResponseModel[schemas.MonitorWorkspaceOut])
-def get_single_workspace(
+async def get_single_workspace(
     workspace_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_user_from_header_or_query)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
 ):
-    workspace = crud.workspace.get_workspace(db, workspace_id=workspace_id, user_id=current_user.id)
+    workspace = await crud.workspace.get_workspace_async(db, workspace_id=workspace_id, user_id=current_user.id)
     if not workspace:
         raise APIException(code=status.HTTP_404_NOT_FOUND, msg="工作区不存在或无权访问")
     return ResponseModel(data=workspace)
 
 @router.put("/{workspace_id}", response_model=ResponseModel[schemas.MonitorWorkspaceOut])
-def rename_workspace(
+async def rename_workspace(
     workspace_id: int,
     payload: Dict[str, Any] = Body(...),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_user_from_header_or_query)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
 ):
     new_name = payload.get("name")
     if not new_name or not isinstance(new_name, str):
         raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="需要提供新的工作区名称 'name'")
-    updated_workspace = crud.workspace.update_workspace_name(
+    updated_workspace = await crud.workspace.update_workspace_name_async(
         db, workspace_id=workspace_id, user_id=current_user.id, new_name=new_name
     )
     if not updated_workspace:
@@ -65,28 +69,36 @@ def rename_workspace(
     return ResponseModel(data=updated_workspace)
 
 @router.delete("/{workspace_id}", response_model=ResponseModel)
-def delete_a_workspace(
+async def delete_a_workspace(
     workspace_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_user_from_header_or_query)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
 ):
-    success = crud.workspace.delete_workspace(db, workspace_id=workspace_id, user_id=current_user.id)
+    success = await crud.workspace.delete_workspace_async(db, workspace_id=workspace_id, user_id=current_user.id)
     if not success:
         raise APIException(code=status.HTTP_404_NOT_FOUND, msg="工作区不存在或无权访问")
     return ResponseModel(msg="工作区已成功删除")
 
+async def _check_custom_formula_quota(db: AsyncSession, user: Principal, definition: Dict[str, Any],
+                                      exclude_entity_id: Optional[int] = None):
+    """与 /indicators 接口一致按公式计数：用户所有 CUSTOM 实体的公式总数 (含本次定义) 不得超过套餐上限。"""
+    existing = await crud.workspace.count_custom_formulas_async(db, user_id=user.id, exclude_entity_id=exclude_entity_id)
+    check_custom_indicator_quota(user, existing + crud.workspace.definition_formula_count(definition))
+
 @router.post("/{workspace_id}/entities", response_model=ResponseModel[schemas.WorkspaceEntityOut])
-def add_entity_to_workspace(
+async def add_entity_to_workspace(
     workspace_id: int,
     entity_in: schemas.WorkspaceEntityCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_user_from_header_or_query)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
 ):
-    workspace = crud.workspace.get_workspace(db, workspace_id=workspace_id, user_id=current_user.id)
+    workspace = await crud.workspace.get_workspace_async(db, workspace_id=workspace_id, user_id=current_user.id)
     if not workspace:
         raise APIException(code=status.HTTP_404_NOT_FOUND, msg="工作区不存在或无权访问")
+    if entity_in.entity_type == 'CUSTOM':
+        await _check_custom_formula_quota(db, current_user, entity_in.definition)
     try:
-        new_entity = crud.workspace.create_workspace_entity(
+        new_entity = await crud.workspace.create_workspace_entity_async(
             db=db,
             workspace_id=workspace_id,
             entity_type=entity_in.entity_type,
@@ -101,35 +113,77 @@ def add_entity_to_workspace(
         raise APIException(code=status.HTTP_500_INTERNAL_SERVER_ERROR, msg="创建实体失败，请检查输入或联系管理员")
 
 @router.put("/{workspace_id}/entities/{entity_id}", response_model=ResponseModel[schemas.WorkspaceEntityOut])
-def update_workspace_entity(
+async def update_workspace_entity(
     workspace_id: int,
     entity_id: int,
     entity_in: schemas.WorkspaceEntityCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_user_from_header_or_query)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
 ):
-    workspace = crud.workspace.get_workspace(db, workspace_id=workspace_id, user_id=current_user.id)
+    workspace = await crud.workspace.get_workspace_async(db, workspace_id=workspace_id, user_id=current_user.id)
     if not workspace:
         raise APIException(code=status.HTTP_404_NOT_FOUND, msg="工作区不存在或无权访问")
-    updated_entity = crud.workspace.update_entity_definition(
-        db, entity_id=entity_id, workspace_id=workspace_id,
-        new_name=entity_in.name, new_definition=entity_in.definition
-    )
+    entity = await crud.workspace.get_entity_async(db, entity_id=entity_id, workspace_id=workspace_id)
+    if entity and entity.entity_type == 'CUSTOM':
+        await _check_custom_formula_quota(db, current_user, entity_in.definition, exclude_entity_id=entity_id)
+    try:
+        updated_entity = await crud.workspace.update_entity_definition_async(
+            db, entity_id=entity_id, workspace_id=workspace_id,
+            new_name=entity_in.name, new_definition=entity_in.definition
+        )
+    except ValueError as e:
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg=str(e))
     if not updated_entity:
         raise APIException(code=status.HTTP_404_NOT_FOUND, msg="实体不存在")
     return ResponseModel(data=updated_entity, msg="实体更新成功")
 
 @router.delete("/{workspace_id}/entities/{entity_id}", response_model=ResponseModel)
-def delete_entity_from_workspace(
+async def delete_entity_from_workspace(
     workspace_id: int,
     entity_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_user_from_header_or_query)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
 ):
-    workspace = crud.workspace.get_workspace(db, workspace_id=workspace_id, user_id=current_user.id)
+    workspace = await crud.workspace.get_workspace_async(db, workspace_id=workspace_id, user_id=current_user.id)
     if not workspace:
         raise APIException(code=status.HTTP_404_NOT_FOUND, msg="工作区不存在或无权访问")
-    success = crud.workspace.delete_entity(db, entity_id=entity_id, workspace_id=workspace_id)
+    success = await crud.workspace.delete_entity_async(db, entity_id=entity_id, workspace_id=workspace_id)
     if not success:
         raise APIException(code=status.HTTP_404_NOT_FOUND, msg="实体不存在")
-    return ResponseModel(msg="实体删除成功")
\ No newline at end of file
+    return ResponseModel(msg="实体删除成功")
+
+@router.get("/{workspace_id}/entities/{entity_id}/indicators", response_model=ResponseModel[Dict[str, Any]])
+async def get_entity_indicators(
+    workspace_id: int,
+    entity_id: int,
+    start_date: str = Query(..., description="开始日期 (YYYY-MM-DD)"),
+    end_date: str = Query(..., description="结束日期 (YYYY-MM-DD)"),
+    period: str = Query("daily", description="数据周期，同 /api/data/download-history"),
+    adjust: str = Query("qfq", description="复权方式: qfq, hfq, none"),
+    code: Optional[str] = Query(None, description="股票代码；实体定义中没有 code 时必填"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_user_from_header_or_query)
+):
+    """按 CUSTOM 实体定义中的 indicators/formulas 计算指标；BASE 实体默认计算 MA5/MA10/MA20。"""
+    workspace = await crud.workspace.get_workspace_async(db, workspace_id=workspace_id, user_id=current_user.id)
+    if not workspace:
+        raise APIException(code=status.HTTP_404_NOT_FOUND, msg="工作区不存在或无权访问")
+    entity = await crud.workspace.get_entity_async(db, entity_id=entity_id, workspace_id=workspace_id)
+    if not entity:
+        raise APIException(code=status.HTTP_404_NOT_FOUND, msg="实体不存在")
+    definition = entity.definition or {}
+    target_code = code or definition.get('code')
+    if not target_code:
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg="实体未绑定股票代码，请通过 code 参数指定")
+    if entity.entity_type == 'CUSTOM':
+        specs, formulas = definition.get('indicators') or [], definition.get('formulas') or {}
+    else:
+        specs, formulas = ["MA:5", "MA:10", "MA:20"], {}
+    try:
+        rows, market, message = await compute_indicator_frame(
+            target_code, start_date, end_date, adjust, period, specs, formulas)
+    except ValueError as e:
+        raise APIException(code=status.HTTP_400_BAD_REQUEST, msg=str(e))
+    if rows is None:
+        raise APIException(code=status.HTTP_404_NOT_FOUND, msg=message)
+    return ResponseModel(data={"market": market, "code": target_code, "entity_id": entity.id, "rows": rows})
@@ -1,7 +1,7 @@
 # 文件: app/schemas.py
 
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Dict
 import datetime
 
 # ==================================
@@ -98,4 +98,67 @@ class MonitorWorkspaceOut(BaseModel):
     entities: List[WorkspaceEntityOut] = []
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# ==========================================================
+#   技术指标
+# ==========================================================
+class IndicatorRequest(BaseModel):
+    code: str
+    start_date: str
+    end_date: str
+    period: str = "daily"
+    adjust: str = "qfq"
+    # 内置指标，如 ["MA:5", "MACD:12:26:9", "KDJ", "BOLL"]
+    indicators: List[str] = []
+    # 自定义公式 {输出名: 公式}，如 {"强弱": "CLOSE / MA(CLOSE, 20) - 1"}
+    formulas: Dict[str, str] = {}
+
+# ==========================================================
+#   历史K线回填 (管理员)
+# ==========================================================
+class HistoryBackfillRequest(BaseModel):
+    codes: List[str]
+    start_date: str
+    end_date: str
+    adjust: str = "qfq"
+
+# ==========================================================
+#   行情警报
+# ==========================================================
+class AlertCreate(BaseModel):
+    code: str
+    # 标准化行情字段名 a1..aN (见 /api/data/field-mappings)
+    field: str
+    # > >= < <= crosses crosses_up crosses_down
+    operator: str
+    threshold: float
+    cooldown_seconds: int = 300
+    notify_email: Optional[EmailStr] = None
+    note: Optional[str] = None
+
+class AlertUpdate(BaseModel):
+    operator: Optional[str] = None
+    threshold: Optional[float] = None
+    cooldown_seconds: Optional[int] = None
+    notify_email: Optional[EmailStr] = None
+    note: Optional[str] = None
+    is_active: Optional[bool] = None
+
+class AlertOut(BaseModel):
+    id: int
+    code: str
+    secid: str
+    field: str
+    operator: str
+    threshold: float
+    cooldown_seconds: int
+    notify_email: Optional[str] = None
+    note: Optional[str] = None
+    is_active: bool
+    trigger_count: int
+    last_triggered_at: Optional[datetime.datetime] = None
+    created_at: Optional[datetime.datetime] = None
+
+    class Config:
+        from_attributes = True
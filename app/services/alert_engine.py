@@ -0,0 +1,449 @@
+# 文件: app/services/alert_engine.py
+
+import asyncio
+import datetime
+import html
+import os
+import time
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ..globals import logger
+from .market_hub import market_hub
+from .stock_data import AN_TO_FIELD_NAME_MAP, PROCESSED_FIELD_MAPPING, get_item_secid
+
+# 警报引擎从行情订阅中心取数的间隔 (秒)
+ALERT_EVAL_INTERVAL = float(os.getenv("ALERT_EVAL_INTERVAL", 3.0))
+ALERT_ENGINE_ENABLED = os.getenv("ALERT_ENGINE_ENABLED", "true").lower() == "true"
+# 从数据库重新加载启用警报的间隔 (秒)；其他 worker 上的增删改最多滞后这么久生效
+ALERT_RELOAD_INTERVAL = float(os.getenv("ALERT_RELOAD_INTERVAL", 30.0))
+
+# 穿越类比较需要上一次的值，条件类比较在首次观测到满足时也会触发
+LEVEL_OPERATORS = (">", ">=", "<", "<=")
+CROSS_OPERATORS = ("crosses", "crosses_up", "crosses_down")
+ALERT_OPERATORS = LEVEL_OPERATORS + CROSS_OPERATORS
+
+# 可设置警报的数值字段 (a1..aN 中类型为数值的)
+NUMERIC_FIELDS = {config["an_name"] for config in PROCESSED_FIELD_MAPPING if config["type"] in (int, float)}
+
+
+@dataclass
+class AlertRule:
+    """引擎内存中的一条警报。"""
+    id: int
+    user_id: int
+    secid: str
+    code: str
+    field: str
+    operator: str
+    threshold: float
+    cooldown: float
+    recipient: str
+    note: Optional[str] = None
+    last_fired: float = float("-inf")  # time.monotonic()
+    last_value: Optional[float] = None  # 最近一次触发时的字段值
+
+    @classmethod
+    def from_model(cls, alert, user_email: str) -> "AlertRule":
+        rule = cls(id=alert.id, user_id=alert.user_id, secid=alert.secid, code=alert.code, field=alert.field,
+                   operator=alert.operator, threshold=float(alert.threshold),
+                   cooldown=float(alert.cooldown_seconds or 0), recipient=alert.notify_email or user_email,
+                   note=alert.note)
+        if alert.last_triggered_at is not None:
+            elapsed = (datetime.datetime.utcnow() - alert.last_triggered_at).total_seconds()
+            rule.last_fired = time.monotonic() - max(elapsed, 0.0)
+        return rule
+
+    @property
+    def definition(self) -> tuple:
+        """决定警报行为的字段，用于判断重新加载的规则是否发生变化。"""
+        return (self.user_id, self.secid, self.field, self.operator, self.threshold, self.cooldown, self.recipient,
+                self.note)
+
+    def describe(self) -> str:
+        field_name = AN_TO_FIELD_NAME_MAP.get(self.field, self.field)
+        return f"{self.code} {field_name} {self.operator} {self.threshold:g}"
+
+    def holds(self, value: float) -> bool:
+        """条件类警报在当前值上是否成立。"""
+        t = self.threshold
+        return {">": value > t, ">=": value >= t, "<": value < t, "<=": value <= t}.get(self.operator, False)
+
+
+class _SortedThresholds:
+    """一种比较方式下按阈值排序的警报 (阈值列表与警报 ID 列表平行)。"""
+
+    __slots__ = ("thresholds", "ids")
+
+    def __init__(self):
+        self.thresholds: List[float] = []
+        self.ids: List[int] = []
+
+    def add(self, threshold: float, alert_id: int):
+        index = bisect_right(self.thresholds, threshold)
+        self.thresholds.insert(index, threshold)
+        self.ids.insert(index, alert_id)
+
+    def remove(self, threshold: float, alert_id: int):
+        start = bisect_left(self.thresholds, threshold)
+        for index in range(start, len(self.thresholds)):
+            if self.ids[index] == alert_id:
+                del self.thresholds[index]
+                del self.ids[index]
+                return
+
+    def slice(self, lo: int, hi: int) -> List[int]:
+        return self.ids[lo:hi] if lo < hi else []
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class _FieldIndex:
+    """
+    同一 (secid, 字段) 上的全部警报，按比较方式分组并按阈值排序。
+    值从 prev 变为 cur 时，被触发的警报恰好是阈值落在 prev 与 cur 之间的那一段，
+    两次二分即可取出，开销为 O(log n + 触发数)，与该字段上的警报总数基本无关。
+    """
+
+    def __init__(self):
+        self.by_operator: Dict[str, _SortedThresholds] = {}
+
+    def add(self, rule: AlertRule):
+        self.by_operator.setdefault(rule.operator, _SortedThresholds()).add(rule.threshold, rule.id)
+
+    def remove(self, rule: AlertRule):
+        bucket = self.by_operator.get(rule.operator)
+        if bucket is not None:
+            bucket.remove(rule.threshold, rule.id)
+            if not bucket:
+                del self.by_operator[rule.operator]
+
+    def __bool__(self):
+        return bool(self.by_operator)
+
+    def crossed(self, prev: float, cur: float) -> List[int]:
+        fired: List[int] = []
+        for operator, bucket in self.by_operator.items():
+            t = bucket.thresholds
+            if operator == ">":  # prev <= t < cur
+                fired += bucket.slice(bisect_left(t, prev), bisect_left(t, cur))
+            elif operator in (">=", "crosses_up"):  # prev < t <= cur
+                fired += bucket.slice(bisect_right(t, prev), bisect_right(t, cur))
+            elif operator == "<":  # cur < t <= prev
+                fired += bucket.slice(bisect_right(t, cur), bisect_right(t, prev))
+            elif operator in ("<=", "crosses_down"):  # cur <= t < prev
+                fired += bucket.slice(bisect_left(t, cur), bisect_left(t, prev))
+            elif operator == "crosses":
+                if cur > prev:
+                    fired += bucket.slice(bisect_right(t, prev), bisect_right(t, cur))
+                else:
+                    fired += bucket.slice(bisect_left(t, cur), bisect_left(t, prev))
+        return fired
+
+
+def _numeric(value) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if number != number else number
+
+
+class AlertEngine:
+    """
+    进程内警报引擎。
+
+    以一个普通订阅者的身份从行情订阅中心获取所有警报涉及代码的行情，每个节拍：
+    - 按 secid 找到该代码上的警报 (没有警报或值未变化的字段直接跳过)；
+    - 对值发生变化的 (secid, 字段) 用排序阈值二分取出被穿越的警报；
+    - 新建的条件类警报在下一个节拍按当前值检查一次；
+    - 每条警报按 cooldown 去抖，触发后按收件人合并为一封邮件发送，并批量记录触发次数。
+    多进程部署时每个进程各自运行一份引擎，应只在一个进程中启用 (ALERT_ENGINE_ENABLED)；
+    本进程的修改由路由立即同步，其他 worker 的修改通过每 ALERT_RELOAD_INTERVAL 秒一次的数据库重新加载生效。
+    """
+
+    def __init__(self, interval: float = ALERT_EVAL_INTERVAL):
+        self.interval = interval
+        self._rules: Dict[int, AlertRule] = {}
+        self._index: Dict[str, Dict[str, _FieldIndex]] = {}
+        self._last_values: Dict[Tuple[str, str], float] = {}
+        self._fresh: Dict[Tuple[str, str], Set[int]] = {}
+        self._subscription = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._reload_task: Optional[asyncio.Task] = None
+        self._background: Set[asyncio.Task] = set()
+        # alert_id -> 本进程最近一次增删该警报的时间 (time.monotonic())，重新加载时不覆盖比快照更新的本地修改
+        self._local_changes: Dict[int, float] = {}
+
+    # --- 生命周期 ---
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        if not ALERT_ENGINE_ENABLED or (self._task is not None and not self._task.done()):
+            return
+        try:
+            await self.reload(fresh=False)
+        except Exception as e:
+            logger.error(f"加载警报失败，警报引擎以空规则启动: {e}")
+        self._task = asyncio.create_task(self._run(), name="alert-engine")
+        self._reload_task = asyncio.create_task(self._reload_loop(), name="alert-engine-reload")
+        self._resubscribe()
+        logger.info(f"警报引擎已启动，共 {len(self._rules)} 条警报。")
+
+    async def reload(self, fresh: bool = True):
+        """从数据库加载全部启用的警报 (所属用户已停用的除外)，与内存中的规则集校准。"""
+        from .. import crud
+        from ..database import SessionLocal
+
+        def load():
+            db = SessionLocal()
+            try:
+                return [AlertRule.from_model(alert, email)
+                        for alert, email in crud.alert.get_active_alerts_with_email(db)]
+            finally:
+                db.close()
+
+        loaded_at = time.monotonic()
+        self.reconcile(await asyncio.to_thread(load), loaded_at, fresh)
+
+    def reconcile(self, rules: List[AlertRule], loaded_at: float, fresh: bool = True):
+        """
+        以数据库快照为准增删改规则。快照读取之后本进程路由做过的修改更新，不会被覆盖；
+        定义未变的规则原样保留 (包括去抖状态)，新出现的条件类警报按 fresh 决定是否在下一个节拍检查一次。
+        """
+        loaded = {rule.id: rule for rule in rules}
+        skip = {alert_id for alert_id, changed_at in self._local_changes.items() if changed_at >= loaded_at}
+        changed = False
+        for alert_id in [alert_id for alert_id in self._rules if alert_id not in loaded and alert_id not in skip]:
+            self._remove(self._rules[alert_id])
+            changed = True
+        for rule in loaded.values():
+            current = self._rules.get(rule.id)
+            if rule.id in skip or (current is not None and current.definition == rule.definition):
+                continue
+            if current is not None:
+                rule.last_fired = max(rule.last_fired, current.last_fired)
+                self._remove(current)
+            self._add(rule, fresh=fresh)
+            changed = True
+        self._local_changes = {alert_id: changed_at for alert_id, changed_at in self._local_changes.items()
+                               if changed_at >= loaded_at}
+        if changed:
+            self._resubscribe()
+
+    async def _reload_loop(self):
+        while True:
+            await asyncio.sleep(ALERT_RELOAD_INTERVAL)
+            try:
+                await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"重新加载警报失败: {e}")
+
+    async def stop(self):
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+            self._reload_task = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._subscription is not None:
+            market_hub.unsubscribe(self._subscription)
+            self._subscription = None
+        for task in list(self._background):
+            task.cancel()
+        logger.info("警报引擎已停止。")
+
+    # --- 规则管理 ---
+    def upsert(self, rule: AlertRule):
+        """新增或替换一条警报 (路由在增改后调用)。"""
+        self._note_local_change(rule.id)
+        previous = self._rules.get(rule.id)
+        if previous is not None:
+            rule.last_fired = previous.last_fired
+            self._remove(previous)
+        self._add(rule, fresh=True)
+        self._resubscribe()
+
+    def remove(self, alert_id: int):
+        self._note_local_change(alert_id)
+        rule = self._rules.get(alert_id)
+        if rule is not None:
+            self._remove(rule)
+            self._resubscribe()
+
+    def remove_user(self, user_id: int):
+        """移除某个用户的全部警报 (用户被删除或停用时调用)。可以在任意线程调用 (同步路由运行在线程池中)。"""
+        loop = self._loop
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if loop is None or loop.is_closed() or running is loop:
+            self._remove_user(user_id)
+        else:
+            loop.call_soon_threadsafe(self._remove_user, user_id)
+
+    def _remove_user(self, user_id: int):
+        for rule in [rule for rule in self._rules.values() if rule.user_id == user_id]:
+            self._note_local_change(rule.id)
+            self._remove(rule)
+        self._resubscribe()
+
+    def _note_local_change(self, alert_id: int):
+        if self._reload_task is not None:
+            # 只有定期重新加载时才需要记录，未启用的引擎不积累
+            self._local_changes[alert_id] = time.monotonic()
+
+    def _add(self, rule: AlertRule, fresh: bool):
+        self._rules[rule.id] = rule
+        self._index.setdefault(rule.secid, {}).setdefault(rule.field, _FieldIndex()).add(rule)
+        if fresh and rule.operator in LEVEL_OPERATORS:
+            self._fresh.setdefault((rule.secid, rule.field), set()).add(rule.id)
+
+    def _remove(self, rule: AlertRule):
+        self._rules.pop(rule.id, None)
+        fields = self._index.get(rule.secid, {})
+        index = fields.get(rule.field)
+        if index is not None:
+            index.remove(rule)
+            if not index:
+                del fields[rule.field]
+                self._last_values.pop((rule.secid, rule.field), None)
+        if not fields:
+            self._index.pop(rule.secid, None)
+        fresh = self._fresh.get((rule.secid, rule.field))
+        if fresh is not None:
+            fresh.discard(rule.id)
+
+    def _resubscribe(self):
+        if self._task is None:
+            # 引擎未启动 (或已禁用) 时只维护规则，不占用行情订阅
+            return
+        secids = sorted(self._index)
+        current = self._subscription
+        if current is not None and current.secids == secids:
+            return
+        if current is not None:
+            market_hub.unsubscribe(current)
+        self._subscription = market_hub.subscribe(secids, self.interval) if secids else None
+
+    @property
+    def rule_count(self) -> int:
+        return len(self._rules)
+
+    # --- 求值 ---
+    def evaluate(self, rows: Iterable[dict], now: Optional[float] = None) -> List[AlertRule]:
+        """处理一批行情行，返回本次触发 (已通过去抖) 的警报。"""
+        now = time.monotonic() if now is None else now
+        fired: List[AlertRule] = []
+        for row in rows:
+            secid = get_item_secid(row)
+            fields = self._index.get(secid)
+            if not fields:
+                continue
+            for field_name, index in fields.items():
+                cur = _numeric(row.get(field_name))
+                if cur is None:
+                    continue
+                key = (secid, field_name)
+                prev = self._last_values.get(key)
+                self._last_values[key] = cur
+                candidates: List[int] = []
+                if prev is not None and prev != cur:
+                    candidates = index.crossed(prev, cur)
+                fresh = self._fresh.pop(key, None)
+                if fresh:
+                    candidates += [rule_id for rule_id in fresh
+                                   if rule_id in self._rules and self._rules[rule_id].holds(cur)]
+                for rule_id in dict.fromkeys(candidates):
+                    rule = self._rules.get(rule_id)
+                    if rule is None or now - rule.last_fired < rule.cooldown:
+                        continue
+                    rule.last_fired = now
+                    rule.last_value = cur
+                    fired.append(rule)
+        return fired
+
+    async def _run(self):
+        while True:
+            try:
+                subscription = self._subscription
+                if subscription is None:
+                    await asyncio.sleep(self.interval)
+                    continue
+                frame = await subscription.next_frame(timeout=self.interval * 2)
+                if not frame.rows:
+                    continue
+                fired = self.evaluate(frame.rows)
+                if fired:
+                    self._spawn(self._deliver(fired))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"警报引擎循环出现异常: {e}", exc_info=True)
+                await asyncio.sleep(1.0)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    # --- 通知 ---
+    async def _deliver(self, fired: List[AlertRule]):
+        from .. import crud
+        from ..database import SessionLocal
+
+        triggered_at = datetime.datetime.utcnow()
+
+        def record():
+            db = SessionLocal()
+            try:
+                crud.alert.record_triggers(db, [rule.id for rule in fired], triggered_at)
+            finally:
+                db.close()
+
+        try:
+            await asyncio.to_thread(record)
+        except Exception as e:
+            logger.error(f"记录警报触发失败: {e}")
+
+        by_recipient: Dict[str, List[AlertRule]] = {}
+        for rule in fired:
+            by_recipient.setdefault(rule.recipient, []).append(rule)
+        for recipient, rules in by_recipient.items():
+            await self._send_email(recipient, rules)
+
+    async def _send_email(self, recipient: str, rules: List[AlertRule]):
+        from fastapi_mail import MessageSchema
+        from ..globals import fm
+        from .mailer import send_email_task
+
+        logger.info(f"警报触发 ({recipient}): " + "; ".join(rule.describe() for rule in rules))
+        if fm is None:
+            logger.warning("邮件服务未配置，警报仅记录日志。")
+            return
+        items = "".join(
+            f"<li>{html.escape(rule.describe())}，当前值 {rule.last_value:g}"
+            f"{'，备注: ' + html.escape(rule.note) if rule.note else ''}</li>"
+            for rule in rules)
+        message = MessageSchema(
+            subject=f"【雷达股眼】{len(rules)} 条警报已触发",
+            recipients=[recipient],
+            body=f"<p>您设置的以下警报已触发：</p><ul>{items}</ul>",
+            subtype="html"
+        )
+        await send_email_task(message)
+
+
+# 进程级单例，由 main.py 的启动/关闭钩子管理生命周期
+alert_engine = AlertEngine()
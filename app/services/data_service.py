@@ -1,12 +1,21 @@
 # app/data_service.py
 
-import asyncio
-import requests
+import datetime
 import pandas as pd
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from functools import lru_cache
 from ..globals import logger
 from fake_useragent import UserAgent
+from .stock_data import resolve_market_info_async
+from .history_store import history_store
+from .intraday_store import intraday_store
+from .upstream_limiter import upstream_limiter
+from .kline_resample import DEFAULT_SESSION_ANCHORS, PERIOD_RULES, resample_bars, resample_period
+
+# akshare 分钟线原生支持的周期；其余 N 分钟周期由更细的分钟线重采样得到
+NATIVE_MINUTE_PERIODS = ('1', '5', '15', '30', '60')
+# 美股分钟线按整点对齐聚合 (常规交易时段的开盘 09:30 本身落在 30 分钟整点上)
+US_SESSION_ANCHORS = (datetime.time(0, 0),)
 
 
 @lru_cache(maxsize=1)
@@ -35,78 +44,78 @@ async def _find_market_info_from_api_async(raw_code: str) -> (str | None, str |
     """
     异步版本：将 Ticker 转换为东方财富的 QuoteID 和标准 Ticker
     返回一个元组 (quote_id, security_code)
+    与 stock_data 共用持久化的代码解析缓存，已知代码不再请求搜索接口。
     """
-    ua_generator = get_user_agent_generator()  # 在函数内部获取 UserAgent 实例
-
-    url = "https://searchapi.eastmoney.com/api/suggest/get"
-    params = {"input": raw_code, "type": "14", "token": "D433A59954249B6723224A37D4929D34", "count": 1}
-    headers = {'User-Agent': ua_generator.random}
-
-    try:
-        # 使用 asyncio.to_thread 将同步的 requests.get 调用放入单独的线程中
-        response = await asyncio.to_thread(
-            requests.get, url, params=params, headers=headers, timeout=5
-        )
-        response.raise_for_status()
-        data = response.json()
-        first_result = data.get("QuotationCodeTable", {}).get("Data", [])[0]
-        quote_id = first_result.get('QuoteID')
-        security_code = first_result.get('SecurityCode')
-        return quote_id, security_code
-    except (requests.RequestException, IndexError, KeyError, TypeError) as e:
-        logger.warning(f"在 _find_market_info_from_api_async 中为 {raw_code} 查找市场信息失败: {e}", exc_info=False)
-        return None, None
+    quote_id, security_code = await resolve_market_info_async(raw_code, timeout=5)
+    if not quote_id:
+        logger.warning(f"在 _find_market_info_from_api_async 中为 {raw_code} 查找市场信息失败", exc_info=False)
+    return quote_id, security_code
 
 
 async def _fetch_raw_data_logic(code: str, period: str, start_date: str, end_date: str, adjust: str) -> (
 pd.DataFrame | None, str):
     """
     获取原始数据的核心逻辑。
-    注意：akshare 的大部分函数是同步阻塞的，需要使用 asyncio.to_thread 调用。
+    注意：akshare 的大部分函数是同步阻塞的，统一经 upstream_limiter 在专用线程池中调用，
+    并受按市场的并发与频率限制。
     """
     import akshare as ak  # 在函数内部导入，避免模块加载时的潜在问题
 
-    market = "unknown"
+    market = _market_of(code)
     df = None
-    try:
-        int(code)
-        market = "A-Share" if len(code) > 5 else "HK-Share"
-    except ValueError:
-        market = "US-Share"
 
     try:
-        if period in ['daily', 'weekly', 'monthly']:
+        if period == 'daily' or period in PERIOD_RULES:
             symbol_to_fetch = code
             if market == "US-Share":
                 quote_id, _ = await _find_market_info_from_api_async(code)
                 if not quote_id: return None, market
                 symbol_to_fetch = quote_id
 
-            if market == "A-Share":
-                df = await asyncio.to_thread(ak.stock_zh_a_hist, symbol=symbol_to_fetch, period="daily",
-                                             start_date=start_date, end_date=end_date, adjust=adjust)
-            elif market == "HK-Share":
-                df = await asyncio.to_thread(ak.stock_hk_hist, symbol=symbol_to_fetch, period="daily",
-                                             start_date=start_date, end_date=end_date, adjust=adjust)
-            elif market == "US-Share":
-                df = await asyncio.to_thread(ak.stock_us_hist, symbol=symbol_to_fetch, period="daily",
-                                             start_date=start_date, end_date=end_date, adjust=adjust)
+            hist_func = {"A-Share": ak.stock_zh_a_hist, "HK-Share": ak.stock_hk_hist,
+                         "US-Share": ak.stock_us_hist}[market]
+            # akshare 以空字符串表示不复权
+            ak_adjust = "" if adjust in ("", "none") else adjust
+
+            async def fetch_daily(fetch_start: str, fetch_end: str) -> pd.DataFrame | None:
+                try:
+                    return await upstream_limiter.call(market, hist_func, symbol=symbol_to_fetch, period="daily",
+                                                       start_date=fetch_start, end_date=fetch_end, adjust=ak_adjust)
+                except Exception as e:
+                    logger.error(f"AKShare 获取日线时出错 - 代码: {code}, 区间: {fetch_start}-{fetch_end}, 错误: {e}",
+                                 exc_info=False)
+                    return None
+
+            # 日线经本地K线库读取，只向上游请求本地缺失的区间
+            df = await history_store.get_daily_bars(code, market, start_date, end_date, ak_adjust, fetch_daily)
         else:  # 分时数据
             symbol_to_fetch = code
             if market == "US-Share":
-                _, security_code = await _find_market_info_from_api_async(code)
-                if not security_code: return None, market
-                symbol_to_fetch = security_code
-
-            if market == "A-Share":
-                df = await asyncio.to_thread(ak.stock_zh_a_hist_min_em, symbol=symbol_to_fetch, period=period,
-                                             adjust=adjust)
-            elif market == "HK-Share":
-                df = await asyncio.to_thread(ak.stock_hk_hist_min_em, symbol=symbol_to_fetch, period=period,
-                                             adjust=adjust)
-            elif market == "US-Share":
-                df = await asyncio.to_thread(ak.stock_us_hist_min_em, symbol=symbol_to_fetch, period=period,
-                                             adjust=adjust)
+                # 美股分钟线接口的 symbol 为东方财富 QuoteID (如 105.AAPL)
+                quote_id, _ = await _find_market_info_from_api_async(code)
+                if not quote_id: return None, market
+                symbol_to_fetch = quote_id
+
+            ak_adjust = "" if adjust in ("", "none") else adjust
+
+            async def fetch_minutes(fetch_start: str) -> pd.DataFrame | None:
+                try:
+                    if market == "A-Share":
+                        return await upstream_limiter.call(market, ak.stock_zh_a_hist_min_em, symbol=symbol_to_fetch,
+                                                           start_date=fetch_start, period=period, adjust=ak_adjust)
+                    if market == "HK-Share":
+                        return await upstream_limiter.call(market, ak.stock_hk_hist_min_em, symbol=symbol_to_fetch,
+                                                           start_date=fetch_start, period=period, adjust=ak_adjust)
+                    # 美股分钟线接口只有 1 分钟且不支持复权
+                    return await upstream_limiter.call(market, ak.stock_us_hist_min_em, symbol=symbol_to_fetch,
+                                                       start_date=fetch_start)
+                except Exception as e:
+                    logger.error(f"AKShare 获取分钟线时出错 - 代码: {code}, 周期: {period}, 起始: {fetch_start}, 错误: {e}",
+                                 exc_info=False)
+                    return None
+
+            # 分钟线经进程内缓存读取，盘中只增量请求最新的K线
+            df = await intraday_store.get_bars(code, market, period, ak_adjust, fetch_minutes, start_date, end_date)
 
     except Exception as e:
         logger.error(f"AKShare 获取数据时出错 - 代码: {code}, 周期: {period}, 错误: {e}", exc_info=False)
@@ -115,72 +124,95 @@ pd.DataFrame | None, str):
     return df, market
 
 
+def _market_of(code: str) -> str:
+    try:
+        int(code)
+        return "A-Share" if len(code) > 5 else "HK-Share"
+    except ValueError:
+        return "US-Share"
+
+
 def aggregate_kline_data(df: pd.DataFrame, period: str = 'daily') -> pd.DataFrame:
     """
-    将日线数据聚合为周线或月线。
+    将日线数据聚合为周线、月线、季线或交易周线，不修改入参。
     """
-    if df.empty or period == 'daily':
-        return df
-
-    df['日期'] = pd.to_datetime(df['日期'])
-    df.set_index('日期', inplace=True)
-
-    ohlc_rule = {'开盘': 'first', '最高': 'max', '最低': 'min', '收盘': 'last', '成交量': 'sum', '成交额': 'sum'}
+    return resample_period(df, period)
 
-    period_map = {'weekly': 'W', 'monthly': 'M'}
-    if period in period_map:
-        df_agg = df.resample(period_map[period]).apply(ohlc_rule)
-        df_agg.dropna(inplace=True)
-        return df_agg.reset_index()
 
-    return df.reset_index()
+def _minute_fetch_period(period: str, market: str) -> str | None:
+    """N 分钟周期实际向上游请求的分钟周期；不是合法分钟周期时返回 None。"""
+    if not period.isdigit() or int(period) <= 0:
+        return None
+    if market == "US-Share":
+        return '1'
+    if period in NATIVE_MINUTE_PERIODS:
+        return period
+    return '5' if int(period) % 5 == 0 else '1'
 
 
-async def get_historical_data_as_json(
+async def get_historical_frame(
         code_str: str,
         start_date: str,
         end_date: str,
         adjust: str,
         period: str
-) -> Dict[str, Any]:
+) -> Tuple[pd.DataFrame | None, str, str]:
     """
-    获取历史K线数据，并以JSON格式返回。
+    获取历史K线并统一列名 (date/open/close/high/low/volume/turnover)。
+    返回 (DataFrame 或 None, 市场, 说明信息)，供 JSON 接口与流式导出共用。
     """
     raw_code = code_str.strip()
 
-    df, market = await _fetch_raw_data_logic(raw_code, period, start_date, end_date, adjust)
-
-    if df is not None and not df.empty:
-        df_period = df
+    fetch_period = period
+    if period != 'daily' and period not in PERIOD_RULES:
+        fetch_period = _minute_fetch_period(period, _market_of(raw_code))
+        if fetch_period is None:
+            return None, "unknown", f"不支持的数据周期: {period}"
+
+    df, market = await _fetch_raw_data_logic(raw_code, fetch_period, start_date, end_date, adjust)
+
+    if df is None or df.empty:
+        return None, market, "获取数据失败或代码无效。"
+
+    df_period = df
+    if '日期' in df_period.columns:
+        if period in PERIOD_RULES:
+            df_period = aggregate_kline_data(df, period)
+        rename_map = {'日期': 'date', '开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low',
+                      '成交量': 'volume', '成交额': 'turnover'}
+    elif '时间' in df_period.columns:
+        if fetch_period != period:
+            anchors = US_SESSION_ANCHORS if market == "US-Share" else DEFAULT_SESSION_ANCHORS
+            df_period = resample_bars(df, f"{period}min", session_anchors=anchors)
+        rename_map = {'时间': 'date', '开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low',
+                      '成交量': 'volume', '成交额': 'turnover'}
+    else:
+        return None, market, "在获取的数据中未找到日期/时间列"
 
-        if '日期' in df_period.columns:
-            if period in ['weekly', 'monthly']:
-                df_period = aggregate_kline_data(df, period)
-            rename_map = {'日期': 'date', '开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low',
-                          '成交量': 'volume', '成交额': 'turnover'}
-        elif '时间' in df_period.columns:
-            rename_map = {'时间': 'date', '开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low',
-                          '成交量': 'volume', '成交额': 'turnover'}
-        else:
-            return {"market": market, "code": raw_code, "data": [], "message": "在获取的数据中未找到日期/时间列"}
+    df_period.rename(columns=rename_map, inplace=True)
 
-        df_period.rename(columns=rename_map, inplace=True)
+    if 'date' in df_period.columns:
+        df_period['date'] = df_period['date'].astype(str)
 
-        if 'date' in df_period.columns:
-            df_period['date'] = df_period['date'].astype(str)
+    return df_period, market, f"成功获取 {len(df_period)} 条记录。"
 
-        data_list = df_period.to_dict(orient='records')
 
-        return {
-            "market": market,
-            "code": raw_code,
-            "data": data_list,
-            "message": f"成功获取 {len(data_list)} 条记录。"
-        }
-    else:
-        return {
-            "market": market,
-            "code": raw_code,
-            "data": [],
-            "message": "获取数据失败或代码无效。"
-        }
\ No newline at end of file
+async def get_historical_data_as_json(
+        code_str: str,
+        start_date: str,
+        end_date: str,
+        adjust: str,
+        period: str
+) -> Dict[str, Any]:
+    """
+    获取历史K线数据，并以JSON格式返回。
+    """
+    raw_code = code_str.strip()
+    df_period, market, message = await get_historical_frame(raw_code, start_date, end_date, adjust, period)
+    data_list = df_period.to_dict(orient='records') if df_period is not None else []
+    return {
+        "market": market,
+        "code": raw_code,
+        "data": data_list,
+        "message": message
+    }
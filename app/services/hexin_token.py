@@ -0,0 +1,231 @@
+# 文件: app/services/hexin_token.py
+
+import asyncio
+import collections
+import json
+import os
+import time
+from typing import Deque, Dict, Optional, Tuple
+
+from ..globals import logger
+
+_SERVICE_DIR = os.path.dirname(__file__)
+HEXIN_JS_PATH = os.path.join(_SERVICE_DIR, '2.js')
+HEXIN_WORKER_PATH = os.path.join(_SERVICE_DIR, 'hexin_worker.js')
+NODE_BINARY = os.getenv("NODE_BINARY", "node")
+
+# --- 令牌池配置 ---
+# 预生成的 hexin-v 数量
+HEXIN_TOKEN_POOL_SIZE = int(os.getenv("HEXIN_TOKEN_POOL_SIZE", 16))
+# 单个令牌的有效期 (秒)，超过后不再发放，由后台补充新令牌
+HEXIN_TOKEN_TTL = float(os.getenv("HEXIN_TOKEN_TTL", 120))
+# 后台巡检间隔 (秒)，用于剔除即将过期的令牌
+HEXIN_TOKEN_REFRESH_INTERVAL = float(os.getenv("HEXIN_TOKEN_REFRESH_INTERVAL", 10))
+# 单次请求 JS 工作进程的超时 (秒)
+HEXIN_WORKER_TIMEOUT = float(os.getenv("HEXIN_WORKER_TIMEOUT", 5))
+
+
+class HexinTokenError(Exception):
+    """令牌生成失败，message 为可直接返回给用户的提示。"""
+
+    def __init__(self, message: str):
+        self.message = message
+        super().__init__(message)
+
+
+class HexinTokenProvider:
+    """
+    问财请求凭证 (hexin-v) 的提供者。
+
+    进程内只保留一个常驻的 node 工作进程 (hexin_worker.js)，通过 stdin/stdout
+    按行交换 JSON；另外维护一个预生成的令牌池，每个令牌在有效期内只发放一次，
+    后台任务负责补充和剔除过期令牌。查询时通常直接从池中取出，几乎没有等待。
+    """
+
+    def __init__(self, pool_size: int = HEXIN_TOKEN_POOL_SIZE, ttl: float = HEXIN_TOKEN_TTL):
+        self.pool_size = max(1, pool_size)
+        self.ttl = ttl
+        self._pool: Deque[Tuple[str, float]] = collections.deque()
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._refill_task: Optional[asyncio.Task] = None
+        self._refill_event: Optional[asyncio.Event] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 1
+        self._spawn_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+    async def start(self):
+        if self._refill_task is None or self._refill_task.done():
+            self._stopping = False
+            self._refill_event = asyncio.Event()
+            self._refill_event.set()
+            self._refill_task = asyncio.create_task(self._refill_loop())
+            logger.info(f"hexin-v 令牌池已启动 (容量: {self.pool_size}, 有效期: {self.ttl}s)。")
+
+    async def stop(self):
+        if self._refill_task is not None:
+            # wait_for 与 Event 同时完成时可能吞掉取消请求 (Python 3.11)，另设标志保证循环退出
+            self._stopping = True
+            self._refill_event.set()
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+        await self._kill_worker()
+        self._pool.clear()
+        logger.info("hexin-v 令牌池已停止。")
+
+    # ------------------------------------------------------------------
+    # 对外接口
+    # ------------------------------------------------------------------
+    async def get_token(self) -> str:
+        """取出一个未过期的令牌；池为空时直接向工作进程请求。"""
+        now = time.monotonic()
+        token = None
+        while self._pool:
+            candidate, created_at = self._pool.popleft()
+            if now - created_at < self.ttl:
+                token = candidate
+                break
+        if self._refill_event is not None:
+            self._refill_event.set()
+        if token is not None:
+            return token
+        return (await self._generate(1))[0]
+
+    def pool_status(self) -> dict:
+        return {
+            "pooled": len(self._pool),
+            "capacity": self.pool_size,
+            "worker_alive": self._process is not None and self._process.returncode is None,
+        }
+
+    # ------------------------------------------------------------------
+    # 令牌池维护
+    # ------------------------------------------------------------------
+    def _drop_expired(self):
+        # 提前一个巡检周期剔除，保证发放出去的令牌在使用时仍然有效
+        deadline = time.monotonic() - max(self.ttl - HEXIN_TOKEN_REFRESH_INTERVAL, 0)
+        while self._pool and self._pool[0][1] < deadline:
+            self._pool.popleft()
+
+    async def _refill_loop(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._refill_event.wait(), timeout=HEXIN_TOKEN_REFRESH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                break
+            self._refill_event.clear()
+            self._drop_expired()
+            missing = self.pool_size - len(self._pool)
+            if missing <= 0:
+                continue
+            try:
+                tokens = await self._generate(missing)
+                created_at = time.monotonic()
+                self._pool.extend((token, created_at) for token in tokens)
+            except asyncio.CancelledError:
+                raise
+            except HexinTokenError as e:
+                logger.warning(f"补充 hexin-v 令牌池失败: {e.message}")
+                await asyncio.sleep(HEXIN_TOKEN_REFRESH_INTERVAL)
+            except Exception as e:
+                logger.error(f"hexin-v 令牌池后台任务异常: {e}", exc_info=True)
+                await asyncio.sleep(HEXIN_TOKEN_REFRESH_INTERVAL)
+
+    # ------------------------------------------------------------------
+    # JS 工作进程
+    # ------------------------------------------------------------------
+    async def _ensure_worker(self) -> asyncio.subprocess.Process:
+        if self._process is not None and self._process.returncode is None:
+            return self._process
+        if self._spawn_lock is None:
+            self._spawn_lock = asyncio.Lock()
+        async with self._spawn_lock:
+            if self._process is not None and self._process.returncode is None:
+                return self._process
+            if not os.path.exists(HEXIN_JS_PATH) or not os.path.exists(HEXIN_WORKER_PATH):
+                raise HexinTokenError("服务器内部配置错误 (缺少JS依赖)。")
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    NODE_BINARY, HEXIN_WORKER_PATH, HEXIN_JS_PATH,
+                    stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+            except FileNotFoundError:
+                raise HexinTokenError("服务器环境错误 (缺少Node.js运行时)。")
+            self._process = process
+            self._reader_task = asyncio.create_task(self._read_responses(process))
+            logger.info(f"hexin-v 工作进程已启动 (pid: {process.pid})。")
+            return process
+
+    async def _read_responses(self, process: asyncio.subprocess.Process):
+        try:
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    logger.warning(f"hexin-v 工作进程输出无法解析: {line[:200]!r}")
+                    continue
+                future = self._pending.pop(message.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        finally:
+            # 进程退出：让所有等待中的请求失败，下次调用时会重新拉起进程
+            # (若已有新进程接替，待处理请求属于新进程，不能误伤)
+            if self._process is process or self._process is None:
+                for future in self._pending.values():
+                    if not future.done():
+                        future.set_exception(HexinTokenError("无法生成有效的请求凭证。"))
+                self._pending.clear()
+            if self._process is process:
+                logger.warning("hexin-v 工作进程已退出。")
+
+    async def _generate(self, count: int) -> list:
+        process = await self._ensure_worker()
+        request_id = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            process.stdin.write((json.dumps({"id": request_id, "count": count}) + "\n").encode("utf-8"))
+            await process.stdin.drain()
+            message = await asyncio.wait_for(future, timeout=HEXIN_WORKER_TIMEOUT * max(1, count / 16))
+        except (BrokenPipeError, ConnectionResetError):
+            await self._kill_worker()
+            raise HexinTokenError("无法生成有效的请求凭证。")
+        except asyncio.TimeoutError:
+            logger.error("hexin-v 工作进程响应超时，将重启该进程。")
+            await self._kill_worker()
+            raise HexinTokenError("无法生成有效的请求凭证。")
+        finally:
+            self._pending.pop(request_id, None)
+
+        if message.get("error") or not message.get("tokens"):
+            logger.error(f"执行 '2.js' 失败: {message.get('error')}")
+            raise HexinTokenError("无法生成有效的请求凭证。")
+        return message["tokens"]
+
+    async def _kill_worker(self):
+        process, self._process = self._process, None
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+
+
+# 进程级单例，由 main.py 的启动/关闭钩子管理生命周期
+hexin_token_provider = HexinTokenProvider()
@@ -0,0 +1,52 @@
+// 文件: app/services/hexin_worker.js
+//
+// 常驻的 hexin-v 生成进程，由 app/services/hexin_token.py 启动和管理。
+// 启动时编译一次 2.js，之后每个令牌都在全新的 vm 上下文中执行，
+// 结果与单独运行 `node 2.js` 一致，但省去了进程启动和 V8 预热的开销。
+//
+// 协议: stdin/stdout 上按行传输 JSON。
+//   请求: {"id": 1, "count": 4}
+//   响应: {"id": 1, "tokens": ["...", ...]} 或 {"id": 1, "error": "..."}
+
+const fs = require('fs');
+const readline = require('readline');
+const vm = require('vm');
+
+const scriptPath = process.argv[2];
+const source = fs.readFileSync(scriptPath, 'utf-8');
+// 2.js 末尾会 console.log 一次结果，这里用空实现吞掉，避免污染协议输出
+const script = new vm.Script(source, { filename: scriptPath });
+const silentConsole = { log() {}, info() {}, warn() {}, error() {}, debug() {} };
+
+function generateToken() {
+    const context = vm.createContext({ console: silentConsole });
+    script.runInContext(context);
+    return String(context.target.num());
+}
+
+function reply(message) {
+    process.stdout.write(JSON.stringify(message) + '\n');
+}
+
+const rl = readline.createInterface({ input: process.stdin, terminal: false });
+rl.on('line', (line) => {
+    if (!line.trim()) return;
+    let request;
+    try {
+        request = JSON.parse(line);
+    } catch (e) {
+        reply({ id: null, error: 'invalid request: ' + e.message });
+        return;
+    }
+    try {
+        const count = Math.max(1, Math.min(Number(request.count) || 1, 256));
+        const tokens = [];
+        for (let i = 0; i < count; i++) tokens.push(generateToken());
+        reply({ id: request.id, tokens: tokens });
+    } catch (e) {
+        reply({ id: request.id, error: String((e && e.stack) || e) });
+    }
+});
+rl.on('close', () => process.exit(0));
+
+reply({ id: 0, ready: true });
@@ -0,0 +1,96 @@
+# 文件: app/services/history_export.py
+
+import importlib.util
+import io
+import os
+from typing import AsyncGenerator, List
+
+import pandas as pd
+
+from ..common.serializer import dumps_bytes
+from .history_fetcher import iter_history_frames
+
+# 同时在途的代码数：决定导出时的峰值内存，而不是代码总数
+HISTORY_EXPORT_CONCURRENCY = int(os.getenv("HISTORY_EXPORT_CONCURRENCY", 4))
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+}
+
+# CSV / Arrow 的固定列；不同市场附带的额外列 (如 A 股的 股票代码) 不导出
+EXPORT_COLUMNS = ["code", "date", "open", "close", "high", "low", "volume", "turnover",
+                  "振幅", "涨跌幅", "涨跌额", "换手率"]
+_NUMERIC_COLUMNS = EXPORT_COLUMNS[2:]
+
+
+def arrow_available() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _export_frame(code: str, df: pd.DataFrame) -> pd.DataFrame:
+    out = df.reindex(columns=EXPORT_COLUMNS)
+    out["code"] = code
+    return out
+
+
+async def stream_history(codes: List[str], start_date: str, end_date: str, adjust: str, period: str,
+                         export_format: str,
+                         concurrency: int = HISTORY_EXPORT_CONCURRENCY) -> AsyncGenerator[bytes, None]:
+    """
+    逐代码流式导出历史K线。每个代码的数据就绪后立即编码并发送，随后释放，
+    内存占用只与并发窗口有关。
+    - ndjson: 每行一个 JSON 对象，在原有字段前加上 code；
+    - csv:    固定列 EXPORT_COLUMNS，只输出一次表头；
+    - arrow:  Arrow IPC 流格式，每个代码一个 record batch。
+    """
+    frames = ((code, df) async for code, df, _ in
+              iter_history_frames(codes, start_date, end_date, adjust, period, concurrency))
+
+    if export_format == "ndjson":
+        async for code, df in frames:
+            if df is None or df.empty:
+                continue
+            lines = [dumps_bytes({"code": code, **record}) for record in df.to_dict(orient="records")]
+            yield b"\n".join(lines) + b"\n"
+
+    elif export_format == "csv":
+        header_sent = False
+        async for code, df in frames:
+            if df is None or df.empty:
+                continue
+            buffer = io.StringIO()
+            _export_frame(code, df).to_csv(buffer, index=False, header=not header_sent)
+            header_sent = True
+            yield buffer.getvalue().encode("utf-8")
+        if not header_sent:
+            yield (",".join(EXPORT_COLUMNS) + "\n").encode("utf-8")
+
+    elif export_format == "arrow":
+        import pyarrow as pa
+
+        schema = pa.schema([("code", pa.string()), ("date", pa.string())]
+                           + [(column, pa.float64()) for column in _NUMERIC_COLUMNS])
+        sink = io.BytesIO()
+        writer = pa.ipc.new_stream(sink, schema)
+
+        def drain() -> bytes:
+            chunk = sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+            return chunk
+
+        yield drain()  # 先发送 schema，客户端可立即开始解析
+        async for code, df in frames:
+            if df is None or df.empty:
+                continue
+            out = _export_frame(code, df)
+            out[_NUMERIC_COLUMNS] = out[_NUMERIC_COLUMNS].apply(pd.to_numeric, errors="coerce")
+            writer.write_batch(pa.RecordBatch.from_pandas(out, schema=schema, preserve_index=False))
+            yield drain()
+        writer.close()
+        yield drain()
+
+    else:
+        raise ValueError(f"不支持的导出格式: {export_format}")
@@ -0,0 +1,107 @@
+# 文件: app/services/history_fetcher.py
+
+import asyncio
+import os
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from ..globals import logger
+from .data_service import get_historical_frame
+from .kline_resample import PERIOD_RULES, resample_period
+
+# 批量获取时同时处理的代码数 (上游调用另受 upstream_limiter 的按市场限流约束)
+HISTORY_BATCH_CONCURRENCY = int(os.getenv("HISTORY_BATCH_CONCURRENCY", 16))
+
+# (代码, DataFrame 或 None, 说明信息)
+FrameResult = Tuple[str, Optional[pd.DataFrame], str]
+
+
+async def iter_history_frames(codes: List[str], start_date: str, end_date: str, adjust: str, period: str,
+                              concurrency: int = HISTORY_BATCH_CONCURRENCY) -> AsyncGenerator[FrameResult, None]:
+    """
+    以固定窗口并发获取各代码的K线，谁先完成先产出谁。
+    单个代码失败不影响其他代码，失败时 DataFrame 为 None，说明信息给出原因。
+    """
+    pending = list(reversed(codes))
+    in_flight: Dict[asyncio.Task, str] = {}
+    concurrency = max(1, concurrency)
+
+    def launch():
+        while pending and len(in_flight) < concurrency:
+            code = pending.pop()
+            task = asyncio.ensure_future(get_historical_frame(code, start_date, end_date, adjust, period))
+            in_flight[task] = code
+
+    launch()
+    try:
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                code = in_flight.pop(task)
+                try:
+                    df, _, message = task.result()
+                except Exception as e:
+                    logger.error(f"获取 {code} 的历史数据失败: {e}", exc_info=False)
+                    df, message = None, "获取数据时发生内部错误。"
+                launch()
+                yield code, df, message
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+
+async def fetch_history_batch(codes: List[str], start_date: str, end_date: str, adjust: str, period: str,
+                              concurrency: int = HISTORY_BATCH_CONCURRENCY
+                              ) -> Tuple[Dict[str, pd.DataFrame], Dict[str, str]]:
+    """
+    批量获取历史K线。返回 (成功: 代码 -> DataFrame, 失败: 代码 -> 原因)，成功结果按传入的代码顺序排列。
+    周线/月线等聚合周期先批量获取日线，再把所有代码拼接后一次性重采样。
+    """
+    fetch_period = "daily" if period in PERIOD_RULES else period
+    frames: Dict[str, pd.DataFrame] = {}
+    failures: Dict[str, str] = {}
+    async for code, df, message in iter_history_frames(codes, start_date, end_date, adjust, fetch_period,
+                                                       concurrency):
+        if df is None:
+            failures[code] = message
+        else:
+            frames[code] = df
+    if fetch_period != period and frames:
+        frames = _resample_frames(frames, period)
+    ordered = {code: frames[code] for code in dict.fromkeys(codes) if code in frames}
+    return ordered, failures
+
+
+def _resample_frames(frames: Dict[str, pd.DataFrame], period: str) -> Dict[str, pd.DataFrame]:
+    """把多个代码的日线拼成一张表，按 (代码, 周期) 一次分组聚合后再拆回各代码。"""
+    stacked = pd.concat([df.assign(__code=code) for code, df in frames.items()], ignore_index=True)
+    resampled = resample_period(stacked, period, code_column="__code")
+    resampled["date"] = resampled["date"].astype(str)
+    return {code: group.drop(columns="__code").reset_index(drop=True)
+            for code, group in resampled.groupby("__code", sort=False)}
+
+
+def describe_failures(failures: Dict[str, str], limit: int = 10) -> str:
+    """把失败明细整理为一句话，用于接口的 msg 字段。"""
+    parts = [f"{code}({reason})" for code, reason in list(failures.items())[:limit]]
+    if len(failures) > limit:
+        parts.append(f"等 {len(failures)} 个")
+    return "以下代码获取失败: " + "，".join(parts)
+
+
+async def backfill_history(codes: List[str], start_date: str, end_date: str, adjust: str = "qfq",
+                           concurrency: int = HISTORY_BATCH_CONCURRENCY) -> Dict[str, object]:
+    """
+    后台回填本地K线库：只触发获取，不保留数据。与 REST 接口共享同一套按市场限流。
+    返回 {"succeeded": 成功数, "failed": {代码: 原因}}。
+    """
+    succeeded = 0
+    failures: Dict[str, str] = {}
+    async for code, df, message in iter_history_frames(codes, start_date, end_date, adjust, "daily", concurrency):
+        if df is None:
+            failures[code] = message
+        else:
+            succeeded += 1
+    logger.info(f"历史K线回填完成: 成功 {succeeded} 个，失败 {len(failures)} 个。")
+    return {"succeeded": succeeded, "failed": failures}
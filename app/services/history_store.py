@@ -0,0 +1,304 @@
+# 文件: app/services/history_store.py
+
+import asyncio
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import pandas as pd
+
+from ..globals import logger
+from .trading_calendar import now_shanghai
+
+# 本地K线库文件位置
+HISTORY_STORE_PATH = os.getenv("HISTORY_STORE_PATH", os.path.join("cache", "history.sqlite3"))
+HISTORY_STORE_ENABLED = os.getenv("HISTORY_STORE_ENABLED", "true").lower() == "true"
+
+# 按列落盘的数值字段 (与 akshare 日线接口的列一致)
+VALUE_COLUMNS = ["开盘", "收盘", "最高", "最低", "成交量", "成交额", "振幅", "涨跌幅", "涨跌额", "换手率"]
+# akshare 以整数返回的列，读出时还原为整数，保证输出与直接请求上游一致
+INTEGER_COLUMNS = {"成交量"}
+DATE_COLUMN = "日期"
+
+# K线在北京时间的哪个时刻之后视为定型 (当日K线在此之前仍可能变化)；美股为次日
+_FINAL_CUTOFF = {
+    "A-Share": (0, datetime.time(15, 30)),
+    "HK-Share": (0, datetime.time(16, 30)),
+    "US-Share": (1, datetime.time(6, 0)),
+}
+
+# 同一天的收盘价相差超过此比例时认为复权因子已变化
+_ADJUST_TOLERANCE = 1e-6
+
+# 上游抓取函数: (start_yyyymmdd, end_yyyymmdd) -> DataFrame 或 None
+Fetcher = Callable[[str, str], Awaitable[Optional[pd.DataFrame]]]
+SeriesKey = Tuple[str, str, str]
+
+
+def to_date(value: str) -> datetime.date:
+    """接受 YYYY-MM-DD 或 YYYYMMDD。"""
+    return datetime.datetime.strptime(value.replace("-", "").strip(), "%Y%m%d").date()
+
+
+def to_ymd(value: datetime.date) -> str:
+    return value.strftime("%Y%m%d")
+
+
+def last_final_date(market: str, now: Optional[datetime.datetime] = None) -> datetime.date:
+    """返回最近一个已定型的K线日期 (不区分节假日：非交易日本来就没有K线)。"""
+    now = now or now_shanghai()
+    offset_days, cutoff = _FINAL_CUTOFF.get(market, _FINAL_CUTOFF["A-Share"])
+    candidate = now.date() - datetime.timedelta(days=offset_days)
+    if now.timetz().replace(tzinfo=None) < cutoff:
+        candidate -= datetime.timedelta(days=1)
+    return candidate
+
+
+class HistoryStore:
+    """
+    本地日K线库 (SQLite，按列存储)。
+
+    每个 (代码, 周期, 复权方式) 为一个序列，记录已向上游完整请求过的连续日期区间 [covered_start, covered_end]。
+    请求的区间在覆盖范围内时直接读本地；否则只向上游补齐缺失的头部或尾部。
+    补尾部时会连同最后一根已存K线一起重新拉取，若其收盘价变化 (如前复权因分红送转整体调整)，
+    整个序列作废并重新拉取。未定型的当日K线不计入覆盖范围，下次请求时会被刷新。
+    新序列或尾部的上游结果为空时不记录覆盖，下次请求会重新向上游确认；已有序列的头部为空
+    (如早于上市日期) 则说明该区间确实无数据，直接计入覆盖范围。
+    """
+
+    def __init__(self, path: str = HISTORY_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # 每个序列一把锁；没有协程持有或等待时自动回收
+        self._series_locks: "weakref.WeakValueDictionary[SeriesKey, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    # ------------------------------------------------------------------
+    # SQLite 访问 (同步，经 asyncio.to_thread 调用)
+    # ------------------------------------------------------------------
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS history_series ("
+                " code TEXT NOT NULL, period TEXT NOT NULL, adjust TEXT NOT NULL, market TEXT,"
+                " covered_start TEXT NOT NULL, covered_end TEXT NOT NULL,"
+                " columns TEXT NOT NULL, constants TEXT NOT NULL, updated_at REAL NOT NULL,"
+                " PRIMARY KEY (code, period, adjust))"
+            )
+            value_columns = ", ".join(
+                f'"{c}" {"INTEGER" if c in INTEGER_COLUMNS else "REAL"}' for c in VALUE_COLUMNS)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS history_bars ("
+                " code TEXT NOT NULL, period TEXT NOT NULL, adjust TEXT NOT NULL, date TEXT NOT NULL,"
+                f" {value_columns},"
+                " PRIMARY KEY (code, period, adjust, date)) WITHOUT ROWID"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _load_series(self, key: SeriesKey) -> Optional[dict]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT covered_start, covered_end, columns, constants, market FROM history_series"
+                " WHERE code=? AND period=? AND adjust=?", key).fetchone()
+        if row is None:
+            return None
+        return {
+            "covered_start": datetime.date.fromisoformat(row[0]),
+            "covered_end": datetime.date.fromisoformat(row[1]),
+            "columns": json.loads(row[2]),
+            "constants": json.loads(row[3]),
+            "market": row[4],
+        }
+
+    def _last_bar(self, key: SeriesKey, through: datetime.date) -> Optional[Tuple[str, float]]:
+        """覆盖范围内 (已定型) 的最后一根K线。"""
+        with self._lock:
+            return self._connect().execute(
+                'SELECT date, "收盘" FROM history_bars WHERE code=? AND period=? AND adjust=? AND date <= ?'
+                " ORDER BY date DESC LIMIT 1", (*key, through.isoformat())).fetchone()
+
+    def _save(self, key: SeriesKey, market: str, df: Optional[pd.DataFrame],
+              covered_start: datetime.date, covered_end: datetime.date,
+              columns: List[str], constants: dict, replace: bool = False):
+        rows = []
+        if df is not None and not df.empty:
+            dates = pd.to_datetime(df[DATE_COLUMN], errors="coerce").dt.strftime("%Y-%m-%d")
+            values = df.reindex(columns=VALUE_COLUMNS).astype(float)
+            values = values.where(values.notna(), None)
+            rows = [(*key, d, *v) for d, v in zip(dates, values.itertuples(index=False, name=None))
+                    if isinstance(d, str)]
+        placeholders = ", ".join("?" for _ in range(4 + len(VALUE_COLUMNS)))
+        value_columns = ", ".join(f'"{c}"' for c in VALUE_COLUMNS)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                if replace:
+                    conn.execute("DELETE FROM history_bars WHERE code=? AND period=? AND adjust=?", key)
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO history_bars (code, period, adjust, date, {value_columns})"
+                    f" VALUES ({placeholders})", rows)
+                conn.execute(
+                    "INSERT OR REPLACE INTO history_series"
+                    " (code, period, adjust, market, covered_start, covered_end, columns, constants, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*key, market, covered_start.isoformat(), covered_end.isoformat(),
+                     json.dumps(columns, ensure_ascii=False), json.dumps(constants, ensure_ascii=False), time.time()))
+
+    def _read(self, key: SeriesKey, start: datetime.date, end: datetime.date,
+              columns: List[str], constants: dict) -> pd.DataFrame:
+        value_columns = ", ".join(f'"{c}"' for c in VALUE_COLUMNS)
+        with self._lock:
+            df = pd.read_sql_query(
+                f"SELECT date AS \"{DATE_COLUMN}\", {value_columns} FROM history_bars"
+                " WHERE code=? AND period=? AND adjust=? AND date BETWEEN ? AND ? ORDER BY date",
+                self._connect(), params=(*key, start.isoformat(), end.isoformat()))
+        if df.empty:
+            return pd.DataFrame(columns=columns)
+        df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN]).dt.date
+        for column in INTEGER_COLUMNS:
+            if df[column].notna().all():
+                df[column] = df[column].astype("int64")
+        for column, value in constants.items():
+            df[column] = value
+        return df[[c for c in columns if c in df.columns]]
+
+    # ------------------------------------------------------------------
+    # 对外接口
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _describe(df: pd.DataFrame, previous: Optional[dict]) -> Tuple[List[str], dict]:
+        """记录原始列顺序；不在数值列中的常量列 (如 A 股的 股票代码) 单独保存。"""
+        if df is None or df.empty:
+            if previous:
+                return previous["columns"], previous["constants"]
+            return [DATE_COLUMN] + VALUE_COLUMNS, {}
+        constants = dict(previous["constants"]) if previous else {}
+        for column in df.columns:
+            if column != DATE_COLUMN and column not in VALUE_COLUMNS:
+                values = df[column].dropna().unique()
+                if len(values) == 1:
+                    value = values[0]
+                    constants[column] = value.item() if hasattr(value, "item") else value
+        columns = [c for c in df.columns if c == DATE_COLUMN or c in VALUE_COLUMNS or c in constants]
+        return columns, constants
+
+    @staticmethod
+    def _storable(df: Optional[pd.DataFrame]) -> bool:
+        if df is None or df.empty:
+            return True
+        if DATE_COLUMN not in df.columns:
+            return False
+        extra = [c for c in df.columns if c != DATE_COLUMN and c not in VALUE_COLUMNS]
+        return all(df[c].nunique(dropna=True) <= 1 for c in extra)
+
+    async def get_daily_bars(self, code: str, market: str, start_date: str, end_date: str, adjust: str,
+                             fetch: Fetcher, period: str = "daily") -> Optional[pd.DataFrame]:
+        """
+        返回 [start_date, end_date] 内的日K线 (与 akshare 返回的列一致)，只向上游请求本地缺失的部分。
+        上游失败时返回本地已有的数据；本地也没有时返回 None。
+        """
+        start, end = to_date(start_date), to_date(end_date)
+        if not HISTORY_STORE_ENABLED:
+            return await fetch(to_ymd(start), to_ymd(end))
+
+        key: SeriesKey = (code.upper(), period, adjust or "")
+        lock = self._series_locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._series_locks[key] = lock
+        async with lock:
+            try:
+                return await self._get_locked(key, market, start, end, fetch)
+            except sqlite3.Error as e:
+                logger.warning(f"本地K线库不可用，直接请求上游: {e}")
+                return await fetch(to_ymd(start), to_ymd(end))
+
+    async def _get_locked(self, key: SeriesKey, market: str, start: datetime.date, end: datetime.date,
+                          fetch: Fetcher) -> Optional[pd.DataFrame]:
+        final_through = last_final_date(market)
+        end_eff = min(end, now_shanghai().date())
+        series = await asyncio.to_thread(self._load_series, key)
+
+        if series is None:
+            df = await fetch(to_ymd(start), to_ymd(end_eff))
+            if df is None or df.empty or not self._storable(df):
+                return df
+            columns, constants = self._describe(df, None)
+            # covered_end 可能早于 start (只请求了未定型的当日K线)，表示尚无定型覆盖
+            await asyncio.to_thread(self._save, key, market, df, start, min(end_eff, final_through),
+                                    columns, constants)
+            logger.info(f"本地K线库新建序列 {key}，{len(df)} 根K线。")
+            return await asyncio.to_thread(self._read, key, start, end, columns, constants)
+
+        covered_start, covered_end = series["covered_start"], series["covered_end"]
+        columns, constants = series["columns"], series["constants"]
+        upstream_failed = False
+
+        # --- 补头部 ---
+        if start < covered_start:
+            head = await fetch(to_ymd(start), to_ymd(covered_start - datetime.timedelta(days=1)))
+            if head is None or not self._storable(head):
+                upstream_failed = True
+            else:
+                columns, constants = self._describe(head, {"columns": columns, "constants": constants})
+                covered_start = start
+                await asyncio.to_thread(self._save, key, market, head, covered_start, covered_end,
+                                        columns, constants)
+
+        # --- 补尾部 (连同最后一根已存K线，用于检测复权变化) ---
+        if end_eff > covered_end:
+            last_bar = await asyncio.to_thread(self._last_bar, key, covered_end)
+            tail_start = to_date(last_bar[0]) if last_bar else covered_end + datetime.timedelta(days=1)
+            tail = await fetch(to_ymd(min(tail_start, end_eff)), to_ymd(end_eff))
+            if tail is None or not self._storable(tail):
+                upstream_failed = True
+            elif not tail.empty:
+                new_end = max(covered_end, min(end_eff, final_through))
+                if last_bar and key[2] and self._adjust_changed(tail, last_bar):
+                    logger.info(f"{key} 复权因子已变化，重新拉取整个序列。")
+                    full = await fetch(to_ymd(covered_start), to_ymd(end_eff))
+                    if full is None or full.empty or not self._storable(full):
+                        upstream_failed = True
+                    else:
+                        columns, constants = self._describe(full, {"columns": columns, "constants": constants})
+                        await asyncio.to_thread(self._save, key, market, full, covered_start, new_end,
+                                                columns, constants, True)
+                else:
+                    columns, constants = self._describe(tail, {"columns": columns, "constants": constants})
+                    await asyncio.to_thread(self._save, key, market, tail, covered_start, new_end,
+                                            columns, constants)
+
+        if upstream_failed:
+            logger.warning(f"上游获取 {key} 的缺失区间失败，返回本地已有数据。")
+        df = await asyncio.to_thread(self._read, key, start, end, columns, constants)
+        if upstream_failed and df.empty:
+            return None
+        return df
+
+    @staticmethod
+    def _adjust_changed(tail: pd.DataFrame, last_bar: Tuple[str, float]) -> bool:
+        last_date, last_close = last_bar
+        if tail is None or tail.empty or last_close is None:
+            return False
+        dates = pd.to_datetime(tail[DATE_COLUMN], errors="coerce").dt.strftime("%Y-%m-%d")
+        matched = tail.loc[dates == last_date, "收盘"]
+        if matched.empty:
+            return False
+        new_close = float(matched.iloc[0])
+        return abs(new_close - last_close) > _ADJUST_TOLERANCE * max(abs(last_close), 1.0)
+
+
+# 进程级单例
+history_store = HistoryStore()
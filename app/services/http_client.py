@@ -0,0 +1,97 @@
+# 文件: app/services/http_client.py
+
+import asyncio
+import importlib.util
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+
+from ..globals import logger
+
+# --- 连接池配置 ---
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 1000))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 200))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30.0))
+# 单个主机的最大并发请求数
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", 64))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 10.0))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5.0))
+# 仅在安装了 h2 时启用 HTTP/2
+HTTP_ENABLE_HTTP2 = (os.getenv("HTTP_ENABLE_HTTP2", "true").lower() == "true"
+                     and importlib.util.find_spec("h2") is not None)
+
+
+class AsyncHTTPPool:
+    """
+    进程级共享的异步 HTTP 客户端。
+
+    所有上游请求 (行情、代码搜索、全市场列表等) 共用一个 httpx.AsyncClient，
+    按主机保持长连接池，并用每主机信号量限制并发；在应用启动时创建、关闭时释放。
+    请求直接运行在事件循环上，不再占用线程池。
+    """
+
+    def __init__(self, per_host_limit: int = HTTP_PER_HOST_LIMIT):
+        self.per_host_limit = per_host_limit
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    async def start(self):
+        if self._client is None:
+            self._client = self._create_client()
+            logger.info(f"共享 HTTP 客户端已创建 (HTTP/2: {HTTP_ENABLE_HTTP2}, 每主机并发: {self.per_host_limit})。")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._host_semaphores.clear()
+            logger.info("共享 HTTP 客户端已关闭。")
+
+    @staticmethod
+    def _create_client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            http2=HTTP_ENABLE_HTTP2,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # 未经启动钩子 (如脚本直接调用) 时惰性创建
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+
+    def _semaphore_for(self, url: str) -> asyncio.Semaphore:
+        host = httpx.URL(url).host
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_limit)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        async with self._semaphore_for(url):
+            return await self.client.request(method, url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        流式请求。连接存续期间一直占用主机并发名额 (推送长连接的总数由 QuoteFeedManager 另行限制)。
+        """
+        async with self._semaphore_for(url):
+            async with self.client.stream(method, url, **kwargs) as response:
+                yield response
+
+
+# 进程级单例，由 main.py 的启动/关闭钩子管理生命周期
+http_pool = AsyncHTTPPool()
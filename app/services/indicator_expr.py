@@ -0,0 +1,217 @@
+# 文件: app/services/indicator_expr.py
+
+import ast
+import re
+from typing import Callable, Dict, Mapping, Set
+
+import numpy as np
+import pandas as pd
+
+from . import indicators as kernels
+
+# 公式长度与语法树节点数上限
+MAX_FORMULA_LENGTH = 500
+MAX_FORMULA_NODES = 200
+
+# 行情变量：大小写不敏感，支持通达信风格的单字母简写
+_OHLCV_ALIASES = {
+    "OPEN": "open", "O": "open",
+    "HIGH": "high", "H": "high",
+    "LOW": "low", "L": "low",
+    "CLOSE": "close", "C": "close",
+    "VOLUME": "volume", "VOL": "volume", "V": "volume",
+    "AMOUNT": "turnover", "TURNOVER": "turnover",
+}
+# 实时行情字段 a1..aN (见 /api/data/field-mappings)，取最新快照值，对整段K线按常数参与计算
+_SNAPSHOT_FIELD = re.compile(r"^a\d+$")
+
+
+def _window(n) -> int:
+    if isinstance(n, (pd.Series, np.ndarray)) or int(n) != n or not 0 < n <= kernels.MAX_WINDOW:
+        raise ValueError(f"周期参数必须是 1~{kernels.MAX_WINDOW} 之间的整数常量")
+    return int(n)
+
+
+def _series(x, index) -> pd.Series:
+    return x if isinstance(x, pd.Series) else pd.Series(float(x), index=index)
+
+
+def _cross(a, b):
+    diff = a - b
+    return ((diff > 0) & (diff.shift(1) <= 0)).astype(float)
+
+
+# 函数名 -> (参数个数, 实现)。窗口参数由 _window 校验，只接受常量
+_FUNCTIONS: Dict[str, tuple] = {
+    "MA": (2, lambda x, n: kernels.ma(x, _window(n))),
+    "EMA": (2, lambda x, n: kernels.ema(x, _window(n))),
+    "SMA": (3, lambda x, n, m: kernels.sma(x, _window(n), _window(m))),
+    "STD": (2, lambda x, n: kernels.std(x, _window(n))),
+    "HHV": (2, lambda x, n: kernels.hhv(x, _window(n))),
+    "LLV": (2, lambda x, n: kernels.llv(x, _window(n))),
+    "SUM": (2, lambda x, n: x.rolling(_window(n), min_periods=1).sum()),
+    "REF": (2, lambda x, n: x.shift(_window(n))),
+    "COUNT": (2, lambda x, n: x.astype(bool).astype(float).rolling(_window(n), min_periods=1).sum()),
+    "CROSS": (2, _cross),
+    "ABS": (1, lambda x: x.abs()),
+    "SQRT": (1, lambda x: np.sqrt(x)),
+    "LOG": (1, lambda x: np.log(x)),
+    "MAX": (2, lambda a, b: np.maximum(a, b)),
+    "MIN": (2, lambda a, b: np.minimum(a, b)),
+    "IF": (3, None),  # 特殊处理，见 _Evaluator
+}
+
+_BIN_OPS: Dict[type, Callable] = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.Mod: lambda a, b: a % b,
+    ast.Pow: lambda a, b: a ** b,
+}
+_COMPARE_OPS: Dict[type, Callable] = {
+    ast.Gt: lambda a, b: a > b,
+    ast.GtE: lambda a, b: a >= b,
+    ast.Lt: lambda a, b: a < b,
+    ast.LtE: lambda a, b: a <= b,
+    ast.Eq: lambda a, b: a == b,
+    ast.NotEq: lambda a, b: a != b,
+}
+
+
+class Formula:
+    """
+    编译后的自定义公式。语法为 Python 表达式的一个安全子集：
+    四则运算、乘方、取模、比较、and/or/not、条件表达式 (x if c else y)，
+    变量为 OPEN/HIGH/LOW/CLOSE/VOLUME/AMOUNT (及 O/H/L/C/V 简写) 与实时字段 a1..aN，
+    函数为 MA/EMA/SMA/STD/HHV/LLV/SUM/REF/COUNT/CROSS/ABS/SQRT/LOG/MAX/MIN/IF (大小写不敏感)。
+    编译阶段即拒绝其他语法 (属性访问、下标、lambda 等)，求值时不会执行任意代码。
+    """
+
+    def __init__(self, source: str):
+        if not isinstance(source, str) or not source.strip():
+            raise ValueError("公式不能为空")
+        if len(source) > MAX_FORMULA_LENGTH:
+            raise ValueError(f"公式长度不能超过 {MAX_FORMULA_LENGTH} 个字符")
+        self.source = source.strip()
+        try:
+            self._tree = ast.parse(self.source, mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"公式语法错误: {e.msg}")
+        self.snapshot_fields: Set[str] = set()
+        self._validate(self._tree)
+
+    def _validate(self, tree: ast.AST):
+        nodes = list(ast.walk(tree))
+        if len(nodes) > MAX_FORMULA_NODES:
+            raise ValueError("公式过于复杂")
+        call_names = {id(node.func) for node in nodes if isinstance(node, ast.Call)}
+        for node in nodes:
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or node.func.id.upper() not in _FUNCTIONS:
+                    raise ValueError(f"不支持的函数: {ast.unparse(node.func)}")
+                arity = _FUNCTIONS[node.func.id.upper()][0]
+                if node.keywords or len(node.args) != arity:
+                    raise ValueError(f"{node.func.id} 需要 {arity} 个参数")
+            elif isinstance(node, ast.Name):
+                if id(node) in call_names:
+                    continue
+                if _SNAPSHOT_FIELD.match(node.id):
+                    self.snapshot_fields.add(node.id)
+                elif node.id.upper() not in _OHLCV_ALIASES:
+                    raise ValueError(f"未知的变量: {node.id}")
+            elif isinstance(node, ast.Constant):
+                if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                    raise ValueError("公式中只允许数值常量")
+            elif isinstance(node, ast.BinOp):
+                if type(node.op) not in _BIN_OPS:
+                    raise ValueError(f"不支持的运算符: {type(node.op).__name__}")
+            elif isinstance(node, ast.Compare):
+                if any(type(op) not in _COMPARE_OPS for op in node.ops):
+                    raise ValueError("不支持的比较运算符")
+            elif not isinstance(node, (ast.Expression, ast.UnaryOp, ast.BoolOp, ast.IfExp, ast.Load,
+                                       ast.USub, ast.UAdd, ast.Not, ast.And, ast.Or, *_BIN_OPS, *_COMPARE_OPS)):
+                raise ValueError(f"不支持的语法: {type(node).__name__}")
+
+    def evaluate(self, df: pd.DataFrame, snapshot: Mapping[str, object] = None) -> pd.Series:
+        """在整段K线 (英文列) 上向量化求值；snapshot 提供公式中用到的 a1..aN。"""
+        try:
+            return _Evaluator(kernels.numeric_frame(df), snapshot or {}).run(self._tree)
+        except (ArithmeticError, TypeError) as e:
+            raise ValueError(f"公式求值失败: {e}")
+
+
+class _Evaluator:
+    def __init__(self, frame: pd.DataFrame, snapshot: Mapping[str, object]):
+        self.frame = frame
+        self.snapshot = snapshot
+
+    def run(self, tree: ast.Expression) -> pd.Series:
+        result = self.eval(tree.body)
+        result = _series(result, self.frame.index)
+        if result.dtype == bool:
+            result = result.astype(float)
+        return result.replace([np.inf, -np.inf], np.nan)
+
+    def eval(self, node: ast.AST):
+        if isinstance(node, ast.Constant):
+            # 统一按浮点数计算，避免整数乘方构造超大整数
+            return float(node.value)
+        if isinstance(node, ast.Name):
+            if _SNAPSHOT_FIELD.match(node.id):
+                value = self.snapshot.get(node.id)
+                try:
+                    return float(value)
+                except (TypeError, ValueError):
+                    raise ValueError(f"实时字段 {node.id} 不是数值，无法参与计算")
+            return self.frame[_OHLCV_ALIASES[node.id.upper()]]
+        if isinstance(node, ast.BinOp):
+            return _BIN_OPS[type(node.op)](self.eval(node.left), self.eval(node.right))
+        if isinstance(node, ast.UnaryOp):
+            operand = self.eval(node.operand)
+            if isinstance(node.op, ast.Not):
+                return ~_series(operand, self.frame.index).astype(bool)
+            return -operand if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.Compare):
+            left, result = self.eval(node.left), None
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.eval(comparator)
+                part = _series(_COMPARE_OPS[type(op)](left, right), self.frame.index)
+                result = part if result is None else result & part
+                left = right
+            return result
+        if isinstance(node, ast.BoolOp):
+            values = [_series(self.eval(value), self.frame.index).astype(bool) for value in node.values]
+            result = values[0]
+            for value in values[1:]:
+                result = result & value if isinstance(node.op, ast.And) else result | value
+            return result
+        if isinstance(node, ast.IfExp):
+            return self._if(node.test, node.body, node.orelse)
+        if isinstance(node, ast.Call):
+            name = node.func.id.upper()
+            if name == "IF":
+                return self._if(*node.args)
+            args = [self.eval(arg) for arg in node.args]
+            if args and not isinstance(args[0], pd.Series) and name not in ("MAX", "MIN"):
+                args[0] = _series(args[0], self.frame.index)
+            return _FUNCTIONS[name][1](*args)
+        raise ValueError(f"不支持的语法: {type(node).__name__}")
+
+    def _if(self, test, body, orelse):
+        condition = _series(self.eval(test), self.frame.index).astype(bool)
+        yes, no = _series(self.eval(body), self.frame.index), _series(self.eval(orelse), self.frame.index)
+        return yes.where(condition, no)
+
+
+def compile_formulas(formulas: Mapping[str, str]) -> Dict[str, Formula]:
+    """编译 {输出名: 公式}，任一公式不合法时抛出 ValueError。"""
+    if not isinstance(formulas, Mapping):
+        raise ValueError("formulas 必须是 {名称: 公式} 的对象")
+    compiled = {}
+    for name, source in formulas.items():
+        try:
+            compiled[str(name)] = Formula(source)
+        except ValueError as e:
+            raise ValueError(f"公式 {name} 无效: {e}")
+    return compiled
@@ -0,0 +1,156 @@
+# 文件: app/services/indicator_service.py
+
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ..globals import logger
+from .data_service import get_historical_frame
+from .indicator_expr import Formula, compile_formulas
+from .indicators import Indicator, numeric_frame, parse_indicator_specs
+from .stock_data import get_stock_details_async
+
+# 增量状态缓存的序列数上限
+INDICATOR_CACHE_MAX_ENTRIES = int(os.getenv("INDICATOR_CACHE_MAX_ENTRIES", 256))
+# 单次请求 / 单个实体最多的指标与公式数
+MAX_INDICATORS_PER_REQUEST = int(os.getenv("MAX_INDICATORS_PER_REQUEST", 20))
+
+# 输出中附带的行情列
+BAR_COLUMNS = ["date", "open", "high", "low", "close", "volume"]
+
+
+class _IndicatorSeries:
+    """一组指标在某条K线序列上的已提交状态：最后一根 (可能尚未走完) 之前的全部K线。"""
+
+    def __init__(self, indicators: List[Indicator]):
+        self.indicators = indicators
+        self.values = np.empty((0, sum(len(ind.columns) for ind in indicators)))
+        self.anchor: Optional[Tuple[str, float]] = None  # 最后一根已提交K线的 (日期, 收盘价)
+
+    @property
+    def committed(self) -> int:
+        return len(self.values)
+
+
+class IndicatorCache:
+    """
+    按 (代码, 周期, 复权, 起始日期, 指标组合) 保存指标的增量状态。
+
+    首次请求时对整段K线做向量化计算并建立状态；之后同一序列只对新增K线调用各指标的 update，
+    每根新K线每个指标 O(1)。最后一根K线总是在状态副本上计算，不提交，因此盘中尚未走完的K线
+    被刷新时不会污染状态。已提交部分的日期或收盘价与新数据不一致 (如复权因子变化) 时整体重算。
+    """
+
+    def __init__(self, max_entries: int = INDICATOR_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, _IndicatorSeries]" = OrderedDict()
+
+    def compute(self, key: tuple, df: pd.DataFrame, specs: Sequence[str]) -> pd.DataFrame:
+        """返回与 df 同索引的各内置指标列。df 为 get_historical_frame 输出的英文列K线。"""
+        full_key = key + (tuple(specs),)
+        entry = self._entries.get(full_key)
+        if entry is None or not self._matches(entry, df):
+            entry = _IndicatorSeries(parse_indicator_specs(specs))
+            committed = df.iloc[:-1]
+            if len(committed):
+                entry.values = pd.concat([ind.batch(committed) for ind in entry.indicators], axis=1).to_numpy()
+            self._entries[full_key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(full_key)
+            new_bars = numeric_frame(df.iloc[entry.committed:-1]).to_dict(orient="records")
+            if new_bars:
+                rows = [sum((ind.update(bar) for ind in entry.indicators), []) for bar in new_bars]
+                entry.values = np.vstack([entry.values, np.asarray(rows, dtype=float)])
+
+        if len(df) > 1:
+            entry.anchor = (df["date"].iloc[-2], float(df["close"].iloc[-2]))
+        last_bar = numeric_frame(df.iloc[-1:]).to_dict(orient="records")[0]
+        last_row = sum((ind.copy().update(last_bar) for ind in entry.indicators), [])
+        values = np.vstack([entry.values, np.asarray([last_row], dtype=float)])
+        columns = [column for ind in entry.indicators for column in ind.columns]
+        return pd.DataFrame(values, index=df.index, columns=columns)
+
+    @staticmethod
+    def _matches(entry: _IndicatorSeries, df: pd.DataFrame) -> bool:
+        count = entry.committed
+        if count == 0 or entry.anchor is None or len(df) <= count:
+            return False
+        return (df["date"].iloc[count - 1] == entry.anchor[0]
+                and float(df["close"].iloc[count - 1]) == entry.anchor[1])
+
+    def clear(self):
+        self._entries.clear()
+
+
+# 进程级单例
+indicator_cache = IndicatorCache()
+
+
+def validate_indicator_request(specs: Sequence[str], formulas: Mapping[str, str]) -> Dict[str, Formula]:
+    """校验内置指标与自定义公式，返回编译后的公式；不合法时抛出 ValueError。"""
+    if not specs and not formulas:
+        raise ValueError("至少需要一个指标或公式")
+    if len(specs) + len(formulas) > MAX_INDICATORS_PER_REQUEST:
+        raise ValueError(f"单次最多计算 {MAX_INDICATORS_PER_REQUEST} 个指标")
+    parse_indicator_specs(specs)
+    return compile_formulas(formulas)
+
+
+def validate_custom_definition(definition: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    校验 CUSTOM 实体中的指标定义：
+    {"code": "600519", "indicators": ["MA:5", "MACD"], "formulas": {"强弱": "CLOSE / MA(CLOSE, 20) - 1"}}
+    code 可省略 (此时由请求参数提供)。不合法时抛出 ValueError。
+    """
+    specs = definition.get("indicators") or []
+    formulas = definition.get("formulas") or {}
+    if not isinstance(specs, list) or not all(isinstance(spec, str) for spec in specs):
+        raise ValueError("indicators 必须是字符串数组，如 [\"MA:5\", \"MACD\"]")
+    validate_indicator_request(specs, formulas)
+    return definition
+
+
+def _to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    df = df.astype(object).where(pd.notna(df), None)
+    return df.to_dict(orient="records")
+
+
+async def compute_indicator_frame(code: str, start_date: str, end_date: str, adjust: str, period: str,
+                                  specs: Sequence[str], formulas: Mapping[str, str]
+                                  ) -> Tuple[Optional[List[Dict[str, Any]]], str, str]:
+    """
+    获取历史K线并计算内置指标与自定义公式。
+    返回 (每根K线一行的记录或 None, 市场, 说明信息)；指标或公式不合法时抛出 ValueError。
+    """
+    compiled = validate_indicator_request(specs, formulas)
+    code = code.strip()
+    df, market, message = await get_historical_frame(code, start_date, end_date, adjust, period)
+    if df is None or df.empty:
+        return None, market, message
+    df = df.reset_index(drop=True)
+
+    parts = [df.reindex(columns=BAR_COLUMNS)]
+    if specs:
+        key = (code, period, adjust, start_date)
+        parts.append(indicator_cache.compute(key, df, specs))
+    if compiled:
+        snapshot = await _load_snapshot(code, compiled.values())
+        parts.append(pd.DataFrame({name: formula.evaluate(df, snapshot) for name, formula in compiled.items()},
+                                  index=df.index))
+    return _to_records(pd.concat(parts, axis=1)), market, message
+
+
+async def _load_snapshot(code: str, formulas) -> Dict[str, Any]:
+    """公式用到 a1..aN 时才请求一次实时行情快照。"""
+    if not any(formula.snapshot_fields for formula in formulas):
+        return {}
+    details = await get_stock_details_async(code)
+    if not details:
+        logger.warning(f"获取 {code} 的实时行情失败，公式中的实时字段将无法计算。")
+        raise ValueError(f"无法获取 {code} 的实时行情，公式中的 a1..aN 字段不可用")
+    return details
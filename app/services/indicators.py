@@ -0,0 +1,385 @@
+# 文件: app/services/indicators.py
+
+import copy
+import math
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 指标计算统一使用英文列 (get_historical_frame 重命名后的列)
+OHLCV_COLUMNS = ("open", "high", "low", "close", "volume", "turnover")
+# 窗口参数上限，避免恶意参数耗尽内存
+MAX_WINDOW = 1000
+
+
+# --- 向量化内核 (口径与通达信/同花顺一致) ---
+
+def ma(series: pd.Series, n: int) -> pd.Series:
+    return series.rolling(n, min_periods=n).mean()
+
+
+def ema(series: pd.Series, n: int) -> pd.Series:
+    return series.ewm(span=n, adjust=False).mean()
+
+
+def sma(series: pd.Series, n: int, m: int = 1) -> pd.Series:
+    """通达信 SMA(X,N,M)：Y = (M*X + (N-M)*Y') / N。"""
+    return series.ewm(alpha=m / n, adjust=False).mean()
+
+
+def std(series: pd.Series, n: int) -> pd.Series:
+    return series.rolling(n, min_periods=n).std()
+
+
+def hhv(series: pd.Series, n: int) -> pd.Series:
+    return series.rolling(n, min_periods=1).max()
+
+
+def llv(series: pd.Series, n: int) -> pd.Series:
+    return series.rolling(n, min_periods=1).min()
+
+
+def _rsv(close: pd.Series, high: pd.Series, low: pd.Series, n: int) -> pd.Series:
+    lowest, highest = llv(low, n), hhv(high, n)
+    spread = highest - lowest
+    # 区间内最高价等于最低价时 RSV 取中值 50
+    return ((close - lowest) / spread.where(spread != 0) * 100).fillna(50.0)
+
+
+# --- 增量计算的基础状态 ---
+
+class _Ema:
+    """单个 EMA/SMA 递推状态：每根K线 O(1)。"""
+
+    __slots__ = ("alpha", "value")
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.value: Optional[float] = None
+
+    def update(self, x: float) -> Optional[float]:
+        if x is None or math.isnan(x):
+            return self.value
+        self.value = x if self.value is None else self.alpha * x + (1 - self.alpha) * self.value
+        return self.value
+
+
+class _Window:
+    """定长窗口的和与平方和：每根K线 O(1)。"""
+
+    __slots__ = ("n", "values", "total", "total_sq")
+
+    def __init__(self, n: int):
+        self.n = n
+        self.values: deque = deque()
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def push(self, x: float):
+        self.values.append(x)
+        self.total += x
+        self.total_sq += x * x
+        if len(self.values) > self.n:
+            old = self.values.popleft()
+            self.total -= old
+            self.total_sq -= old * old
+
+    @property
+    def full(self) -> bool:
+        return len(self.values) == self.n
+
+
+class _Extreme:
+    """滑动窗口最大/最小值 (单调队列)，均摊 O(1)。"""
+
+    __slots__ = ("n", "is_max", "items", "index")
+
+    def __init__(self, n: int, is_max: bool):
+        self.n = n
+        self.is_max = is_max
+        self.items: deque = deque()  # (序号, 值)
+        self.index = 0
+
+    def push(self, x: float) -> float:
+        items = self.items
+        while items and (items[-1][1] <= x if self.is_max else items[-1][1] >= x):
+            items.pop()
+        items.append((self.index, x))
+        if items[0][0] <= self.index - self.n:
+            items.popleft()
+        self.index += 1
+        return items[0][1]
+
+
+def _nan(value: Optional[float]) -> float:
+    return float("nan") if value is None else value
+
+
+# --- 内置指标 ---
+
+class Indicator(ABC):
+    """
+    内置指标的基类。一个实例同时是一份增量状态：
+    - batch(df): 向量化计算整段K线，并把自身状态推进到最后一根之后；
+    - update(bar): 追加一根K线，O(1) 返回该K线的各输出值；
+    - copy(): 复制状态，用于计算尚未走完的最后一根而不提交。
+    """
+
+    name = ""
+    defaults: Tuple[int, ...] = ()
+    outputs: Tuple[str, ...] = ()
+
+    def __init__(self, *params: int):
+        if len(params) > len(self.defaults):
+            raise ValueError(f"{self.name} 最多接受 {len(self.defaults)} 个参数")
+        values = tuple(params) + self.defaults[len(params):]
+        if any(int(v) != v or v <= 0 or v > MAX_WINDOW for v in values):
+            raise ValueError(f"{self.name} 的参数必须是 1~{MAX_WINDOW} 之间的整数")
+        self.params = tuple(int(v) for v in values)
+        self.reset()
+
+    @property
+    def label(self) -> str:
+        return self.name + "_".join(str(p) for p in self.params)
+
+    @property
+    def columns(self) -> List[str]:
+        if len(self.outputs) == 1:
+            return [self.label]
+        return [f"{self.label}.{output}" for output in self.outputs]
+
+    @abstractmethod
+    def reset(self):
+        ...
+
+    @abstractmethod
+    def compute(self, df: pd.DataFrame) -> pd.DataFrame:
+        ...
+
+    @abstractmethod
+    def update(self, bar: Dict[str, float]) -> List[float]:
+        ...
+
+    def batch(self, df: pd.DataFrame) -> pd.DataFrame:
+        frame = numeric_frame(df)
+        out = self.compute(frame)
+        out.columns = self.columns
+        self.reset()
+        self._seed(frame)
+        return out
+
+    def _seed(self, df: pd.DataFrame):
+        """默认逐根回放建立状态；递推类指标只需回放尾部即可得到相同状态时应覆盖此方法。"""
+        for bar in df[list(OHLCV_COLUMNS)].itertuples(index=False):
+            self.update(bar._asdict())
+
+    def copy(self) -> "Indicator":
+        return copy.deepcopy(self)
+
+
+class MA(Indicator):
+    name = "MA"
+    defaults = (5,)
+    outputs = ("MA",)
+
+    def reset(self):
+        self._window = _Window(self.params[0])
+
+    def compute(self, df):
+        return pd.DataFrame({"MA": ma(df["close"], self.params[0])})
+
+    def _seed(self, df):
+        for x in df["close"].iloc[-self.params[0]:]:
+            self._window.push(float(x))
+
+    def update(self, bar):
+        self._window.push(float(bar["close"]))
+        return [self._window.total / self._window.n if self._window.full else float("nan")]
+
+
+class EMA(Indicator):
+    name = "EMA"
+    defaults = (12,)
+    outputs = ("EMA",)
+
+    def reset(self):
+        self._ema = _Ema(2 / (self.params[0] + 1))
+
+    def compute(self, df):
+        result = ema(df["close"], self.params[0])
+        self._last = result.iloc[-1] if len(result) else None
+        return pd.DataFrame({"EMA": result})
+
+    def _seed(self, df):
+        self._ema.value = None if self._last is None or pd.isna(self._last) else float(self._last)
+
+    def update(self, bar):
+        return [_nan(self._ema.update(float(bar["close"])))]
+
+
+class MACD(Indicator):
+    name = "MACD"
+    defaults = (12, 26, 9)
+    outputs = ("DIF", "DEA", "MACD")
+
+    def reset(self):
+        fast, slow, signal = self.params
+        self._fast, self._slow, self._signal = _Ema(2 / (fast + 1)), _Ema(2 / (slow + 1)), _Ema(2 / (signal + 1))
+
+    def compute(self, df):
+        fast, slow, signal = self.params
+        ema_fast, ema_slow = ema(df["close"], fast), ema(df["close"], slow)
+        dif = ema_fast - ema_slow
+        dea = ema(dif, signal)
+        self._last = tuple(s.iloc[-1] if len(s) else None for s in (ema_fast, ema_slow, dea))
+        return pd.DataFrame({"DIF": dif, "DEA": dea, "MACD": (dif - dea) * 2})
+
+    def _seed(self, df):
+        for state, value in zip((self._fast, self._slow, self._signal), self._last):
+            state.value = None if value is None or pd.isna(value) else float(value)
+
+    def update(self, bar):
+        close = float(bar["close"])
+        fast, slow = self._fast.update(close), self._slow.update(close)
+        if fast is None or slow is None:
+            return [float("nan")] * 3
+        dif = fast - slow
+        dea = self._signal.update(dif)
+        return [dif, dea, (dif - dea) * 2]
+
+
+class RSI(Indicator):
+    name = "RSI"
+    defaults = (6,)
+    outputs = ("RSI",)
+
+    def reset(self):
+        alpha = 1 / self.params[0]
+        self._gain, self._move = _Ema(alpha), _Ema(alpha)
+        self._prev: Optional[float] = None
+
+    def compute(self, df):
+        n = self.params[0]
+        diff = df["close"].diff()
+        gain, move = sma(diff.clip(lower=0), n), sma(diff.abs(), n)
+        self._last = (gain.iloc[-1] if len(gain) else None, move.iloc[-1] if len(move) else None,
+                      df["close"].iloc[-1] if len(df) else None)
+        return pd.DataFrame({"RSI": gain / move.where(move != 0) * 100})
+
+    def _seed(self, df):
+        gain, move, prev = self._last
+        self._gain.value = None if gain is None or pd.isna(gain) else float(gain)
+        self._move.value = None if move is None or pd.isna(move) else float(move)
+        self._prev = None if prev is None else float(prev)
+
+    def update(self, bar):
+        close = float(bar["close"])
+        if self._prev is None:
+            self._prev = close
+            return [float("nan")]
+        diff = close - self._prev
+        self._prev = close
+        gain, move = self._gain.update(max(diff, 0.0)), self._move.update(abs(diff))
+        return [gain / move * 100 if move else float("nan")]
+
+
+class KDJ(Indicator):
+    name = "KDJ"
+    defaults = (9, 3, 3)
+    outputs = ("K", "D", "J")
+
+    def reset(self):
+        n, k_n, d_n = self.params
+        self._high, self._low = _Extreme(n, True), _Extreme(n, False)
+        self._k, self._d = _Ema(1 / k_n), _Ema(1 / d_n)
+
+    def compute(self, df):
+        n, k_n, d_n = self.params
+        rsv = _rsv(df["close"], df["high"], df["low"], n)
+        k = sma(rsv, k_n)
+        d = sma(k, d_n)
+        self._last = (k.iloc[-1] if len(k) else None, d.iloc[-1] if len(d) else None)
+        return pd.DataFrame({"K": k, "D": d, "J": 3 * k - 2 * d})
+
+    def _seed(self, df):
+        for high, low in zip(df["high"].iloc[-self.params[0]:], df["low"].iloc[-self.params[0]:]):
+            self._high.push(float(high))
+            self._low.push(float(low))
+        self._k.value, self._d.value = (None if v is None or pd.isna(v) else float(v) for v in self._last)
+
+    def update(self, bar):
+        highest, lowest = self._high.push(float(bar["high"])), self._low.push(float(bar["low"]))
+        spread = highest - lowest
+        rsv = (float(bar["close"]) - lowest) / spread * 100 if spread else 50.0
+        k = self._k.update(rsv)
+        d = self._d.update(k)
+        return [k, d, 3 * k - 2 * d]
+
+
+class BOLL(Indicator):
+    name = "BOLL"
+    defaults = (20, 2)
+    outputs = ("MID", "UPPER", "LOWER")
+
+    def reset(self):
+        self._window = _Window(self.params[0])
+
+    def compute(self, df):
+        n, width = self.params
+        mid, dev = ma(df["close"], n), std(df["close"], n)
+        return pd.DataFrame({"MID": mid, "UPPER": mid + width * dev, "LOWER": mid - width * dev})
+
+    def _seed(self, df):
+        for x in df["close"].iloc[-self.params[0]:]:
+            self._window.push(float(x))
+
+    def update(self, bar):
+        window = self._window
+        window.push(float(bar["close"]))
+        if not window.full:
+            return [float("nan")] * 3
+        n, width = self.params
+        mid = window.total / n
+        variance = max((window.total_sq - n * mid * mid) / (n - 1), 0.0) if n > 1 else float("nan")
+        dev = math.sqrt(variance)
+        return [mid, mid + width * dev, mid - width * dev]
+
+
+BUILTIN_INDICATORS = {cls.name: cls for cls in (MA, EMA, MACD, RSI, KDJ, BOLL)}
+
+
+def parse_indicator_spec(spec: str) -> Indicator:
+    """
+    解析 "名称[:参数1[:参数2...]]" 形式的内置指标，如 MA:5、MACD:12:26:9、BOLL。
+    名称不区分大小写；参数省略时使用默认值。
+    """
+    parts = [part.strip() for part in str(spec).split(":")]
+    cls = BUILTIN_INDICATORS.get(parts[0].upper())
+    if cls is None:
+        raise ValueError(f"未知的指标: {parts[0]}，可用: {', '.join(BUILTIN_INDICATORS)}")
+    try:
+        params = [int(p) for p in parts[1:] if p]
+    except ValueError:
+        raise ValueError(f"指标参数必须是整数: {spec}")
+    return cls(*params)
+
+
+def parse_indicator_specs(specs: Sequence[str]) -> List[Indicator]:
+    return [parse_indicator_spec(spec) for spec in specs]
+
+
+def compute_indicators(df: pd.DataFrame, indicators: Sequence[Indicator]) -> pd.DataFrame:
+    """对整段K线做向量化计算，返回与 df 同索引的各指标列。"""
+    if not indicators:
+        return pd.DataFrame(index=df.index)
+    frame = numeric_frame(df)
+    return pd.concat([indicator.compute(frame).set_axis(indicator.columns, axis=1) for indicator in indicators],
+                     axis=1)
+
+
+def numeric_frame(df: pd.DataFrame) -> pd.DataFrame:
+    frame = df.reindex(columns=list(OHLCV_COLUMNS))
+    return frame.apply(pd.to_numeric, errors="coerce").astype(np.float64)
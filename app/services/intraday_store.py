@@ -0,0 +1,147 @@
+# 文件: app/services/intraday_store.py
+
+import asyncio
+import datetime
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+
+import pandas as pd
+
+from ..globals import logger
+from .trading_calendar import PHASE_AFTERNOON, PHASE_MORNING, market_phase, now_shanghai
+
+# 同一序列两次增量请求之间的最小间隔 (秒)：图表高频刷新时直接使用缓存
+INTRADAY_MIN_REFRESH_SECONDS = float(os.getenv("INTRADAY_MIN_REFRESH_SECONDS", 3))
+# 最多缓存的 (代码, 周期, 复权) 序列数，超出后淘汰最久未使用的
+INTRADAY_CACHE_MAX_ENTRIES = int(os.getenv("INTRADAY_CACHE_MAX_ENTRIES", 512))
+
+TIME_COLUMN = "时间"
+# 首次加载时的起始时刻 (与 akshare 默认值一致，即取上游能给出的全部分钟线)
+_EARLIEST = "1979-09-01 09:32:00"
+
+# 上游抓取函数: 起始时刻 ("YYYY-MM-DD HH:MM:SS"，含) -> DataFrame 或 None
+Fetcher = Callable[[str], Awaitable[Optional[pd.DataFrame]]]
+SeriesKey = Tuple[str, str, str, str]
+
+
+def _bound(value: Optional[str], end_of_day: bool) -> Optional[str]:
+    """把 YYYY-MM-DD / YYYYMMDD / 带时刻的字符串统一为可与 时间 列直接比较的格式。"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        if len(value) <= 10:
+            day = datetime.datetime.strptime(value.replace("-", ""), "%Y%m%d")
+            return day.strftime("%Y-%m-%d") + (" 23:59:59" if end_of_day else " 00:00:00")
+        return pd.Timestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+class _Series:
+    def __init__(self):
+        self.bars: Optional[pd.DataFrame] = None
+        self.session_day: Optional[datetime.date] = None
+        self.refreshed_at = 0.0  # time.monotonic()
+        self.refreshed_wall: Optional[datetime.datetime] = None
+        self.lock = asyncio.Lock()
+
+
+class IntradayStore:
+    """
+    分钟线的进程内缓存，按 (代码, 市场, 周期, 复权) 各保存一份当日可用的全部分钟线。
+
+    - 每个交易日第一次请求时全量加载 (跨日即换日，复权因子也可能随之变化)；
+    - 盘中只请求最后一根缓存K线及之后的数据，替换尚未走完的最后一根并追加新K线；
+    - 距上次请求不足 INTRADAY_MIN_REFRESH_SECONDS，或 A 股处于午休/收盘且本阶段已刷新过时，直接返回缓存；
+    - 同一序列的并发请求合并为一次上游调用；增量请求失败时退回缓存数据。
+    """
+
+    def __init__(self, max_entries: int = INTRADAY_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._series: "OrderedDict[SeriesKey, _Series]" = OrderedDict()
+
+    def _get_series(self, key: SeriesKey) -> _Series:
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series()
+            while len(self._series) > self.max_entries:
+                self._series.popitem(last=False)
+        else:
+            self._series.move_to_end(key)
+        return series
+
+    @staticmethod
+    def _is_settled(series: _Series, market: str, now: datetime.datetime) -> bool:
+        """A 股午休或收盘后，本阶段内已刷新过的数据不会再变化。"""
+        if market != "A-Share" or series.refreshed_wall is None:
+            return False
+        phase, phase_start, _ = market_phase(now)
+        if phase in (PHASE_MORNING, PHASE_AFTERNOON):
+            return False
+        return series.refreshed_wall >= phase_start
+
+    async def get_bars(self, code: str, market: str, period: str, adjust: str, fetch: Fetcher,
+                       start_date: Optional[str] = None, end_date: Optional[str] = None) -> Optional[pd.DataFrame]:
+        """返回按 start_date/end_date 过滤后的分钟线 (含两端，只给日期时按整天计)；无数据时返回 None。"""
+        series = self._get_series((code, market, period, adjust))
+        async with series.lock:
+            bars = await self._refresh(series, code, market, fetch)
+        if bars is None or bars.empty:
+            return None
+
+        start, end = _bound(start_date, False), _bound(end_date, True)
+        if start is None and end is None:
+            return bars.copy()
+        times = bars[TIME_COLUMN]
+        mask = pd.Series(True, index=bars.index)
+        if start is not None:
+            mask &= times >= start
+        if end is not None:
+            mask &= times <= end
+        return bars[mask].reset_index(drop=True)
+
+    async def _refresh(self, series: _Series, code: str, market: str, fetch: Fetcher) -> Optional[pd.DataFrame]:
+        now = now_shanghai()
+        if series.bars is None or series.session_day != now.date():
+            # 首次加载或换日：全量加载
+            df = await fetch(_EARLIEST)
+            if df is None or df.empty or TIME_COLUMN not in df.columns:
+                # 换日加载失败时仍返回前一交易日的缓存
+                return series.bars
+            self._store(series, df.reset_index(drop=True), now)
+            return series.bars
+
+        if (time.monotonic() - series.refreshed_at < INTRADAY_MIN_REFRESH_SECONDS
+                or self._is_settled(series, market, now)):
+            return series.bars
+
+        last_time = series.bars[TIME_COLUMN].iloc[-1] if not series.bars.empty else _EARLIEST
+        tail = await fetch(last_time)
+        if tail is None or TIME_COLUMN not in getattr(tail, "columns", ()):
+            logger.warning(f"{code} 分钟线增量更新失败，使用缓存数据。")
+            return series.bars
+        if not tail.empty:
+            # 最后一根可能尚未走完，用上游的新值替换
+            kept = series.bars[series.bars[TIME_COLUMN] < tail[TIME_COLUMN].iloc[0]]
+            merged = pd.concat([kept, tail], ignore_index=True) if not kept.empty else tail.reset_index(drop=True)
+        else:
+            merged = series.bars
+        self._store(series, merged, now)
+        return series.bars
+
+    @staticmethod
+    def _store(series: _Series, bars: pd.DataFrame, now: datetime.datetime):
+        series.bars = bars
+        series.session_day = now.date()
+        series.refreshed_at = time.monotonic()
+        series.refreshed_wall = now
+
+    def clear(self):
+        self._series.clear()
+
+
+# 进程级单例
+intraday_store = IntradayStore()
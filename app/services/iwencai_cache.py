@@ -0,0 +1,172 @@
+# 文件: app/services/iwencai_cache.py
+
+import asyncio
+import collections
+import os
+import re
+import time
+import unicodedata
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+
+from ..globals import logger
+from .trading_calendar import PHASE_CLOSED, market_phase, now_shanghai
+
+# --- 缓存配置 ---
+IWENCAI_CACHE_ENABLED = os.getenv("IWENCAI_CACHE_ENABLED", "true").lower() == "true"
+# 盘中结果的有效期 (秒)；收盘后的结果一直有效到下一次开盘
+IWENCAI_CACHE_INTRADAY_TTL = float(os.getenv("IWENCAI_CACHE_INTRADAY_TTL", 60))
+# 最多缓存的查询数，超出后淘汰最久未使用的
+IWENCAI_CACHE_MAX_ENTRIES = int(os.getenv("IWENCAI_CACHE_MAX_ENTRIES", 256))
+
+PageChunk = List[Dict[str, Any]]
+CacheKey = Tuple[str, str, str, Optional[int]]
+
+
+def normalize_question(question: str) -> str:
+    """全角转半角、去首尾空白、合并连续空白并转为小写，使 'MACD金叉' 与 ' macd金叉 ' 命中同一条缓存。"""
+    text = unicodedata.normalize("NFKC", question or "")
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class _CacheEntry:
+    """一次查询的结果：按到达顺序保存的分页数据块，抓取进行中时可被多个等待者同时跟随。"""
+
+    __slots__ = ("chunks", "done", "error", "expires_at", "task", "_changed")
+
+    def __init__(self, expires_at: float):
+        self.chunks: List[PageChunk] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.expires_at = expires_at
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        # 唤醒当前所有等待者，之后的等待者使用新的事件
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, chunk: PageChunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def follow(self) -> AsyncGenerator[PageChunk, None]:
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class IWenCaiResultCache:
+    """
+    问财选股结果缓存。
+
+    键为 (规范化问句, 意图, 交易时段, limit)；盘中条目在 IWENCAI_CACHE_INTRADAY_TTL 后过期 (且不跨越
+    午休/收盘)，收盘后的条目有效到下一次开盘。相同查询并发到达时只向问财发起一次抓取，
+    抓到的每一页同时推给所有等待者；命中缓存时按原有的分页顺序原样重放。
+    抓取失败或不完整 (有分页获取失败，producer 最后抛出异常) 的结果不会被缓存，
+    已推给等待者的分页之后会收到同一个异常。
+    """
+
+    def __init__(self, intraday_ttl: float = IWENCAI_CACHE_INTRADAY_TTL,
+                 max_entries: int = IWENCAI_CACHE_MAX_ENTRIES):
+        self.intraday_ttl = intraday_ttl
+        self.max_entries = max(1, max_entries)
+        self._entries: "collections.OrderedDict[CacheKey, _CacheEntry]" = collections.OrderedDict()
+
+    def _key_and_expiry(self, question: str, secondary_intent: str,
+                        limit: Optional[int] = None) -> Tuple[CacheKey, float]:
+        now = now_shanghai()
+        phase, phase_start, phase_end = market_phase(now)
+        seconds_left = (phase_end - now).total_seconds()
+        if phase != PHASE_CLOSED:
+            seconds_left = min(seconds_left, self.intraday_ttl)
+        session = f"{phase_start:%Y%m%d%H%M}-{phase}"
+        key = (normalize_question(question), (secondary_intent or "").strip().lower(), session, limit)
+        return key, time.monotonic() + max(seconds_left, 0.0)
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [k for k, entry in self._entries.items() if entry.done and entry.expires_at <= now]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            # 只淘汰已完成的条目，进行中的抓取仍有等待者
+            for key, entry in self._entries.items():
+                if entry.done:
+                    del self._entries[key]
+                    break
+            else:
+                break
+
+    async def _produce(self, key: CacheKey, entry: _CacheEntry,
+                       producer: Callable[[], AsyncGenerator[PageChunk, None]]):
+        try:
+            async for chunk in producer():
+                if chunk:
+                    entry.append(chunk)
+        except asyncio.CancelledError:
+            entry.finish(asyncio.CancelledError())
+            self._entries.pop(key, None)
+            raise
+        except Exception as e:
+            entry.finish(e)
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+            logger.warning(f"问财查询 '{key[0]}' 抓取失败或结果不完整，未缓存: {e}")
+            return
+        entry.finish()
+        logger.info(f"问财查询 '{key[0]}' 已缓存 {sum(len(c) for c in entry.chunks)} 行。")
+
+    async def stream(self, question: str, secondary_intent: str,
+                     producer: Callable[[], AsyncGenerator[PageChunk, None]],
+                     limit: Optional[int] = None) -> AsyncGenerator[PageChunk, None]:
+        """
+        按分页顺序产出查询结果。producer 是无参的异步生成器工厂，只在未命中缓存时调用一次。
+        抓取在独立任务中进行，发起者中途断开不会影响其他等待者和缓存。
+        limit 不同的查询结果不同，分别缓存。
+        """
+        if not IWENCAI_CACHE_ENABLED:
+            async for chunk in producer():
+                yield chunk
+            return
+
+        key, expires_at = self._key_and_expiry(question, secondary_intent, limit)
+        entry = self._entries.get(key)
+        if entry is not None and entry.done and entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            entry = _CacheEntry(expires_at)
+            self._entries[key] = entry
+            self._evict()
+            entry.task = asyncio.create_task(self._produce(key, entry, producer))
+        else:
+            self._entries.move_to_end(key)
+            if entry.done:
+                logger.info(f"问财查询 '{key[0]}' 命中缓存。")
+
+        async for chunk in entry.follow():
+            yield chunk
+
+    async def close(self):
+        tasks = [entry.task for entry in self._entries.values() if entry.task and not entry.task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._entries.clear()
+
+
+# 进程级单例
+iwencai_result_cache = IWenCaiResultCache()
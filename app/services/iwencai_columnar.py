@@ -0,0 +1,124 @@
+# 文件: app/services/iwencai_columnar.py
+
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+# 问财列名中嵌入的日期/区间，如 "区间涨跌幅[20250101-20250301]"、"收盘价:不复权[20250301]"
+_BRACKET_PATTERN = re.compile(r"\[[^\]]*\]")
+
+
+def normalize_column_name(name: str) -> str:
+    """去掉列名中方括号包裹的日期部分并去除首尾空白。"""
+    return _BRACKET_PATTERN.sub("", name).strip() or name
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """解析逗号分隔的 fields 参数；为空时返回 None，表示不做投影。"""
+    if not fields:
+        return None
+    parsed = [f.strip() for f in fields.split(",") if f.strip()]
+    return parsed or None
+
+
+def _json_type(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, (list, tuple)):
+        return "array"
+    return "string"
+
+
+class ColumnarEncoder:
+    """
+    把问财分页结果 (每行一个 dict) 转换为列式帧，每个连接一个实例。
+
+    - header 帧: {"type": "header", "columns": [{"name", "source", "type"}, ...]}，
+      name 为去掉日期后的列名 (重名时保留原列名)，source 为问财原始列名，
+      type 为 number/string/bool/object/array/null，按首次出现的非空值推断；
+    - rows 帧: {"type": "rows", "rows": [[...], ...]}，值的顺序与 header 中的列一致。
+    后续分页出现新列或之前全为空的列首次有值时，会再发送一个包含全部列的 header 帧。
+    fields 投影同时匹配规范化列名和原始列名，未命中的列在服务端直接丢弃。
+    """
+
+    def __init__(self, fields: Optional[Iterable[str]] = None):
+        self.fields = set(fields) if fields else None
+        self._sources: List[str] = []
+        self._known: set = set()
+        self._columns: List[Dict[str, Any]] = []
+
+    def _wanted(self, source: str, name: str) -> bool:
+        return self.fields is None or source in self.fields or name in self.fields
+
+    def _register_columns(self, rows: List[Dict[str, Any]]) -> bool:
+        used_names = {column["name"] for column in self._columns}
+        added = False
+        for row in rows:
+            for source in row:
+                if source in self._known:
+                    continue
+                self._known.add(source)
+                name = normalize_column_name(source)
+                if not self._wanted(source, name):
+                    continue
+                if name in used_names:
+                    name = source
+                used_names.add(name)
+                self._sources.append(source)
+                self._columns.append({"name": name, "source": source, "type": None})
+                added = True
+        return added
+
+    def _infer_types(self, rows: List[Dict[str, Any]]) -> bool:
+        changed = False
+        for column in self._columns:
+            if column["type"] is not None:
+                continue
+            source = column["source"]
+            for row in rows:
+                inferred = _json_type(row.get(source))
+                if inferred is not None:
+                    column["type"] = inferred
+                    changed = True
+                    break
+        return changed
+
+    def header(self) -> Dict[str, Any]:
+        return {
+            "type": "header",
+            "columns": [dict(column, type=column["type"] or "null") for column in self._columns],
+        }
+
+    def encode(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """返回本批次需要发送的帧 (可能先有一个 header 帧)。"""
+        frames = []
+        added = self._register_columns(rows)
+        if self._infer_types(rows) or added:
+            frames.append(self.header())
+        sources = self._sources
+        frames.append({"type": "rows", "rows": [[row.get(source) for source in sources] for row in rows]})
+        return frames
+
+
+def project_rows(rows: List[Dict[str, Any]], fields: Optional[Iterable[str]]) -> List[Dict[str, Any]]:
+    """对行式输出做字段投影，同时匹配规范化列名和原始列名。"""
+    if not fields:
+        return rows
+    wanted = set(fields)
+    keep_cache: Dict[str, bool] = {}
+
+    def keep(source: str) -> bool:
+        result = keep_cache.get(source)
+        if result is None:
+            result = source in wanted or normalize_column_name(source) in wanted
+            keep_cache[source] = result
+        return result
+
+    return [{key: value for key, value in row.items() if keep(key)} for row in rows]
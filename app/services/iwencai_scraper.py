@@ -3,12 +3,14 @@
 import httpx
 import asyncio
 import json
+import collections
 import math
 import os
-import subprocess
-from typing import AsyncGenerator, List, Dict, Any
+import random
+from typing import AsyncGenerator, Awaitable, Callable, List, Dict, Any, Optional
 
 from ..globals import logger
+from .hexin_token import hexin_token_provider, HexinTokenError
 from fake_useragent import UserAgent
 
 
@@ -24,8 +26,33 @@ class ScraperException(Exception):
         super().__init__(self.message)
 
 
+class IncompleteResultError(ScraperException):
+    """部分分页重试后仍获取失败：已取到的分页照常产出，结果整体不完整。"""
+
+    def __init__(self, failed_pages: List[int]):
+        self.failed_pages = failed_pages
+        super().__init__(f"第 {', '.join(map(str, failed_pages))} 页获取失败，结果不完整，请稍后重试。", 502)
+
+
 # ==========================================================
 
+# 问财连接池配置
+IWENCAI_MAX_CONNECTIONS = int(os.getenv("IWENCAI_MAX_CONNECTIONS", 100))
+IWENCAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("IWENCAI_MAX_KEEPALIVE_CONNECTIONS", 20))
+IWENCAI_TIMEOUT = float(os.getenv("IWENCAI_TIMEOUT", 20.0))
+
+# 分页抓取配置
+PAGE_SIZE = 100
+# 同时在途的分页请求数，过大容易触发问财的 403 限流
+IWENCAI_PAGE_CONCURRENCY = int(os.getenv("IWENCAI_PAGE_CONCURRENCY", 4))
+# 是否按页码顺序产出分页
+IWENCAI_PAGE_ORDERED = os.getenv("IWENCAI_PAGE_ORDERED", "true").lower() == "true"
+# 403/429/5xx 及网络错误的重试次数与退避时间 (秒)
+IWENCAI_MAX_RETRIES = int(os.getenv("IWENCAI_MAX_RETRIES", 3))
+IWENCAI_RETRY_BACKOFF_INITIAL = float(os.getenv("IWENCAI_RETRY_BACKOFF_INITIAL", 0.5))
+IWENCAI_RETRY_BACKOFF_MAX = float(os.getenv("IWENCAI_RETRY_BACKOFF_MAX", 8.0))
+RETRYABLE_STATUS_CODES = {403, 429, 500, 502, 503, 504}
+
 REQUEST_COOKIES = {
     "other_uid": "Ths_iwencai_Xuangu_vdvjnt4x1qr8qltcbtsoakhlu7j43xs2",
     "ta_random_userid": "ju99ai1yph",
@@ -46,6 +73,13 @@ REQUEST_COOKIES = {
 
 
 class IWenCaiScraper:
+    """
+    问财选股爬虫。
+
+    作为应用级单例使用 (见模块底部的 wencai_scraper)：持有一个复用连接的 httpx 客户端，
+    由 main.py 的启动/关闭钩子创建和释放。hexin-v、user-agent 等每次查询不同的请求头
+    通过参数逐个请求传入，不修改共享客户端的状态，并发查询之间互不影响。
+    """
     GET_ROBOT_DATA_URL = "https://www.iwencai.com/customized/chart/get-robot-data"
     GET_DATA_LIST_URL = "https://www.iwencai.com/gateway/urp/v7/landing/getDataList"
 
@@ -60,48 +94,139 @@ class IWenCaiScraper:
                         self): return 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36'
 
             self.ua = FallbackUA()
-        self.async_client = httpx.AsyncClient(cookies=self._cookies, timeout=20.0)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = self._create_client()
+            logger.info("问财 HTTP 客户端已创建。")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("问财 HTTP 客户端已关闭。")
+
+    def _create_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            cookies=self._cookies,
+            timeout=IWENCAI_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=IWENCAI_MAX_CONNECTIONS,
+                max_keepalive_connections=IWENCAI_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+        )
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        # 未经启动钩子 (如脚本直接调用) 时惰性创建
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+
+    def _request_headers(self, v_value: str) -> Dict[str, str]:
+        return {'hexin-v': v_value, 'user-agent': self.ua.random}
 
     async def _get_v_value_async(self) -> str:
-        js_file_path = os.path.join(os.path.dirname(__file__), '2.js')
-        if not os.path.exists(js_file_path):
-            raise ScraperException("服务器内部配置错误 (缺少JS依赖)。")
+        # 由常驻 JS 工作进程和预生成令牌池提供，不再为每次查询启动 node 进程
+        try:
+            return await hexin_token_provider.get_token()
+        except HexinTokenError as e:
+            raise ScraperException(e.message)
+        except Exception as e:
+            logger.error(f"获取 hexin-v 令牌时发生未知错误: {e}")
+            raise ScraperException("生成请求凭证时发生未知错误。")
 
-        def run_node_sync():
+    async def _post_with_retry(self, url: str, headers: Dict[str, str], **kwargs) -> httpx.Response:
+        """POST 请求，遇到 403/429/5xx 或网络错误时按带抖动的指数退避重试。"""
+        attempt = 0
+        while True:
             try:
-                result = subprocess.run(
-                    ['node', js_file_path], capture_output=True, text=True, check=True, encoding='utf-8'
-                )
-                lines = result.stdout.strip().splitlines()
-                if not lines: raise ValueError("Node.js 脚本未返回有效数据。")
-                return lines[-1]
-            except FileNotFoundError:
-                raise ScraperException("服务器环境错误 (缺少Node.js运行时)。")
-            except subprocess.CalledProcessError as e:
-                logger.error(f"执行 '2.js' 失败: {e.stderr.strip()}")
-                raise ScraperException("无法生成有效的请求凭证。")
-            except Exception as e:
-                logger.error(f"执行 '2.js' 时发生未知错误: {e}")
-                raise ScraperException("生成请求凭证时发生未知错误。")
-
-        return await asyncio.to_thread(run_node_sync)
-
-    async def fetch_data_stream(self, question: str, secondary_intent: str) -> AsyncGenerator[
-        List[Dict[str, Any]], None]:
+                response = await self.async_client.post(url, headers=headers, **kwargs)
+                response.raise_for_status()
+                return response
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRYABLE_STATUS_CODES or attempt >= IWENCAI_MAX_RETRIES:
+                    raise
+                reason = f"状态码 {e.response.status_code}"
+            except httpx.TransportError as e:
+                if attempt >= IWENCAI_MAX_RETRIES:
+                    raise
+                reason = type(e).__name__
+            delay = random.uniform(0, min(IWENCAI_RETRY_BACKOFF_MAX, IWENCAI_RETRY_BACKOFF_INITIAL * (2 ** attempt)))
+            attempt += 1
+            logger.info(f"问财请求失败 ({reason})，{delay:.2f}s 后第 {attempt} 次重试。")
+            await asyncio.sleep(delay)
 
+    async def _fetch_page(self, page_data: Dict[str, Any], headers: Dict[str, str]) -> Optional[List[Dict[str, Any]]]:
+        """获取单个分页；无数据的分页返回空列表，重试后仍失败的分页记录日志并返回 None。"""
         try:
-            v_value = await self._get_v_value_async()
-            self.async_client.headers['hexin-v'] = v_value
-            self.async_client.headers['user-agent'] = self.ua.random
+            res = await self._post_with_retry(self.GET_DATA_LIST_URL, headers, data=page_data)
+            json_data = res.json()
+            if components := json_data.get('answer', {}).get('components'):
+                if data := components[0].get('data'):
+                    return data.get('datas') or []
+            return []
+        except httpx.HTTPStatusError as e:
+            logger.warning(f"处理第 {page_data['page']} 页响应时出错 (状态码: {e.response.status_code})")
+        except Exception as e:
+            logger.warning(f"处理第 {page_data['page']} 页时发生未知异常: {e}")
+        return None
+
+    @staticmethod
+    async def _paginate(page_nums: List[int], fetch: Callable[[int], Awaitable[Any]],
+                        concurrency: int, ordered: bool) -> AsyncGenerator[Any, None]:
+        """
+        以固定大小的窗口并发获取分页。
+        ordered=True 时经重排缓冲区按页码顺序产出，窗口同时限制在途请求和缓冲的页数；
+        否则按完成顺序产出。生成器被提前关闭时取消所有在途请求。
+        """
+        pending_pages = collections.deque(page_nums)
+        in_flight: Dict[asyncio.Task, int] = {}
+        buffered: Dict[int, Any] = {}
+        expected = collections.deque(page_nums)
+        try:
+            while pending_pages or in_flight or buffered:
+                # 有序模式下只允许领先当前待产出页 concurrency 页以内的请求
+                while pending_pages and len(in_flight) + len(buffered) < concurrency:
+                    page_num = pending_pages.popleft()
+                    in_flight[asyncio.create_task(fetch(page_num))] = page_num
+
+                if ordered and expected and expected[0] in buffered:
+                    yield buffered.pop(expected.popleft())
+                    continue
+
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    page_num = in_flight.pop(task)
+                    if ordered:
+                        buffered[page_num] = task.result()
+                    else:
+                        yield task.result()
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def fetch_data_stream(self, question: str, secondary_intent: str, limit: Optional[int] = None,
+                                ordered: bool = IWENCAI_PAGE_ORDERED,
+                                concurrency: int = IWENCAI_PAGE_CONCURRENCY) -> AsyncGenerator[
+        List[Dict[str, Any]], None]:
+        """
+        逐页产出问财选股结果。
+        limit: 只需要前 N 行时传入，凑够后不再请求后续分页；
+        ordered: 是否按页码顺序产出；concurrency: 同时在途的分页请求数。
+        有分页获取失败时，其余分页照常产出，最后抛出 IncompleteResultError。
+        """
+        try:
+            headers = self._request_headers(await self._get_v_value_async())
 
             # --- 获取第一页数据 ---
-            resp = await self.async_client.post(self.GET_ROBOT_DATA_URL, json={
-                "source": "Ths_iwencai_Xuangu", "version": "2.0", "question": question, "perpage": 100,
+            resp = await self._post_with_retry(self.GET_ROBOT_DATA_URL, headers, json={
+                "source": "Ths_iwencai_Xuangu", "version": "2.0", "question": question, "perpage": PAGE_SIZE,
                 "page": 1, "secondary_intent": secondary_intent,
                 "add_info": "{\"urp\":{\"scene\":1,\"company\":1,\"business\":1},\"contentType\":\"json\",\"searchInfo\":true}",
                 "rsh": self._cookies.get('other_uid')
             })
-            resp.raise_for_status()
             json_data = resp.json()
 
             component = \
@@ -122,39 +247,54 @@ class IWenCaiScraper:
                 'uuid': component.get('puuid'),
             }
             first_page_results = result_data.get('datas', [])
-            total_pages = math.ceil(meta_extra.get('row_count', 0) / 100)
+            row_count = meta_extra.get('row_count', 0)
+            if limit is not None:
+                row_count = min(row_count, limit)
+            total_pages = math.ceil(row_count / PAGE_SIZE)
 
+            remaining = limit
             if first_page_results:
+                if remaining is not None:
+                    first_page_results = first_page_results[:remaining]
+                    remaining -= len(first_page_results)
                 yield first_page_results
 
-            if total_pages <= 1: return
+            if total_pages <= 1 or remaining == 0: return
 
-            # --- 并发获取剩余分页 ---
-            tasks = []
-            for page_num in range(2, total_pages + 1):
-                page_data = {
-                    "query": question, "page": str(page_num), "perpage": "100", "source": "Ths_iwencai_Xuangu",
+            # --- 按窗口并发获取剩余分页 ---
+            def build_page_data(page_num: int) -> Dict[str, Any]:
+                return {
+                    "query": question, "page": str(page_num), "perpage": str(PAGE_SIZE), "source": "Ths_iwencai_Xuangu",
                     "logid": params['logid'], "ret": "json_all", "sessionid": params['sessionid'],
                     "iwc_token": params['iwc_token'], "user_id": self._cookies.get('other_uid'),
                     "uuids[0]": params['uuid'], "query_type": secondary_intent, "comp_id": params['comp_id'],
                     "business_cat": "soniu", "uuid": params['uuid'], "condition": params['condition'],
                     "urp_sort_index": params['urp_sort_index']
                 }
-                tasks.append(self.async_client.post(self.GET_DATA_LIST_URL, data=page_data))
-
-            for task in asyncio.as_completed(tasks):
-                try:
-                    res = await task
-                    res.raise_for_status()
-                    json_data = res.json()
-                    if components := json_data.get('answer', {}).get('components'):
-                        if data := components[0].get('data'):
-                            if page_results := data.get('datas'):
-                                yield page_results
-                except httpx.HTTPStatusError as e:
-                    logger.warning(f"处理分页响应时出错 (状态码: {e.response.status_code})")
-                except Exception as e:
-                    logger.warning(f"处理分页时发生未知异常: {e}")
+
+            failed_pages: List[int] = []
+
+            async def fetch_page(page_num: int) -> Optional[List[Dict[str, Any]]]:
+                page_results = await self._fetch_page(build_page_data(page_num), headers)
+                if page_results is None:
+                    failed_pages.append(page_num)
+                return page_results
+
+            pages = self._paginate(list(range(2, total_pages + 1)), fetch_page, max(1, concurrency), ordered)
+            try:
+                async for page_results in pages:
+                    if not page_results:
+                        continue
+                    if remaining is not None:
+                        page_results = page_results[:remaining]
+                        remaining -= len(page_results)
+                    yield page_results
+                    if remaining == 0:
+                        break
+            finally:
+                await pages.aclose()
+            if failed_pages:
+                raise IncompleteResultError(sorted(failed_pages))
 
         except httpx.HTTPStatusError as e:
             logger.error(f"请求问财服务器失败，状态码: {e.response.status_code}", exc_info=False)
@@ -168,8 +308,12 @@ class IWenCaiScraper:
             logger.error(f"爬虫执行时发生未知严重错误: {e}", exc_info=True)
             raise ScraperException("执行查询时发生未知内部错误，请联系管理员。")
 
-    async def fetch_all_data_once(self, question: str, secondary_intent: str) -> list:
+    async def fetch_all_data_once(self, question: str, secondary_intent: str, limit: Optional[int] = None) -> list:
         all_data = []
-        async for data_chunk in self.fetch_data_stream(question, secondary_intent):
+        async for data_chunk in self.fetch_data_stream(question, secondary_intent, limit=limit):
             all_data.extend(data_chunk)
-        return all_data
\ No newline at end of file
+        return all_data
+
+
+# 进程级单例，由 main.py 的启动/关闭钩子管理生命周期
+wencai_scraper = IWenCaiScraper()
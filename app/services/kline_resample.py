@@ -0,0 +1,118 @@
+# 文件: app/services/kline_resample.py
+
+import re
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .trading_calendar import AFTERNOON_OPEN, MORNING_OPEN
+
+# 接口 period 参数到重采样规则的映射
+PERIOD_RULES = {
+    "weekly": "W",
+    "monthly": "M",
+    "quarterly": "Q",
+    "trading_weekly": "TW",
+}
+
+# 中文列 (akshare 原始) 与英文列 (get_historical_frame 重命名后) 两套 schema
+_CN_FIELDS = {"open": "开盘", "high": "最高", "low": "最低", "close": "收盘", "volume": "成交量", "turnover": "成交额"}
+_EN_FIELDS = {"open": "open", "high": "high", "low": "low", "close": "close", "volume": "volume",
+              "turnover": "turnover"}
+_AGGREGATIONS = {"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum", "turnover": "sum"}
+
+# 分钟线按交易时段对齐，默认 A 股的上午/下午开盘时刻
+DEFAULT_SESSION_ANCHORS = (MORNING_OPEN, AFTERNOON_OPEN)
+
+_MINUTE_RULE = re.compile(r"^(\d+)\s*(?:min|m|T)$", re.IGNORECASE)
+_PERIOD_FREQ = {"W": "W-SUN", "M": "M", "Q": "Q-DEC"}
+
+
+def _detect_schema(df: pd.DataFrame) -> (str, Dict[str, str]):
+    """返回 (时间列, 字段 -> 列名)。同时支持中文与英文列名。"""
+    for time_column in ("日期", "时间"):
+        if time_column in df.columns:
+            return time_column, _CN_FIELDS
+    if "date" in df.columns:
+        return "date", _EN_FIELDS
+    raise ValueError("K线数据中未找到日期/时间列")
+
+
+def _minute_buckets(times: pd.Series, minutes: int, anchors: Sequence) -> pd.Series:
+    """
+    分钟线的归属时刻：以所在交易时段的开盘为起点每 minutes 分钟一根，按右端点标记
+    (与行情软件一致，如 5 分钟线 09:31~09:35 记为 09:35)。开盘集合竞价那一分钟并入第一根。
+    """
+    days = times.dt.normalize()
+    offset = (times - days).to_numpy(dtype="timedelta64[ns]")
+    anchor_offsets = np.array([np.timedelta64(a.hour * 60 + a.minute, "m") for a in anchors],
+                              dtype="timedelta64[ns]")
+    # 严格早于该时刻的最后一个时段起点；早于首个时段的归入首个时段
+    index = np.clip(np.searchsorted(anchor_offsets, offset, side="left") - 1, 0, len(anchor_offsets) - 1)
+    since_open = offset - anchor_offsets[index]
+    step = np.timedelta64(minutes, "m").astype("timedelta64[ns]")
+    count = np.maximum(1, -(-since_open // step))
+    return days + pd.to_timedelta(anchor_offsets[index] + count * step)
+
+
+def resample_bars(df: pd.DataFrame, rule: str, code_column: Optional[str] = None,
+                  session_anchors: Sequence = DEFAULT_SESSION_ANCHORS) -> pd.DataFrame:
+    """
+    对K线做一次分组向量化重采样，不修改入参。
+
+    - df: 单个代码的K线，或多个代码纵向拼接的K线 (此时用 code_column 指明代码列)；
+      列名可以是 akshare 原始的中文列 (日期/时间、开盘…成交额)，也可以是英文列 (date、open…turnover)。
+    - rule: "Nmin" (N 分钟，按交易时段对齐)、"D" 日、"W" 自然周 (标记为周日)、"M" 月末、"Q" 季末，
+      以及 "TW" 交易周 (同一自然周内的交易日合并，标记为该周实际最后一个交易日)。
+    返回的列为 [代码列,] 时间列 + 开高低收量额，按 (代码, 时间) 排序；其余列 (如涨跌幅) 无法直接聚合，不保留。
+    """
+    time_column, fields = _detect_schema(df)
+    value_columns = [fields[name] for name in _AGGREGATIONS if fields[name] in df.columns]
+    group_keys = [code_column] if code_column else []
+    if df.empty:
+        return df.reindex(columns=group_keys + [time_column] + value_columns).iloc[0:0]
+
+    work = df[group_keys + value_columns].copy()
+    times = pd.to_datetime(df[time_column])
+
+    minute_match = _MINUTE_RULE.match(rule)
+    label_by_last_bar = False
+    if minute_match:
+        buckets = _minute_buckets(times, int(minute_match.group(1)), session_anchors)
+    elif rule == "D":
+        buckets = times.dt.normalize()
+    elif rule == "TW":
+        buckets = times.dt.to_period("W-SUN")
+        label_by_last_bar = True
+    elif rule in _PERIOD_FREQ:
+        buckets = times.dt.to_period(_PERIOD_FREQ[rule]).dt.end_time.dt.normalize()
+    else:
+        raise ValueError(f"不支持的重采样规则: {rule}")
+
+    work["__bucket"] = buckets.to_numpy()
+    aggregations = {fields[name]: how for name, how in _AGGREGATIONS.items() if fields[name] in work.columns}
+    if label_by_last_bar:
+        work[time_column] = times.dt.normalize().to_numpy()
+        aggregations[time_column] = "max"
+
+    # 先按时间排好序，保证 first/last 取到的是区间内最早/最晚的一根
+    work["__time"] = times.to_numpy()
+    work.sort_values(group_keys + ["__time"], inplace=True, kind="stable")
+    grouped = work.groupby(group_keys + ["__bucket"], sort=True, observed=True).agg(aggregations)
+    grouped.reset_index(inplace=True)
+
+    if label_by_last_bar:
+        grouped.drop(columns="__bucket", inplace=True)
+    else:
+        grouped.rename(columns={"__bucket": time_column}, inplace=True)
+    grouped.dropna(subset=[column for column in (fields["open"], fields["close"]) if column in grouped.columns],
+                   inplace=True)
+    return grouped[group_keys + [time_column] + value_columns].reset_index(drop=True)
+
+
+def resample_period(df: pd.DataFrame, period: str, code_column: Optional[str] = None) -> pd.DataFrame:
+    """按接口的 period 参数 (weekly/monthly/quarterly/trading_weekly) 重采样日线；daily 原样返回。"""
+    if df.empty or period not in PERIOD_RULES:
+        return df
+    return resample_bars(df, PERIOD_RULES[period], code_column=code_column)
@@ -0,0 +1,17 @@
+# 文件: app/services/mailer.py
+
+from aiosmtplib.errors import SMTPResponseException
+from fastapi_mail import MessageSchema
+
+from ..globals import fm, logger
+
+
+async def send_email_task(message: MessageSchema):
+    """发送一封邮件，供路由的后台任务与警报引擎共用；失败只记录日志。"""
+    try:
+        await fm.send_message(message)
+        logger.info(f"邮件已成功投递到 SMTP 服务器: 主题='{message.subject}', 收件人={message.recipients}")
+    except SMTPResponseException as e:
+        logger.warning(f"邮件发送后关闭连接时出现SMTP响应异常 (通常无害): {e}")
+    except Exception as e:
+        logger.error(f"发送邮件时发生严重错误: {e}", exc_info=True)
@@ -0,0 +1,56 @@
+# 文件: app/services/market_delta.py
+
+from typing import Any, Dict, List, Optional
+
+from .stock_data import get_item_secid
+
+# 默认每隔多少帧发送一次完整关键帧
+DEFAULT_KEYFRAME_INTERVAL = 50
+
+
+class DeltaFrameEncoder:
+    """
+    行情 SSE 的增量协议编码器 (每个连接一个实例)。
+
+    - 第一帧及每隔 keyframe_interval 帧发送 snapshot 帧，携带全部行；
+    - 其余帧为 patch 帧，只携带发生变化的行及其变化的 aN 字段，新出现的行给出完整数据，
+      消失的行列在 removed 中；
+    - 每帧带有连续递增的 seq，客户端发现序号不连续时重连即可重新获得快照。
+    """
+
+    def __init__(self, keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL):
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.seq = 0
+        # 自上一个关键帧 (含关键帧本身) 以来发送的帧数
+        self._frames_since_keyframe = 0
+        self._last_rows: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @staticmethod
+    def _index_rows(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        return {get_item_secid(row) or str(i): row for i, row in enumerate(rows)}
+
+    def encode(self, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """返回需要合并进 SSE 载荷的协议字段。"""
+        self.seq += 1
+        rows_by_secid = self._index_rows(rows)
+
+        if self._last_rows is None or self._frames_since_keyframe >= self.keyframe_interval:
+            self._last_rows = rows_by_secid
+            self._frames_since_keyframe = 1
+            return {"type": "snapshot", "seq": self.seq, "data": rows}
+
+        previous = self._last_rows
+        changes = {}
+        for secid, row in rows_by_secid.items():
+            prev_row = previous.get(secid)
+            if prev_row is None:
+                changes[secid] = row
+            elif prev_row is not row:
+                changed_fields = {key: value for key, value in row.items() if prev_row.get(key) != value}
+                if changed_fields:
+                    changes[secid] = changed_fields
+        removed = [secid for secid in previous if secid not in rows_by_secid]
+
+        self._last_rows = rows_by_secid
+        self._frames_since_keyframe += 1
+        return {"type": "patch", "seq": self.seq, "changes": changes, "removed": removed}
@@ -0,0 +1,249 @@
+# 文件: app/services/market_hub.py
+
+import asyncio
+import datetime
+import os
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from ..globals import logger
+from ..common.serializer import sse_event
+from .stock_data import fetch_stock_data_async, get_item_secid
+from .quote_feed import QuoteFeedManager
+from .quote_cache import quote_cache, stored_at_iso
+
+# 每批发给上游的 secid 数量 (避免 URL 过长)
+MARKET_HUB_BATCH_SIZE = int(os.getenv("MARKET_HUB_BATCH_SIZE", 200))
+# 单次上游请求的最短超时 (秒)，实际超时取本轮到期订阅者中最小间隔与该值的较大者
+MARKET_HUB_MIN_FETCH_TIMEOUT = float(os.getenv("MARKET_HUB_MIN_FETCH_TIMEOUT", 1.0))
+# 上游接入模式: poll (每个节拍请求一次) 或 push (保持推送长连接，节拍只读内存行情表)
+MARKET_HUB_MODE = os.getenv("MARKET_HUB_MODE", "poll").lower()
+
+
+class MarketFrame:
+    """
+    一次分发给订阅者的数据帧。
+
+    代码列表相同的订阅者共享同一个帧对象，编码后的 SSE 字节按 (status, message) 缓存，
+    同一帧无论有多少订阅者都只序列化一次。
+    本轮上游缺失、由“最后一次成功数据”缓存补上的行记录在 stale 中 (secid -> 该行的获取时间)。
+    """
+
+    __slots__ = ("rows", "timestamp", "stale", "_encoded")
+
+    def __init__(self, rows: list, stale: Optional[Dict[str, str]] = None):
+        self.rows = rows
+        self.timestamp = datetime.datetime.utcnow().isoformat()
+        self.stale = stale or {}
+        self._encoded: Dict[Tuple[str, str], bytes] = {}
+
+    def sse_bytes(self, status: str, message: str) -> bytes:
+        key = (status, message)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            payload: Dict[str, Any] = {
+                "timestamp": self.timestamp, "data": self.rows, "status": status, "message": message
+            }
+            payload.update(self.stale_fields())
+            encoded = sse_event(payload)
+            self._encoded[key] = encoded
+        return encoded
+
+    def stale_fields(self) -> Dict[str, Any]:
+        """SSE 载荷中的陈旧标记：stale 为是否含缓存行，stale_secids 给出这些行的获取时间。"""
+        if not self.stale:
+            return {"stale": False}
+        return {"stale": True, "stale_secids": self.stale}
+
+
+class MarketSubscription:
+    """
+    单个 SSE 连接在行情中心上的订阅。
+    队列只保留最新一帧，慢消费者不会拖累轮询循环。
+    """
+
+    def __init__(self, secids: List[str], interval: float):
+        self.secids = [s.strip().upper() for s in secids if s and s.strip()]
+        self.interval = interval
+        self.next_due = 0.0
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    def deliver(self, frame: MarketFrame):
+        """投递一帧数据；如果上一帧尚未被消费，则用新帧覆盖。"""
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(frame)
+
+    async def next_frame(self, timeout: Optional[float] = None) -> MarketFrame:
+        """等待下一帧。超时返回空帧，由调用方走缓存兜底逻辑。"""
+        if timeout is None:
+            timeout = max(self.interval * 3, 10.0)
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return MarketFrame([])
+
+    async def next_rows(self, timeout: Optional[float] = None) -> list:
+        return (await self.next_frame(timeout)).rows
+
+
+class MarketDataHub:
+    """
+    进程级行情订阅中心。
+
+    维护所有订阅者 secid 的并集，每个节拍只对“到期”的订阅者所需代码轮询一次上游
+    (按批拆分请求)，再把处理后的行按订阅者各自的代码列表分发出去。
+    上游请求次数只与去重后的代码数量有关，与连接数无关；
+    每个订阅者仍按自己的刷新间隔收到数据，套餐限制由路由层在订阅前校验。
+
+    push 模式下由 QuoteFeedManager 保持推送长连接，节拍只从内存行情表取数，
+    推送不在线 (尚未收到快照或连接正在重连) 的代码退回一次性轮询。
+    """
+
+    def __init__(self, batch_size: int = MARKET_HUB_BATCH_SIZE, mode: str = MARKET_HUB_MODE):
+        self.batch_size = max(1, batch_size)
+        self.mode = mode
+        self._feed = QuoteFeedManager(self.batch_size) if mode == "push" else None
+        self._subscriptions: Set[MarketSubscription] = set()
+        self._refcounts: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    # --- 生命周期 ---
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="market-data-hub")
+            logger.info("行情订阅中心已启动。")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info("行情订阅中心已停止。")
+        if self._feed is not None:
+            await self._feed.close()
+
+    # --- 订阅管理 ---
+    def subscribe(self, secids: List[str], interval: float) -> MarketSubscription:
+        subscription = MarketSubscription(secids, interval)
+        self._subscriptions.add(subscription)
+        for secid in subscription.secids:
+            self._refcounts[secid] = self._refcounts.get(secid, 0) + 1
+
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="market-data-hub")
+        self._wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription: MarketSubscription):
+        if subscription not in self._subscriptions:
+            return
+        self._subscriptions.discard(subscription)
+        for secid in subscription.secids:
+            remaining = self._refcounts.get(secid, 0) - 1
+            if remaining > 0:
+                self._refcounts[secid] = remaining
+            else:
+                self._refcounts.pop(secid, None)
+
+    @property
+    def active_secids(self) -> List[str]:
+        return list(self._refcounts.keys())
+
+    # --- 轮询与分发 ---
+    async def _poll(self, secids: List[str], timeout: float) -> Dict[str, dict]:
+        batches = [secids[i:i + self.batch_size] for i in range(0, len(secids), self.batch_size)]
+        results = await asyncio.gather(
+            *(fetch_stock_data_async(",".join(batch), timeout=timeout) for batch in batches),
+            return_exceptions=True
+        )
+        rows_by_secid = {}
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                logger.warning(f"行情中心批量获取失败 ({len(batch)} 个代码): {type(result).__name__} - {result}")
+                continue
+            for row in result:
+                secid = get_item_secid(row)
+                if secid:
+                    rows_by_secid[secid] = row
+        return rows_by_secid
+
+    async def _collect(self, secids: List[str], timeout: float) -> Dict[str, dict]:
+        if self._feed is None:
+            return await self._poll(secids, timeout)
+
+        await self._feed.reconcile(self._refcounts.keys())
+        rows_by_secid = self._feed.get_rows(secids)
+        missing = [secid for secid in secids if secid not in rows_by_secid]
+        if missing:
+            rows_by_secid.update(await self._poll(missing, timeout))
+        return rows_by_secid
+
+    @staticmethod
+    def _build_frame(secids: tuple, rows_by_secid: Dict[str, dict]) -> MarketFrame:
+        """按订阅者的代码顺序组装一帧；本轮缺失的代码用缓存中未过期的最后一次成功数据补上。"""
+        rows, stale = [], {}
+        for secid in secids:
+            row = rows_by_secid.get(secid)
+            if row is None:
+                cached = quote_cache.get(secid)
+                if cached is None:
+                    continue
+                row = cached[0]
+                stale[secid] = stored_at_iso(cached[1])
+            rows.append(row)
+        return MarketFrame(rows, stale)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if not self._subscriptions:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                now = loop.time()
+                due = [s for s in self._subscriptions if s.next_due <= now]
+                if due:
+                    wanted = list(dict.fromkeys(secid for s in due for secid in s.secids))
+                    timeout = max(min(s.interval for s in due), MARKET_HUB_MIN_FETCH_TIMEOUT)
+                    rows_by_secid = await self._collect(wanted, timeout)
+                    quote_cache.put_rows(rows_by_secid)
+
+                    finished = loop.time()
+                    frames: Dict[tuple, MarketFrame] = {}
+                    for subscription in due:
+                        key = tuple(subscription.secids)
+                        frame = frames.get(key)
+                        if frame is None:
+                            frame = self._build_frame(key, rows_by_secid)
+                            frames[key] = frame
+                        subscription.deliver(frame)
+                        subscription.next_due = finished + subscription.interval
+
+                if not self._subscriptions:
+                    continue
+                delay = max(0.0, min(s.next_due for s in self._subscriptions) - loop.time())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"行情订阅中心循环出现异常: {e}", exc_info=True)
+                await asyncio.sleep(1.0)
+
+
+# 进程级单例，由 main.py 的启动/关闭钩子管理生命周期
+market_hub = MarketDataHub()
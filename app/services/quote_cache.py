@@ -0,0 +1,105 @@
+# 文件: app/services/quote_cache.py
+
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from ..common.serializer import dumps_bytes
+
+# 单条行情在缓存中保留的最长时间 (秒)，超过后不再作为兜底数据
+QUOTE_CACHE_TTL = float(os.getenv("QUOTE_CACHE_TTL", 3600))
+# 最多缓存的代码数
+QUOTE_CACHE_MAX_ENTRIES = int(os.getenv("QUOTE_CACHE_MAX_ENTRIES", 20000))
+# 内存预算 (按每个代码首次写入时该行 JSON 编码后的字节数估算)
+QUOTE_CACHE_MAX_BYTES = int(os.getenv("QUOTE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+
+class LastGoodQuoteCache:
+    """
+    “最后一次成功数据”缓存，按 secid 保存单行行情及其写入时间。
+
+    由行情中心在每次成功获取后整体写入 (每个节拍一次，与连接数无关)；兜底时按订阅者的代码逐条组装，
+    因此不同代码组合共用同一份数据，从未被请求过的组合也能拿到其中已缓存代码的部分兜底。
+    条目按最近写入时间排序：过期条目从队首批量清理，超出条目数或内存预算时淘汰最久未更新的代码，
+    长期运行内存保持平稳。
+    """
+
+    def __init__(self, ttl: float = QUOTE_CACHE_TTL, max_entries: int = QUOTE_CACHE_MAX_ENTRIES,
+                 max_bytes: int = QUOTE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # secid -> (行, 写入时间, 估算字节数)
+        self._entries: "OrderedDict[str, Tuple[dict, float, int]]" = OrderedDict()
+        self._bytes = 0
+
+    def put_rows(self, rows_by_secid: Mapping[str, dict], now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            for secid, row in rows_by_secid.items():
+                previous = self._entries.pop(secid, None)
+                if previous is not None:
+                    # 同一代码的行字段固定、编码长度相近，沿用已有估算，避免每个节拍重复编码整帧
+                    size = previous[2]
+                    self._bytes -= size
+                else:
+                    size = len(dumps_bytes(row))
+                self._entries[secid] = (row, now, size)
+                self._bytes += size
+            self._evict(now)
+
+    def get(self, secid: str, now: Optional[float] = None) -> Optional[Tuple[dict, float]]:
+        """返回 (行, 写入时间)；没有或已过期时返回 None。"""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(secid)
+        if entry is None or now - entry[1] > self.ttl:
+            return None
+        return entry[0], entry[1]
+
+    def get_rows(self, secids: Iterable[str], now: Optional[float] = None) -> Tuple[List[dict], Dict[str, str]]:
+        """按顺序组装兜底行，返回 (行列表, {secid: 该行写入时间 (UTC ISO)})；缺失的代码被跳过。"""
+        now = time.time() if now is None else now
+        rows, as_of = [], {}
+        for secid in secids:
+            entry = self.get(secid, now)
+            if entry is not None:
+                rows.append(entry[0])
+                as_of[secid] = stored_at_iso(entry[1])
+        return rows, as_of
+
+    def _evict(self, now: float):
+        entries = self._entries
+        while entries:
+            secid, (_, stored_at, size) = next(iter(entries.items()))
+            if (now - stored_at <= self.ttl and len(entries) <= self.max_entries
+                    and self._bytes <= self.max_bytes):
+                break
+            entries.popitem(last=False)
+            self._bytes -= size
+
+    def purge(self, now: Optional[float] = None):
+        with self._lock:
+            self._evict(time.time() if now is None else now)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+def stored_at_iso(timestamp: float) -> str:
+    return datetime.datetime.utcfromtimestamp(timestamp).isoformat()
+
+
+# 进程级单例，由行情中心写入
+quote_cache = LastGoodQuoteCache()
@@ -0,0 +1,220 @@
+# 文件: app/services/quote_feed.py
+
+import asyncio
+import json
+import os
+import random
+from typing import Dict, Iterable, List, Optional, Set
+
+import httpx
+
+from ..globals import logger
+from .http_client import http_pool
+from .stock_data import (
+    get_eastmoney_fields, get_user_agent_generator, process_stock_item, DATA_API_UT_TOKEN
+)
+
+# 断线重连的退避参数 (秒)
+PUSH_FEED_BACKOFF_INITIAL = float(os.getenv("PUSH_FEED_BACKOFF_INITIAL", 1.0))
+PUSH_FEED_BACKOFF_MAX = float(os.getenv("PUSH_FEED_BACKOFF_MAX", 30.0))
+# 长连接上超过该时长没有任何数据 (含心跳) 即视为失效并重连
+PUSH_FEED_READ_TIMEOUT = float(os.getenv("PUSH_FEED_READ_TIMEOUT", 60.0))
+# 推送长连接总数上限，超出容量的代码由行情中心退回轮询
+PUSH_FEED_MAX_CONNECTIONS = int(os.getenv("PUSH_FEED_MAX_CONNECTIONS", 20))
+
+
+def _secid_of(raw_item: dict) -> Optional[str]:
+    market, code = raw_item.get('f13'), raw_item.get('f12')
+    if market is None or market == '-' or not code or code == '-':
+        return None
+    return f"{market}.{str(code).upper()}"
+
+
+class PushQuoteFeed:
+    """
+    一条保持打开的 ulist/sse 推送连接。
+
+    首帧是全量快照，之后的帧只携带变化字段 (以快照中的位置序号为键)，
+    本类把这些增量合并进管理器的行情表；连接断开后按指数退避 (带抖动) 重连，
+    在重新收到全量快照之前，本连接的代码不视为实时。
+    """
+
+    def __init__(self, manager: "QuoteFeedManager", secids: List[str]):
+        self.manager = manager
+        self.secids = list(secids)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name=f"push-quote-feed-{len(self.secids)}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.manager.mark_down(self.secids)
+
+    async def _run(self):
+        backoff = PUSH_FEED_BACKOFF_INITIAL
+        while True:
+            received = False
+            try:
+                async for _ in self._consume():
+                    if not received:
+                        received = True
+                        backoff = PUSH_FEED_BACKOFF_INITIAL
+                logger.info(f"行情推送连接被上游关闭，准备重连 ({len(self.secids)} 个代码)。")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"行情推送连接异常 ({len(self.secids)} 个代码): {type(e).__name__} - {e}")
+
+            self.manager.mark_down(self.secids)
+            delay = backoff * random.uniform(0.5, 1.5)
+            backoff = min(backoff * 2, PUSH_FEED_BACKOFF_MAX)
+            await asyncio.sleep(delay)
+
+    async def _consume(self):
+        k = random.randint(10, 99)
+        url = f'https://{k}.push2.eastmoney.com/api/qt/ulist/sse'
+        params = {
+            'secids': ",".join(self.secids), 'fields': get_eastmoney_fields(), 'invt': '3',
+            'ut': DATA_API_UT_TOKEN, 'fid': '', 'po': '1', 'pi': '0', 'pz': '30000',
+            'mpi': '6000', 'dect': '1',
+        }
+        headers = {'User-Agent': get_user_agent_generator().random}
+        timeout = httpx.Timeout(10.0, read=PUSH_FEED_READ_TIMEOUT)
+
+        # 位置序号 -> secid，由全量快照建立
+        positions: Dict[str, str] = {}
+        async with http_pool.stream('GET', url, params=params, headers=headers, timeout=timeout) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                try:
+                    frame = json.loads(line[len('data:'):].strip())
+                except json.JSONDecodeError:
+                    continue
+                self._apply_frame(frame, positions)
+                yield frame
+
+    def _apply_frame(self, frame: dict, positions: Dict[str, str]):
+        data = frame.get('data') if isinstance(frame, dict) else None
+        if not data or not data.get('diff'):
+            return
+        diff = data['diff']
+        items = diff.items() if isinstance(diff, dict) else enumerate(diff)
+        is_full = frame.get('full') == 1
+        if is_full:
+            positions.clear()
+
+        for position, raw_item in items:
+            position = str(position)
+            secid = _secid_of(raw_item)
+            if secid:
+                positions[position] = secid
+            else:
+                secid = positions.get(position)
+            if secid:
+                self.manager.apply(secid, raw_item, replace=is_full)
+
+
+class QuoteFeedManager:
+    """
+    管理若干条推送长连接并维护内存行情表 (secid -> 合并后的原始字段)。
+
+    通过 reconcile() 与行情中心的订阅并集对齐：代码集合不变的满载连接原样保留，
+    其余连接拆散后与新增代码一起按 batch_size 重新装箱，连接数不超过 PUSH_FEED_MAX_CONNECTIONS。
+    只有所在连接已收到全量快照、当前在线的代码才从行情表返回，其余由行情中心退回轮询。
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = max(1, batch_size)
+        self._feeds: List[PushQuoteFeed] = []
+        self._wanted: Set[str] = set()
+        self._raw: Dict[str, dict] = {}
+        self._versions: Dict[str, int] = {}
+        self._processed: Dict[str, tuple] = {}
+        # 所在连接在线且已收到全量快照的代码
+        self._live: Set[str] = set()
+
+    # --- 行情表 ---
+    def apply(self, secid: str, raw_item: dict, replace: bool = False):
+        if replace or secid not in self._raw:
+            self._raw[secid] = dict(raw_item)
+        else:
+            self._raw[secid].update(raw_item)
+        self._versions[secid] = self._versions.get(secid, 0) + 1
+        if replace:
+            self._live.add(secid)
+
+    def mark_down(self, secids: Iterable[str]):
+        """连接断开或停止：其代码在重新收到快照前不再作为实时数据返回。"""
+        self._live.difference_update(secids)
+
+    def get_rows(self, secids: Iterable[str]) -> Dict[str, dict]:
+        """返回推送在线的代码的处理后行数据；只在字段有变化时重新处理。"""
+        rows = {}
+        for secid in secids:
+            version = self._versions.get(secid)
+            if version is None or secid not in self._live:
+                continue
+            cached = self._processed.get(secid)
+            if cached is None or cached[0] != version:
+                cached = (version, process_stock_item(self._raw[secid]))
+                self._processed[secid] = cached
+            rows[secid] = cached[1]
+        return rows
+
+    # --- 连接管理 ---
+    async def reconcile(self, wanted: Iterable[str]):
+        wanted = set(wanted)
+        if wanted == self._wanted:
+            return
+
+        # 只保留代码全部仍被需要的满载连接，其余拆散重新装箱，
+        # 连接数始终为 ceil(代码数 / batch_size)，不会因反复增删而碎片化
+        kept = []
+        for feed in self._feeds:
+            if (len(feed.secids) == self.batch_size and wanted.issuperset(feed.secids)
+                    and len(kept) < PUSH_FEED_MAX_CONNECTIONS):
+                kept.append(feed)
+            else:
+                await feed.stop()
+        self._feeds = kept
+
+        # 仍在存活连接上的代码保留其行情 (后续增量帧依赖完整的基础快照)
+        covered = {secid for feed in self._feeds for secid in feed.secids}
+        for secid in list(self._raw):
+            if secid not in covered:
+                self._raw.pop(secid, None)
+                self._versions.pop(secid, None)
+                self._processed.pop(secid, None)
+
+        self._wanted = wanted
+        pending = sorted(wanted - covered)
+        capacity = (PUSH_FEED_MAX_CONNECTIONS - len(self._feeds)) * self.batch_size
+        if len(pending) > capacity:
+            logger.warning(f"行情推送连接数已达上限 ({PUSH_FEED_MAX_CONNECTIONS})，"
+                           f"{len(pending) - capacity} 个代码退回轮询。")
+            pending = pending[:capacity]
+        for i in range(0, len(pending), self.batch_size):
+            feed = PushQuoteFeed(self, pending[i:i + self.batch_size])
+            feed.start()
+            self._feeds.append(feed)
+
+        logger.info(f"行情推送连接已更新: {len(wanted)} 个代码, {len(self._feeds)} 条连接。")
+
+    async def close(self):
+        for feed in self._feeds:
+            await feed.stop()
+        self._feeds = []
+        self._wanted = set()
+        self._raw.clear()
+        self._versions.clear()
+        self._processed.clear()
+        self._live.clear()
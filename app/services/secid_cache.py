@@ -0,0 +1,113 @@
+# 文件: app/services/secid_cache.py
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from ..globals import logger
+
+# 本地缓存文件位置与有效期 (秒)
+SECID_CACHE_PATH = os.getenv("SECID_CACHE_PATH", os.path.join("cache", "secid_cache.sqlite3"))
+SECID_CACHE_TTL = float(os.getenv("SECID_CACHE_TTL", 7 * 24 * 3600))
+# 无效代码的负缓存有效期，避免反复为同一个错误代码请求搜索接口
+SECID_CACHE_NEGATIVE_TTL = float(os.getenv("SECID_CACHE_NEGATIVE_TTL", 3600))
+
+# (quote_id, security_code, resolved_at)；quote_id 为 None 表示负缓存
+CacheEntry = Tuple[Optional[str], Optional[str], float]
+
+
+class SecidCache:
+    """
+    代码 -> 东方财富 QuoteID 的持久化解析缓存。
+
+    以 SQLite 文件落盘、重启后仍然有效；首次使用时整表载入内存，
+    之后查询只走内存字典，写入时同步落盘。支持正/负两种有效期和批量预热。
+    """
+
+    def __init__(self, path: str = SECID_CACHE_PATH, ttl: float = SECID_CACHE_TTL,
+                 negative_ttl: float = SECID_CACHE_NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[str, CacheEntry] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @staticmethod
+    def normalize(raw_code: str) -> str:
+        return raw_code.strip().upper()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS secid_cache ("
+                " code TEXT PRIMARY KEY, quote_id TEXT, security_code TEXT, resolved_at REAL NOT NULL)"
+            )
+            for code, quote_id, security_code, resolved_at in conn.execute(
+                    "SELECT code, quote_id, security_code, resolved_at FROM secid_cache"):
+                self._entries[code] = (quote_id, security_code, resolved_at)
+            self._conn = conn
+            logger.info(f"已从 {self.path} 载入 {len(self._entries)} 条代码解析缓存。")
+        return self._conn
+
+    def lookup(self, raw_code: str) -> Optional[CacheEntry]:
+        """
+        返回未过期的缓存项；未命中或已过期返回 None。
+        命中负缓存时返回 quote_id 为 None 的缓存项，调用方应直接视为无效代码。
+        """
+        code = self.normalize(raw_code)
+        with self._lock:
+            try:
+                self._connect()
+            except sqlite3.Error as e:
+                logger.warning(f"代码解析缓存不可用: {e}")
+                return None
+            entry = self._entries.get(code)
+        if entry is None:
+            return None
+        ttl = self.ttl if entry[0] else self.negative_ttl
+        if time.time() - entry[2] > ttl:
+            return None
+        return entry
+
+    def store(self, raw_code: str, quote_id: Optional[str], security_code: Optional[str] = None):
+        self.store_many([(raw_code, quote_id, security_code)])
+
+    def store_many(self, items: Iterable[Tuple[str, Optional[str], Optional[str]]]):
+        now = time.time()
+        rows = [(self.normalize(code), quote_id, security_code, now) for code, quote_id, security_code in items]
+        if not rows:
+            return
+        with self._lock:
+            # 先连接 (首次连接会载入已持久化的旧记录)，再写入本次结果，避免新结果被旧记录覆盖
+            try:
+                conn = self._connect()
+            except sqlite3.Error as e:
+                logger.warning(f"代码解析缓存不可用: {e}")
+                conn = None
+            for code, quote_id, security_code, resolved_at in rows:
+                self._entries[code] = (quote_id, security_code, resolved_at)
+            if conn is None:
+                return
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO secid_cache (code, quote_id, security_code, resolved_at)"
+                        " VALUES (?, ?, ?, ?)", rows
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"写入代码解析缓存失败: {e}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# 进程级单例，stock_data 与 data_service 共用
+secid_cache = SecidCache()
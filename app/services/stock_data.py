@@ -4,11 +4,13 @@ import asyncio
 import random
 import json
 import logging
-import requests
-from typing import List, Dict, Any, Optional
+import httpx
+from typing import List, Dict, Any, Optional, Tuple
 from functools import lru_cache
 
 from ..globals import logger
+from .secid_cache import secid_cache
+from .http_client import http_pool
 
 # --- 导入：用于获取随机 User-Agent ---
 from fake_useragent import UserAgent
@@ -55,36 +57,36 @@ def get_user_agent_generator():
 FIELD_MAPPING_RAW = {
     'f12': {'name': '股票代码', 'type': str}, 'f14': {'name': '名称', 'type': str},
     'f2': {'name': '最新价', 'type': float, 'dynamic_precision': True},
-    'f3': {'name': '涨跌幅(%)', 'type': float, 'transform': lambda x: x / 100.0 if x is not None else None},
+    'f3': {'name': '涨跌幅(%)', 'type': float, 'scale': 100.0},
     'f4': {'name': '涨跌额', 'type': float, 'dynamic_precision': True},
-    'f6': {'name': '成交额(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f20': {'name': '总市值(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f21': {'name': '流通市值(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f9': {'name': '市盈率', 'type': float, 'transform': lambda x: x / 100.0 if x is not None else None},
-    'f23': {'name': '市净率', 'type': float, 'transform': lambda x: x / 100.0 if x is not None else None},
-    'f8': {'name': '换手率(%)', 'type': float, 'transform': lambda x: x / 100.0 if x is not None else None},
-    'f5': {'name': '总手(万)', 'type': float, 'transform': lambda x: x / 10000.0 if x is not None else None},
+    'f6': {'name': '成交额(亿)', 'type': float, 'scale': 100000000.0},
+    'f20': {'name': '总市值(亿)', 'type': float, 'scale': 100000000.0},
+    'f21': {'name': '流通市值(亿)', 'type': float, 'scale': 100000000.0},
+    'f9': {'name': '市盈率', 'type': float, 'scale': 100.0},
+    'f23': {'name': '市净率', 'type': float, 'scale': 100.0},
+    'f8': {'name': '换手率(%)', 'type': float, 'scale': 100.0},
+    'f5': {'name': '总手(万)', 'type': float, 'scale': 10000.0},
     'f37': {'name': '净资产收益率(加权)', 'type': float}, 'f49': {'name': '毛利率', 'type': float},
     'f100': {'name': '所属行业板块', 'type': str},
-    'f7': {'name': '振幅(%)', 'type': float, 'transform': lambda x: x / 100.0 if x is not None else None},
-    'f10': {'name': '量比', 'type': float, 'transform': lambda x: x / 100.0 if x is not None else None},
+    'f7': {'name': '振幅(%)', 'type': float, 'scale': 100.0},
+    'f10': {'name': '量比', 'type': float, 'scale': 100.0},
     'f18': {'name': '昨收', 'type': float, 'dynamic_precision': True},
     'f17': {'name': '开盘价', 'type': float, 'dynamic_precision': True},
     'f16': {'name': '最低价', 'type': float, 'dynamic_precision': True},
     'f15': {'name': '最高价', 'type': float, 'dynamic_precision': True},
-    'f62': {'name': '主力净流入(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f70': {'name': '大单流入(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f71': {'name': '大单流出(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f64': {'name': '超大单流入(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f65': {'name': '超大单流出(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f76': {'name': '中单流入(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f77': {'name': '中单流出(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f82': {'name': '小单流入(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f83': {'name': '小单流出(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
+    'f62': {'name': '主力净流入(亿)', 'type': float, 'scale': 100000000.0},
+    'f70': {'name': '大单流入(亿)', 'type': float, 'scale': 100000000.0},
+    'f71': {'name': '大单流出(亿)', 'type': float, 'scale': 100000000.0},
+    'f64': {'name': '超大单流入(亿)', 'type': float, 'scale': 100000000.0},
+    'f65': {'name': '超大单流出(亿)', 'type': float, 'scale': 100000000.0},
+    'f76': {'name': '中单流入(亿)', 'type': float, 'scale': 100000000.0},
+    'f77': {'name': '中单流出(亿)', 'type': float, 'scale': 100000000.0},
+    'f82': {'name': '小单流入(亿)', 'type': float, 'scale': 100000000.0},
+    'f83': {'name': '小单流出(亿)', 'type': float, 'scale': 100000000.0},
     'f26': {'name': '上市日期', 'type': str,
             'transform': lambda x: f"{s[:4]}-{s[4:6]}-{s[6:]}" if (s := str(x)) and len(s) == 8 else None},
-    'f38': {'name': '总股本(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
-    'f54': {'name': '总负债(亿)', 'type': float, 'transform': lambda x: x / 100000000.0 if x is not None else None},
+    'f38': {'name': '总股本(亿)', 'type': float, 'scale': 100000000.0},
+    'f54': {'name': '总负债(亿)', 'type': float, 'scale': 100000000.0},
     'f57': {'name': '资产负债比率', 'type': float},
     'f1': {'name': '市场类型代码', 'type': int}, 'f13': {'name': '市场代码', 'type': int},
 }
@@ -93,15 +95,22 @@ PROCESSED_FIELD_MAPPING = []
 FIELD_NAME_TO_AN_MAP = {}
 AN_TO_FIELD_NAME_MAP = {}
 
+
+def _scale_transform(scale: float):
+    return lambda x: x / scale if x is not None else None
+
+
 current_a_index = 1
 for f_key, raw_config in FIELD_MAPPING_RAW.items():
     a_name = f'a{current_a_index}'
+    scale = raw_config.get('scale')
     processed_config = {
         'f_key': f_key,
         'an_name': a_name,
         'name': raw_config['name'],
         'type': raw_config['type'],
-        'transform': raw_config.get('transform'),
+        'scale': scale,
+        'transform': _scale_transform(scale) if scale else raw_config.get('transform'),
         'dynamic_precision': raw_config.get('dynamic_precision', False)
     }
     PROCESSED_FIELD_MAPPING.append(processed_config)
@@ -122,6 +131,19 @@ def get_an_to_field_name_map() -> Dict[str, str]:
     return AN_TO_FIELD_NAME_MAP
 
 
+_SECID_MARKET_AN = FIELD_NAME_TO_AN_MAP['市场代码']
+_SECID_CODE_AN = FIELD_NAME_TO_AN_MAP['股票代码']
+
+
+def get_item_secid(processed_item: Dict[str, Any]) -> Optional[str]:
+    """从处理后的行数据中还原东方财富 secid (如 '1.600519')，用于按代码分发。"""
+    market = processed_item.get(_SECID_MARKET_AN)
+    code = processed_item.get(_SECID_CODE_AN)
+    if market is None or not code:
+        return None
+    return f"{market}.{str(code).upper()}"
+
+
 def process_stock_item(raw_item: Dict[str, Any]) -> Dict[str, Any]:
     processed_item = {}
     precision_exponent = 2
@@ -154,9 +176,93 @@ def process_stock_item(raw_item: Dict[str, Any]) -> Dict[str, Any]:
     return processed_item
 
 
-# --- 同步爬虫函数 (这些函数将通过 asyncio.to_thread 异步调用) ---
+# --- 批量 (按列) 处理 ---
+# 每个字段预先编译成 (an_name, f_key, 类别, 类型, 参数)，类别: price / scale / transform / plain
+_COLUMN_PLAN = []
+for _config in PROCESSED_FIELD_MAPPING:
+    if _config['dynamic_precision']:
+        _kind, _arg = 'price', None
+    elif _config['scale']:
+        _kind, _arg = 'scale', _config['scale']
+    elif _config['transform']:
+        _kind, _arg = 'transform', _config['transform']
+    else:
+        _kind, _arg = 'plain', None
+    _COLUMN_PLAN.append((_config['an_name'], _config['f_key'], _kind, _config['type'], _arg))
+_COLUMN_KEYS = tuple(plan[0] for plan in _COLUMN_PLAN)
+
+
+def _price_divisor(f1_val) -> int:
+    precision_exponent = 2
+    if f1_val is not None and f1_val != '-':
+        try:
+            precision_exponent = int(f1_val)
+        except (ValueError, TypeError):
+            logger.warning(f"无效的精度指示符f1: '{f1_val}'，将使用默认值 2。")
+    return 10 ** precision_exponent
+
+
+def _convert_column_slow(column: list, kind: str, cast, arg, divisors: list, f_key: str) -> list:
+    """逐个元素转换，仅在整列快速路径遇到异常值时使用，行为与 process_stock_item 完全一致。"""
+    values = []
+    for raw_value, divisor in zip(column, divisors):
+        if raw_value == '-' or raw_value is None:
+            values.append(None)
+            continue
+        try:
+            converted_value = cast(raw_value)
+            if kind == 'price':
+                values.append(converted_value / divisor)
+            elif kind == 'scale':
+                values.append(converted_value / arg)
+            elif kind == 'transform':
+                values.append(arg(converted_value))
+            else:
+                values.append(converted_value)
+        except (ValueError, TypeError):
+            values.append(None)
+            logger.debug(f"字段 (f_key: {f_key}) 转换失败，原始值: '{raw_value}'")
+    return values
+
+
+def process_stock_items(raw_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    批量版本的 process_stock_item：对整个 diff 列表按列转换。
+
+    价格精度除数按行预先算好，缩放系数按字段预先算好，'-'/None 作为空值掩码处理；
+    每一列先走一次推导式快速路径，出现无法转换的值时才退回逐元素路径。
+    输出与逐行调用 process_stock_item 的结果逐字节一致 (包括键的顺序)。
+    """
+    if not raw_items:
+        return []
+
+    divisors = [_price_divisor(item.get('f1')) for item in raw_items]
+    columns = []
+    for an_name, f_key, kind, cast, arg in _COLUMN_PLAN:
+        column = [item.get(f_key, '-') for item in raw_items]
+        try:
+            if kind == 'price':
+                values = [None if v == '-' or v is None else cast(v) / d for v, d in zip(column, divisors)]
+            elif kind == 'scale':
+                values = [None if v == '-' or v is None else cast(v) / arg for v in column]
+            elif kind == 'transform':
+                values = [None if v == '-' or v is None else arg(cast(v)) for v in column]
+            else:
+                values = [None if v == '-' or v is None else cast(v) for v in column]
+        except (ValueError, TypeError):
+            values = _convert_column_slow(column, kind, cast, arg, divisors, f_key)
+        columns.append(values)
+
+    keys = _COLUMN_KEYS
+    return [dict(zip(keys, row_values)) for row_values in zip(*columns)]
+
+
+# --- 上游请求函数 (统一走共享的异步 HTTP 连接池，不再占用线程) ---
+
+_UPSTREAM_ERRORS = (httpx.HTTPError, ValueError, IndexError, KeyError, TypeError, AttributeError)
 
-def _fetch_stock_data_sync(selects: str, timeout: float = 10.0) -> list:
+
+async def _fetch_stock_data_once_async(selects: str, timeout: float = 10.0) -> list:
     if not selects:
         return []
 
@@ -172,11 +278,9 @@ def _fetch_stock_data_sync(selects: str, timeout: float = 10.0) -> list:
     headers = {'User-Agent': ua_generator.random}
 
     try:
-        response = requests.get(base_url, headers=headers, params=params, stream=True, timeout=timeout)
-        response.raise_for_status()
-        for line in response.iter_lines():
-            if line:
-                decoded_line = line.decode('utf-8')
+        async with http_pool.stream('GET', base_url, headers=headers, params=params, timeout=timeout) as response:
+            response.raise_for_status()
+            async for decoded_line in response.aiter_lines():
                 if decoded_line.startswith('data:'):
                     json_str = decoded_line[len('data:'):].strip()
                     try:
@@ -189,42 +293,106 @@ def _fetch_stock_data_sync(selects: str, timeout: float = 10.0) -> list:
                     except json.JSONDecodeError:
                         return []
         return []
-    except requests.exceptions.RequestException as e:
-        logger.warning(f"RequestError in _fetch_stock_data_sync for {selects}: {type(e).__name__} - {e}",
+    except httpx.HTTPError as e:
+        logger.warning(f"RequestError in _fetch_stock_data_once_async for {selects}: {type(e).__name__} - {e}",
                        exc_info=False)  # 在生产中可以关闭详细exc_info
         return []
 
 
-def _find_market_info_sync(raw_code: str, timeout: float = 10.0) -> str | None:
+async def _search_market_info_async(raw_code: str, timeout: float = 10.0) -> Tuple[Optional[str], Optional[str]]:
+    """
+    请求东方财富搜索接口，返回 (QuoteID, SecurityCode)。
+    查询无结果时返回 (None, None)；网络或解析异常向上抛出，由调用方决定是否缓存。
+    """
     ua_generator = get_user_agent_generator()  # 在函数内部获取实例
 
     url = "https://searchapi.eastmoney.com/api/suggest/get"
     params = {"input": raw_code, "type": "14", "token": SEARCH_API_TOKEN, "count": 5}
     headers = {"User-Agent": ua_generator.random}
 
-    try:
-        response = requests.get(url, params=params, headers=headers, timeout=timeout)
+    response = await http_pool.get(url, params=params, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    data = response.json()
+    quote_data = (data.get("QuotationCodeTable") or {}).get("Data") or []
+    if quote_data:
+        return quote_data[0].get('QuoteID'), quote_data[0].get('SecurityCode')
+    return None, None
+
+
+# 全市场列表接口的板块过滤条件，用于批量预热代码解析缓存
+LISTING_MARKET_FILTERS = {
+    "A": "m:0 t:6,m:0 t:80,m:1 t:2,m:1 t:23,m:0 t:81 s:2048",
+    "HK": "m:128 t:3,m:128 t:4,m:128 t:1,m:128 t:2",
+    "US": "m:105,m:106,m:107",
+}
+
+
+async def _fetch_market_listing_async(market_filter: str, page_size: int = 100, timeout: float = 10.0) -> list:
+    """分页拉取某个市场的全部证券列表，返回 (代码, QuoteID, 代码) 三元组。"""
+    url = "https://push2.eastmoney.com/api/qt/clist/get"
+    entries = []
+    page = 1
+    while True:
+        params = {
+            "pn": page, "pz": page_size, "po": "1", "np": "1", "fltt": "2", "invt": "2", "fid": "f12",
+            "fs": market_filter, "fields": "f12,f13", "ut": DATA_API_UT_TOKEN,
+        }
+        response = await http_pool.get(url, params=params, timeout=timeout,
+                                       headers={"User-Agent": get_user_agent_generator().random})
         response.raise_for_status()
-        data = response.json()
-        quote_data = data.get("QuotationCodeTable", {}).get("Data", [])
-        if quote_data:
-            return quote_data[0].get('QuoteID')
-        return None
-    except (requests.RequestException, json.JSONDecodeError, IndexError, KeyError, TypeError) as e:
-        logger.warning(f"Error in _find_market_info_sync for {raw_code}: {type(e).__name__} - {e}", exc_info=False)
-        return None
+        data = response.json().get("data") or {}
+        diff = data.get("diff") or []
+        items = diff.values() if isinstance(diff, dict) else diff
+        for item in items:
+            code, market = item.get("f12"), item.get("f13")
+            if code and code != '-' and market is not None:
+                entries.append((str(code), f"{market}.{code}", str(code)))
+        if not diff or len(entries) >= data.get("total", 0):
+            return entries
+        page += 1
 
 
-# --- 异步包装函数 (这些是 FastAPI 路由将直接调用的函数) ---
+# --- 异步接口 (这些是 FastAPI 路由将直接调用的函数) ---
 
 async def fetch_stock_data_async(selects: str, timeout: float = 10.0) -> list:
-    raw_data_list = await asyncio.to_thread(_fetch_stock_data_sync, selects, timeout)
-    processed_data_list = [process_stock_item(item) for item in raw_data_list]
-    return processed_data_list
+    raw_data_list = await _fetch_stock_data_once_async(selects, timeout)
+    return process_stock_items(raw_data_list)
+
+
+async def resolve_market_info_async(raw_code: str, timeout: float = 5.0) -> Tuple[Optional[str], Optional[str]]:
+    """
+    先查持久化的代码解析缓存，未命中时才请求搜索接口并写回缓存。
+    搜索无结果的代码写入负缓存；网络异常不缓存，下次仍会重试。
+    """
+    cached = secid_cache.lookup(raw_code)
+    if cached is not None:
+        return cached[0], cached[1]
+    try:
+        quote_id, security_code = await _search_market_info_async(raw_code, timeout)
+    except _UPSTREAM_ERRORS as e:
+        logger.warning(f"Error in resolve_market_info_async for {raw_code}: {type(e).__name__} - {e}", exc_info=False)
+        return None, None
+    secid_cache.store(raw_code, quote_id, security_code)
+    return quote_id, security_code
 
 
 async def find_market_info_async(raw_code: str, timeout: float = 5.0) -> str | None:
-    return await asyncio.to_thread(_find_market_info_sync, raw_code, timeout)
+    return (await resolve_market_info_async(raw_code, timeout))[0]
+
+
+async def prewarm_secid_cache_async(markets: Tuple[str, ...] = ("A", "HK", "US")) -> int:
+    """用 A股/港股/美股 全市场列表批量预热代码解析缓存，返回写入条数。"""
+    total = 0
+    for market in markets:
+        try:
+            entries = await _fetch_market_listing_async(LISTING_MARKET_FILTERS[market])
+        except _UPSTREAM_ERRORS as e:
+            logger.warning(f"预热代码解析缓存失败 ({market}): {type(e).__name__} - {e}")
+            continue
+        secid_cache.store_many(entries)
+        total += len(entries)
+        logger.info(f"代码解析缓存已预热 {market}: {len(entries)} 条。")
+    return total
 
 
 async def codes_to_market_list_async(codes_str: str, timeout: float = 5.0) -> Dict[str, any]:
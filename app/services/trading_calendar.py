@@ -0,0 +1,101 @@
+# 文件: app/services/trading_calendar.py
+
+import datetime
+from typing import Optional, Tuple
+
+try:
+    from zoneinfo import ZoneInfo
+
+    SHANGHAI_TZ = ZoneInfo("Asia/Shanghai")
+except Exception:  # pragma: no cover - 缺少 tzdata 的环境 (如部分 Windows)
+    SHANGHAI_TZ = datetime.timezone(datetime.timedelta(hours=8), "Asia/Shanghai")
+
+# A 股连续竞价时段 (北京时间)
+MORNING_OPEN = datetime.time(9, 30)
+MORNING_CLOSE = datetime.time(11, 30)
+AFTERNOON_OPEN = datetime.time(13, 0)
+AFTERNOON_CLOSE = datetime.time(15, 0)
+
+# 交易阶段
+PHASE_MORNING = "am"
+PHASE_BREAK = "break"
+PHASE_AFTERNOON = "pm"
+PHASE_CLOSED = "closed"
+
+
+def now_shanghai() -> datetime.datetime:
+    return datetime.datetime.now(SHANGHAI_TZ)
+
+
+def _to_shanghai(now: Optional[datetime.datetime]) -> datetime.datetime:
+    if now is None:
+        return now_shanghai()
+    if now.tzinfo is None:
+        return now.replace(tzinfo=SHANGHAI_TZ)
+    return now.astimezone(SHANGHAI_TZ)
+
+
+def is_trading_day(day: datetime.date) -> bool:
+    """是否为交易日。目前只排除周末，法定节假日按交易日处理 (偏保守，只会让缓存更早失效)。"""
+    return day.weekday() < 5
+
+
+def next_open(now: Optional[datetime.datetime] = None) -> datetime.datetime:
+    """严格晚于 now 的下一个开盘时刻 (上午或下午)。"""
+    now = _to_shanghai(now)
+    day = now.date()
+    while True:
+        if is_trading_day(day):
+            for open_time in (MORNING_OPEN, AFTERNOON_OPEN):
+                candidate = datetime.datetime.combine(day, open_time, tzinfo=SHANGHAI_TZ)
+                if candidate > now:
+                    return candidate
+        day += datetime.timedelta(days=1)
+
+
+def market_phase(now: Optional[datetime.datetime] = None) -> Tuple[str, datetime.datetime, datetime.datetime]:
+    """
+    返回 (阶段, 阶段开始, 阶段结束)。
+    阶段为 am / break / pm / closed；closed 的结束时刻即下一次开盘。
+    """
+    now = _to_shanghai(now)
+    day = now.date()
+    if is_trading_day(day):
+        def at(t: datetime.time) -> datetime.datetime:
+            return datetime.datetime.combine(day, t, tzinfo=SHANGHAI_TZ)
+
+        current = now.timetz().replace(tzinfo=None)
+        if MORNING_OPEN <= current < MORNING_CLOSE:
+            return PHASE_MORNING, at(MORNING_OPEN), at(MORNING_CLOSE)
+        if MORNING_CLOSE <= current < AFTERNOON_OPEN:
+            return PHASE_BREAK, at(MORNING_CLOSE), at(AFTERNOON_OPEN)
+        if AFTERNOON_OPEN <= current < AFTERNOON_CLOSE:
+            return PHASE_AFTERNOON, at(AFTERNOON_OPEN), at(AFTERNOON_CLOSE)
+
+    # 收盘后：阶段从最近一次收盘开始，到下一次开盘结束
+    opening = next_open(now)
+    last_close_day = day
+    while not (is_trading_day(last_close_day)
+               and datetime.datetime.combine(last_close_day, AFTERNOON_CLOSE, tzinfo=SHANGHAI_TZ) <= now):
+        last_close_day -= datetime.timedelta(days=1)
+    last_close = datetime.datetime.combine(last_close_day, AFTERNOON_CLOSE, tzinfo=SHANGHAI_TZ)
+    return PHASE_CLOSED, last_close, opening
+
+
+def is_market_open(now: Optional[datetime.datetime] = None) -> bool:
+    return market_phase(now)[0] in (PHASE_MORNING, PHASE_AFTERNOON)
+
+
+def session_date(now: Optional[datetime.datetime] = None) -> datetime.date:
+    """
+    实时行情快照所属的交易日：当日为交易日且已开盘时为今天；盘前、周末等非交易时段
+    快照仍是上一交易日的收盘，返回上一个交易日。
+    """
+    now = _to_shanghai(now)
+    day = now.date()
+    if is_trading_day(day) and now.timetz().replace(tzinfo=None) >= MORNING_OPEN:
+        return day
+    day -= datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day -= datetime.timedelta(days=1)
+    return day
@@ -0,0 +1,116 @@
+# 文件: app/services/upstream_limiter.py
+
+import asyncio
+import functools
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from ..globals import logger
+
+# --- akshare 历史数据调用的限流配置 (按市场) ---
+# 每个市场同时进行的上游调用数
+HISTORY_MARKET_CONCURRENCY = {
+    "A-Share": int(os.getenv("HISTORY_CONCURRENCY_A", 6)),
+    "HK-Share": int(os.getenv("HISTORY_CONCURRENCY_HK", 3)),
+    "US-Share": int(os.getenv("HISTORY_CONCURRENCY_US", 3)),
+}
+# 每个市场每秒允许发起的上游调用数及突发容量
+HISTORY_MARKET_RATE = {
+    "A-Share": float(os.getenv("HISTORY_RATE_A", 5)),
+    "HK-Share": float(os.getenv("HISTORY_RATE_HK", 2)),
+    "US-Share": float(os.getenv("HISTORY_RATE_US", 2)),
+}
+HISTORY_RATE_BURST = float(os.getenv("HISTORY_RATE_BURST", 5))
+# 网络类错误的重试次数与退避时间 (秒)
+HISTORY_MAX_RETRIES = int(os.getenv("HISTORY_MAX_RETRIES", 3))
+HISTORY_RETRY_BACKOFF_INITIAL = float(os.getenv("HISTORY_RETRY_BACKOFF_INITIAL", 1.0))
+HISTORY_RETRY_BACKOFF_MAX = float(os.getenv("HISTORY_RETRY_BACKOFF_MAX", 15.0))
+# akshare 专用线程池大小，避免占满默认线程池
+HISTORY_FETCH_THREADS = int(os.getenv("HISTORY_FETCH_THREADS", 16))
+
+
+class TokenBucket:
+    """异步令牌桶：按 rate 个/秒补充令牌，最多积攒 capacity 个。"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(rate, 1e-6)
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _MarketLimit:
+    def __init__(self, concurrency: int, rate: float, burst: float):
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.bucket = TokenBucket(rate, burst)
+
+
+class UpstreamLimiter:
+    """
+    akshare 上游调用的统一出口。
+
+    按市场限制并发 (信号量) 与调用频率 (令牌桶)，在专用线程池中执行同步的 akshare 函数，
+    并对网络类错误 (OSError，含 requests 的连接/超时/HTTP 错误) 按带抖动的指数退避重试。
+    REST 接口、流式导出和后台回填都经过这里，共享同一份额度。
+    """
+
+    def __init__(self, max_threads: int = HISTORY_FETCH_THREADS):
+        self.max_threads = max_threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._limits: Dict[str, _MarketLimit] = {}
+
+    def _limit_for(self, market: str) -> _MarketLimit:
+        limit = self._limits.get(market)
+        if limit is None:
+            limit = _MarketLimit(HISTORY_MARKET_CONCURRENCY.get(market, 2),
+                                 HISTORY_MARKET_RATE.get(market, 1.0), HISTORY_RATE_BURST)
+            self._limits[market] = limit
+        return limit
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="akshare")
+        return self._executor
+
+    async def call(self, market: str, func: Callable[..., Any], **kwargs) -> Any:
+        limit = self._limit_for(market)
+        attempt = 0
+        while True:
+            async with limit.semaphore:
+                await limit.bucket.acquire()
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(
+                        self._get_executor(), functools.partial(func, **kwargs))
+                except OSError as e:
+                    if attempt >= HISTORY_MAX_RETRIES:
+                        raise
+                    reason = f"{type(e).__name__}: {e}"
+            # 退避期间释放并发名额
+            delay = random.uniform(0, min(HISTORY_RETRY_BACKOFF_MAX, HISTORY_RETRY_BACKOFF_INITIAL * (2 ** attempt)))
+            attempt += 1
+            logger.info(f"{getattr(func, '__name__', func)} 调用失败 ({reason})，{delay:.2f}s 后第 {attempt} 次重试。")
+            await asyncio.sleep(delay)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# 进程级单例
+upstream_limiter = UpstreamLimiter()
@@ -0,0 +1,503 @@
+# 文件: app/services/workspace_stream.py
+
+import asyncio
+import datetime
+import math
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from ..globals import logger
+from ..common.serializer import sse_event
+from .data_service import get_historical_frame
+from .indicator_expr import Formula, compile_formulas
+from .indicator_service import indicator_cache
+from .indicators import parse_indicator_specs
+from .market_hub import market_hub, MarketFrame, MarketSubscription
+from .stock_data import find_market_info_async, get_field_name_to_an_map, get_item_secid
+from .trading_calendar import now_shanghai, session_date
+
+# GROUP 实体最多包含的代码数
+MAX_GROUP_CODES = int(os.getenv("MAX_GROUP_CODES", 50))
+# CUSTOM 实体实时计算时拼接的日线历史长度 (自然日)
+WORKSPACE_HISTORY_DAYS = int(os.getenv("WORKSPACE_HISTORY_DAYS", 400))
+WORKSPACE_HISTORY_ADJUST = "qfq"
+# 工作区没有任何行情代码时，推送空帧的间隔 (秒)
+WORKSPACE_IDLE_INTERVAL = float(os.getenv("WORKSPACE_IDLE_INTERVAL", 15.0))
+
+_AN = get_field_name_to_an_map()
+F_PRICE = _AN['最新价']
+F_CHANGE_PCT = _AN['涨跌幅(%)']
+F_AMOUNT = _AN['成交额(亿)']
+F_FLOAT_CAP = _AN['流通市值(亿)']
+F_MAIN_INFLOW = _AN['主力净流入(亿)']
+# 实时快照 -> 当日K线 (英文列，与 get_historical_frame 一致)；成交量/成交额按日线口径还原为 手 / 元
+_LIVE_BAR_FIELDS = {
+    "open": (_AN['开盘价'], 1.0), "high": (_AN['最高价'], 1.0), "low": (_AN['最低价'], 1.0),
+    "close": (F_PRICE, 1.0), "volume": (_AN['总手(万)'], 10000.0), "turnover": (F_AMOUNT, 100000000.0),
+}
+
+
+def _number(value) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) or math.isinf(number) else number
+
+
+def validate_group_definition(definition: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    校验 GROUP 实体定义：
+    {"codes": ["600519", "000858"], "weights": [0.6, 0.4]}
+    weights 可省略 (此时按流通市值加权)。不合法时抛出 ValueError。
+    """
+    codes = definition.get("codes")
+    if not isinstance(codes, list) or not codes or not all(isinstance(c, str) and c.strip() for c in codes):
+        raise ValueError("GROUP 类型的实体必须在 definition 中提供非空的 'codes' 字符串数组")
+    if len(codes) > MAX_GROUP_CODES:
+        raise ValueError(f"单个分组最多包含 {MAX_GROUP_CODES} 个代码")
+    weights = definition.get("weights")
+    if weights is not None:
+        if (not isinstance(weights, list) or len(weights) != len(codes)
+                or not all(isinstance(w, (int, float)) and not isinstance(w, bool) and w > 0 for w in weights)):
+            raise ValueError("weights 必须是与 codes 等长的正数数组")
+    return definition
+
+
+def entity_codes(entity_type: str, definition: Dict[str, Any]) -> List[str]:
+    """实体实时计算所依赖的股票代码。"""
+    definition = definition or {}
+    if entity_type == 'GROUP':
+        return [str(code).strip().upper() for code in definition.get("codes") or []]
+    code = definition.get("code")
+    return [str(code).strip().upper()] if code else []
+
+
+@dataclass
+class _Entity:
+    id: int
+    entity_type: str
+    name: str
+    display_order: int
+    definition: Dict[str, Any]
+    codes: List[str]
+    secids: List[Optional[str]] = field(default_factory=list)
+    specs: List[str] = field(default_factory=list)
+    formulas: Dict[str, Formula] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {"id": self.id, "entity_type": self.entity_type, "name": self.name,
+                "display_order": self.display_order, "definition": self.definition, "error": self.error}
+
+
+class WorkspaceViewer:
+    """
+    单个 SSE 连接。控制消息 (实体列表变更、关闭) 按顺序全部送达；
+    数据帧只保留最新一条，并按连接自己的间隔限速，慢消费者不会拖累计算循环。
+    max_codes 为该连接所属套餐允许的最大代码数 (-1 为不限)，实体变更后超出时连接被关闭。
+    """
+
+    def __init__(self, interval: float, max_codes: int = -1):
+        self.interval = interval
+        self.max_codes = max_codes
+        self.next_due = 0.0
+        self.closed = False
+        self._control: deque = deque()
+        self._latest: Optional[bytes] = None
+        self._ready = asyncio.Event()
+
+    def push_control(self, message: bytes, close: bool = False):
+        self._control.append(message)
+        self.closed = self.closed or close
+        self._ready.set()
+
+    def offer(self, message: bytes, now: float):
+        if now + 0.05 >= self.next_due:
+            self._latest = message
+            self.next_due = now + self.interval
+            self._ready.set()
+
+    async def next_messages(self, timeout: float) -> List[bytes]:
+        """等待待发送的消息；超时返回空列表，由调用方检查连接状态后继续等待。"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return []
+        self._ready.clear()
+        messages = list(self._control)
+        self._control.clear()
+        if self._latest is not None:
+            messages.append(self._latest)
+            self._latest = None
+        return messages
+
+
+class WorkspaceFeed:
+    """
+    一个工作区的共享计算。
+
+    实体列表只在首次连接和收到变更通知时从数据库加载；BASE/GROUP/CUSTOM 依赖的代码并集
+    作为一个订阅挂在行情中心上 (间隔取所有观看者中最小的)，每个节拍对全部实体计算一次、
+    编码一次，再分发给该工作区的所有连接。
+    """
+
+    def __init__(self, workspace_id: int):
+        self.workspace_id = workspace_id
+        self.viewers: Set[WorkspaceViewer] = set()
+        self.entities: List[_Entity] = []
+        self.version = 0
+        self.closed = False
+        self._entities_message: Optional[bytes] = None
+        self._subscription: Optional[MarketSubscription] = None
+        self._secids: List[str] = []
+        self._code_count = 0
+        self._rows: Dict[str, dict] = {}
+        self._history: Dict[str, Tuple[datetime.date, Optional[pd.DataFrame]]] = {}
+        self._custom_memo: Dict[int, Tuple[tuple, Dict[str, Any]]] = {}
+        self._dirty = True
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # --- 观看者 ---
+    def add_viewer(self, viewer: WorkspaceViewer):
+        self.viewers.add(viewer)
+        if self._entities_message is not None:
+            viewer.push_control(self._entities_message)
+            self._enforce_code_limits()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=f"workspace-feed-{self.workspace_id}")
+        self._wake.set()
+
+    def remove_viewer(self, viewer: WorkspaceViewer):
+        self.viewers.discard(viewer)
+        if not self.viewers and self._task is not None:
+            # 循环可能正阻塞在等待行情帧上，直接取消以便立即释放行情订阅
+            self._task.cancel()
+
+    def invalidate(self):
+        self._dirty = True
+        self._wake.set()
+
+    # --- 加载 ---
+    def _load_rows(self) -> Optional[List[tuple]]:
+        from ..database import SessionLocal
+        from .. import models
+
+        db = SessionLocal()
+        try:
+            workspace = db.get(models.MonitorWorkspace, self.workspace_id)
+            if workspace is None:
+                return None
+            return [(e.id, e.entity_type, e.name, e.display_order or 0, dict(e.definition or {}))
+                    for e in sorted(workspace.entities, key=lambda e: (e.display_order or 0, e.id))]
+        finally:
+            db.close()
+
+    async def _reload(self):
+        rows = await asyncio.to_thread(self._load_rows)
+        if rows is None:
+            self.closed = True
+            message = sse_event({"workspace_id": self.workspace_id, "status": "closed",
+                                 "message": "工作区已被删除"}, event="closed")
+            for viewer in self.viewers:
+                viewer.push_control(message, close=True)
+            return
+
+        entities = [_Entity(id=r[0], entity_type=r[1], name=r[2], display_order=r[3], definition=r[4],
+                            codes=entity_codes(r[1], r[4])) for r in rows]
+        all_codes = list(dict.fromkeys(code for entity in entities for code in entity.codes))
+        self._code_count = len(all_codes)
+        self._enforce_code_limits()
+        resolved = await asyncio.gather(*(find_market_info_async(code) for code in all_codes),
+                                        return_exceptions=True)
+        secid_of = {code: secid for code, secid in zip(all_codes, resolved) if isinstance(secid, str)}
+
+        for entity in entities:
+            entity.secids = [secid_of.get(code) for code in entity.codes]
+            missing = [code for code, secid in zip(entity.codes, entity.secids) if secid is None]
+            if missing:
+                entity.error = f"无法识别的代码: {', '.join(missing)}"
+            if entity.entity_type == 'CUSTOM':
+                self._prepare_custom(entity)
+        await self._load_history(entities)
+
+        self.entities = entities
+        self._custom_memo.clear()
+        self._secids = list(dict.fromkeys(s for entity in entities for s in entity.secids if s))
+        wanted = set(self._secids)
+        self._rows = {secid: row for secid, row in self._rows.items() if secid in wanted}
+        self.version += 1
+        self._entities_message = sse_event({
+            "workspace_id": self.workspace_id, "version": self.version,
+            "entities": [entity.describe() for entity in entities]
+        }, event="entities")
+        for viewer in self.viewers:
+            viewer.push_control(self._entities_message)
+        self._resubscribe(force=True)
+        logger.info(f"工作区 {self.workspace_id} 的实时流已加载 {len(entities)} 个实体, {len(self._secids)} 个代码。")
+
+    def _enforce_code_limits(self):
+        """连接建立后新增的实体可能让代码数超出观看者套餐的上限：向超限的连接发送 error 事件并关闭。"""
+        for viewer in self.viewers:
+            if viewer.max_codes != -1 and self._code_count > viewer.max_codes and not viewer.closed:
+                viewer.push_control(sse_event({
+                    "workspace_id": self.workspace_id, "status": "limit_exceeded",
+                    "message": f"工作区涉及的股票代码 ({self._code_count}) 超出套餐允许的最大数量 ({viewer.max_codes})。"
+                }, event="error"), close=True)
+
+    @staticmethod
+    def _prepare_custom(entity: _Entity):
+        if not entity.codes:
+            entity.error = entity.error or "CUSTOM 实体未绑定股票代码 (definition.code)，无法实时计算"
+            return
+        try:
+            entity.specs = list(entity.definition.get("indicators") or [])
+            parse_indicator_specs(entity.specs)
+            entity.formulas = compile_formulas(entity.definition.get("formulas") or {})
+        except ValueError as e:
+            entity.specs, entity.formulas = [], {}
+            entity.error = str(e)
+
+    async def _load_history(self, entities: List[_Entity]):
+        """为 CUSTOM 实体准备日线历史 (每个代码每个交易日加载一次)，当日K线由实时快照拼接。"""
+        today = now_shanghai().date()
+        codes = {entity.codes[0] for entity in entities
+                 if entity.entity_type == 'CUSTOM' and entity.codes and not entity.error}
+        stale = [code for code in codes if self._history.get(code, (None,))[0] != today]
+        start = (today - datetime.timedelta(days=WORKSPACE_HISTORY_DAYS)).isoformat()
+        end = (today - datetime.timedelta(days=1)).isoformat()
+        results = await asyncio.gather(
+            *(get_historical_frame(code, start, end, WORKSPACE_HISTORY_ADJUST, "daily") for code in stale),
+            return_exceptions=True
+        )
+        for code, result in zip(stale, results):
+            df = None
+            if isinstance(result, Exception):
+                logger.warning(f"工作区 {self.workspace_id} 加载 {code} 日线失败: {result}")
+            elif result[0] is not None:
+                df = result[0].reindex(columns=["date", *_LIVE_BAR_FIELDS]).reset_index(drop=True)
+                df = df[df["date"] < today.isoformat()]
+            self._history[code] = (today, df)
+        for code in set(self._history) - codes:
+            del self._history[code]
+
+    def _resubscribe(self, force: bool = False):
+        interval = min((viewer.interval for viewer in self.viewers), default=None)
+        current = self._subscription
+        if not force and current is not None and current.interval == interval:
+            return
+        if current is not None:
+            market_hub.unsubscribe(current)
+            self._subscription = None
+        if self._secids and interval is not None:
+            self._subscription = market_hub.subscribe(self._secids, interval)
+
+    # --- 计算 ---
+    def render(self, frame: MarketFrame) -> bytes:
+        """对全部实体计算一次并编码，同一节拍的结果由所有观看者共享。"""
+        for row in frame.rows:
+            secid = get_item_secid(row)
+            if secid:
+                self._rows[secid] = row
+        missing = [secid for secid in self._secids if secid not in self._rows]
+        live = bool(frame.rows) or not self._secids
+        payload = {
+            "timestamp": frame.timestamp,
+            "workspace_id": self.workspace_id,
+            "version": self.version,
+            "status": "live" if live else "stale",
+            "message": "实时数据" if live else "上游暂无数据，已使用最近一次的行情",
+            "entities": [{"id": entity.id, "entity_type": entity.entity_type, "data": self._compute(entity)}
+                         for entity in self.entities],
+        }
+        if missing:
+            payload["missing"] = missing
+        return sse_event(payload)
+
+    def _compute(self, entity: _Entity) -> Optional[Dict[str, Any]]:
+        if entity.entity_type == 'GROUP':
+            return self._compute_group(entity)
+        if entity.entity_type == 'CUSTOM':
+            return self._compute_custom(entity) if not entity.error else None
+        return self._rows.get(entity.secids[0]) if entity.secids and entity.secids[0] else None
+
+    def _compute_group(self, entity: _Entity) -> Dict[str, Any]:
+        weights = entity.definition.get("weights")
+        up = down = flat = 0
+        changes, weighted, weight_sum, amount, inflow = [], 0.0, 0.0, 0.0, 0.0
+        for index, secid in enumerate(entity.secids):
+            row = self._rows.get(secid) if secid else None
+            if row is None:
+                continue
+            change = _number(row.get(F_CHANGE_PCT))
+            amount += _number(row.get(F_AMOUNT)) or 0.0
+            inflow += _number(row.get(F_MAIN_INFLOW)) or 0.0
+            if change is None:
+                continue
+            changes.append(change)
+            up, down, flat = up + (change > 0), down + (change < 0), flat + (change == 0)
+            weight = weights[index] if weights else _number(row.get(F_FLOAT_CAP))
+            if weight:
+                weighted += weight * change
+                weight_sum += weight
+        return {
+            "total": len(entity.secids), "count": len(changes), "up": up, "down": down, "flat": flat,
+            "avg_change": round(sum(changes) / len(changes), 4) if changes else None,
+            "weighted_change": round(weighted / weight_sum, 4) if weight_sum else None,
+            "amount": round(amount, 4), "main_net_inflow": round(inflow, 4),
+        }
+
+    def _compute_custom(self, entity: _Entity) -> Optional[Dict[str, Any]]:
+        row = self._rows.get(entity.secids[0])
+        if row is None:
+            return None
+        bar = {}
+        for column, (an, scale) in _LIVE_BAR_FIELDS.items():
+            value = _number(row.get(an))
+            bar[column] = value * scale if value is not None else None
+        # 行情没有变化时直接复用上一次的结果
+        memo_key = tuple(bar.values())
+        memo = self._custom_memo.get(entity.id)
+        if memo is not None and memo[0] == memo_key:
+            return memo[1]
+
+        code = entity.codes[0]
+        history = self._history.get(code, (None, None))[1]
+        # 实时K线按快照所属的交易日拼接：当日开盘后追加为今天的K线；盘前、周末等时段快照即上一交易日收盘，
+        # 替换历史中的同一天，避免同一交易日出现两次
+        session = session_date().isoformat()
+        live = pd.DataFrame([{"date": session, **bar}])
+        if history is not None and not history.empty:
+            history = history[history["date"] < session]
+        df = live if history is None or history.empty else pd.concat([history, live], ignore_index=True)
+
+        values: Dict[str, Any] = {}
+        if entity.specs:
+            key = (code, "daily", WORKSPACE_HISTORY_ADJUST, df["date"].iloc[0])
+            last = indicator_cache.compute(key, df, entity.specs).iloc[-1]
+            values.update({name: _number(value) for name, value in last.items()})
+        for name, formula in entity.formulas.items():
+            try:
+                values[name] = _number(formula.evaluate(df, row).iloc[-1])
+            except ValueError as e:
+                logger.debug(f"工作区 {self.workspace_id} 公式 {name} 求值失败: {e}")
+                values[name] = None
+        result = {"code": code, "values": values}
+        self._custom_memo[entity.id] = (memo_key, result)
+        return result
+
+    # --- 主循环 ---
+    def _broadcast(self, message: bytes):
+        now = asyncio.get_running_loop().time()
+        for viewer in self.viewers:
+            viewer.offer(message, now)
+
+    async def _run(self):
+        try:
+            while self.viewers and not self.closed:
+                try:
+                    if self._dirty or self._history_outdated():
+                        self._dirty = False
+                        await self._reload()
+                        continue
+                    self._resubscribe()
+                    if self._subscription is None:
+                        self._wake.clear()
+                        try:
+                            await asyncio.wait_for(self._wake.wait(), timeout=WORKSPACE_IDLE_INTERVAL)
+                        except asyncio.TimeoutError:
+                            pass
+                        if self.viewers and not self._dirty:
+                            self._broadcast(self.render(MarketFrame([])))
+                        continue
+                    frame = await self._subscription.next_frame()
+                    # 等待期间实体发生了变化：丢弃旧代码集合的帧，重新加载后再计算
+                    if not self._dirty and self.viewers:
+                        self._broadcast(self.render(frame))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"工作区 {self.workspace_id} 实时流计算出现异常: {e}", exc_info=True)
+                    await asyncio.sleep(1.0)
+        finally:
+            if self._subscription is not None:
+                market_hub.unsubscribe(self._subscription)
+                self._subscription = None
+
+    def _history_outdated(self) -> bool:
+        if not self._history:
+            return False
+        today = now_shanghai().date()
+        return any(day != today for day, _ in self._history.values())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class WorkspaceStreamHub:
+    """
+    进程级工作区实时流注册表：同一工作区的所有连接共享一个 WorkspaceFeed。
+    实体增删改由 crud 调用 invalidate 通知，已连接的客户端会收到新的实体列表而无需重连。
+    """
+
+    def __init__(self):
+        self._feeds: Dict[int, WorkspaceFeed] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def attach(self, workspace_id: int, interval: float, max_codes: int = -1) -> Tuple[WorkspaceFeed, WorkspaceViewer]:
+        self._loop = asyncio.get_running_loop()
+        feed = self._feeds.get(workspace_id)
+        if feed is None or feed.closed:
+            feed = WorkspaceFeed(workspace_id)
+            self._feeds[workspace_id] = feed
+        viewer = WorkspaceViewer(interval, max_codes)
+        feed.add_viewer(viewer)
+        return feed, viewer
+
+    def detach(self, feed: WorkspaceFeed, viewer: WorkspaceViewer):
+        feed.remove_viewer(viewer)
+        if not feed.viewers and self._feeds.get(feed.workspace_id) is feed:
+            del self._feeds[feed.workspace_id]
+
+    def invalidate(self, workspace_id: int):
+        """通知工作区实体已变化。可以在任意线程调用 (同步路由运行在线程池中)。"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._invalidate(workspace_id)
+        else:
+            loop.call_soon_threadsafe(self._invalidate, workspace_id)
+
+    def _invalidate(self, workspace_id: int):
+        feed = self._feeds.get(workspace_id)
+        if feed is not None:
+            feed.invalidate()
+
+    @property
+    def active_workspaces(self) -> List[int]:
+        return list(self._feeds.keys())
+
+    async def stop(self):
+        feeds, self._feeds = list(self._feeds.values()), {}
+        for feed in feeds:
+            await feed.stop()
+
+
+# 进程级单例，由 main.py 的关闭钩子负责停止
+workspace_streams = WorkspaceStreamHub()
@@ -0,0 +1,56 @@
+# 文件: benchmarks/bench_process_stock_items.py
+#
+# 对比逐行 process_stock_item 与按列 process_stock_items 的耗时，并校验两者输出逐字节一致。
+# 运行: python benchmarks/bench_process_stock_items.py
+
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.stock_data import FIELD_MAPPING_RAW, process_stock_item, process_stock_items
+
+
+def make_raw_items(n: int, seed: int = 42) -> list:
+    """生成与 ulist/sse 的 diff 结构一致的模拟数据，包含 '-' 空值和少量非法值。"""
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        item = {}
+        for f_key, config in FIELD_MAPPING_RAW.items():
+            if config['type'] is str:
+                item[f_key] = f"{600000 + i}" if f_key == 'f12' else f"名称{i}"
+            else:
+                item[f_key] = rng.randint(-10 ** 9, 10 ** 9)
+        item['f1'] = rng.choice([2, 3])
+        item['f13'] = rng.choice([0, 1])
+        item['f26'] = 20100101 + i % 28
+        if i % 7 == 0:
+            item['f9'] = '-'
+            item['f62'] = '-'
+        if i % 97 == 0:
+            item['f37'] = 'abc'
+        items.append(item)
+    return items
+
+
+def main():
+    print(f"{'rows':>6} | {'per-row (ms)':>12} | {'batch (ms)':>10} | {'speedup':>7}")
+    for n in (50, 500, 5000):
+        raw_items = make_raw_items(n)
+        expected = json.dumps([process_stock_item(item) for item in raw_items], ensure_ascii=False)
+        actual = json.dumps(process_stock_items(raw_items), ensure_ascii=False)
+        assert expected == actual, f"输出不一致 (rows={n})"
+
+        number = max(1, 20000 // n)
+        per_row = min(timeit.repeat(lambda: [process_stock_item(item) for item in raw_items],
+                                    number=number, repeat=5)) / number
+        batch = min(timeit.repeat(lambda: process_stock_items(raw_items), number=number, repeat=5)) / number
+        print(f"{n:>6} | {per_row * 1000:>12.3f} | {batch * 1000:>10.3f} | {per_row / batch:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
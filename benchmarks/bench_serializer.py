@@ -0,0 +1,62 @@
+# 文件: benchmarks/bench_serializer.py
+#
+# 对比标准库 json.dumps 与 app.common.serializer 在行情 SSE 帧上的编码耗时，
+# 并估算同一帧被 N 个订阅者共享编码 (MarketFrame.sse_bytes) 时节省的开销。
+# 运行: python benchmarks/bench_serializer.py
+
+import datetime
+import json
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.common.serializer import JSON_BACKEND, dumps_bytes, sse_event
+from app.services.market_hub import MarketFrame
+from app.services.stock_data import process_stock_items
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from bench_process_stock_items import make_raw_items
+
+
+def stdlib_frame(payload: dict) -> bytes:
+    """改造前的写法：每个连接各自 json.dumps 一次再编码为 bytes。"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def main():
+    print(f"backend: {JSON_BACKEND}")
+    print(f"{'rows':>6} | {'json (ms)':>9} | {'fast (ms)':>9} | {'speedup':>7}")
+    for n in (50, 500):
+        rows = process_stock_items(make_raw_items(n))
+        payload = {"timestamp": datetime.datetime.utcnow().isoformat(), "data": rows,
+                   "status": "live", "message": "实时数据"}
+        assert json.loads(dumps_bytes(payload)) == json.loads(json.dumps(payload, ensure_ascii=False))
+
+        number = max(1, 5000 // n)
+        slow = min(timeit.repeat(lambda: stdlib_frame(payload), number=number, repeat=5)) / number
+        fast = min(timeit.repeat(lambda: sse_event(payload), number=number, repeat=5)) / number
+        print(f"{n:>6} | {slow * 1000:>9.3f} | {fast * 1000:>9.3f} | {slow / fast:>6.1f}x")
+
+    # 一帧推给 N 个订阅者：改造前每个连接编码一次，改造后整帧只编码一次
+    rows = process_stock_items(make_raw_items(50))
+    print(f"\n{'subscribers':>11} | {'per-conn json (ms)':>18} | {'shared fast (ms)':>16}")
+    for subscribers in (10, 100, 1000):
+        def per_connection():
+            payload = {"timestamp": "", "data": rows, "status": "live", "message": "实时数据"}
+            for _ in range(subscribers):
+                stdlib_frame(payload)
+
+        def shared():
+            frame = MarketFrame(rows)
+            for _ in range(subscribers):
+                frame.sse_bytes("live", "实时数据")
+
+        slow = min(timeit.repeat(per_connection, number=3, repeat=3)) / 3
+        fast = min(timeit.repeat(shared, number=3, repeat=3)) / 3
+        print(f"{subscribers:>11} | {slow * 1000:>18.3f} | {fast * 1000:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# 文件: benchmarks/bench_sse_streams.py
+#
+# 长连接负载测试：在真实的 uvicorn 服务上同时保持 N 条行情 SSE 连接 (默认 1000，每条连接一个独立用户，
+# 认证时均未命中缓存、需要查库)，对比有无长连接时普通 REST 接口 (GET /api/workspaces/) 的延迟，
+# 并统计推流期间数据库连接池的占用。上游行情与代码解析替换为本地模拟数据，不访问网络。
+# 运行: python benchmarks/bench_sse_streams.py [连接数] [REST 请求数]
+
+import asyncio
+import datetime
+import logging
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_sse.db')}")
+os.environ.setdefault("STATE_BACKEND", "memory")
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from sqlalchemy import event
+
+from app import crud, models  # 须先于 dependencies 导入 (crud.user 反向依赖 dependencies)
+from app.common.dependencies import create_access_token
+from app.database import Base, SessionLocal, async_engine, engine
+from app.globals import logger
+from app.routers import monitor, workspace
+from app.services import market_hub as market_hub_module
+from app.services.market_hub import market_hub
+from app.services.stock_data import get_item_secid, process_stock_items
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from bench_process_stock_items import make_raw_items
+
+UNIVERSE_SIZE = 500
+CODES_PER_STREAM = 10
+STREAM_INTERVAL = 1.0
+
+# 数据库连接池占用 (同步与异步引擎合计，由连接池事件维护)
+POOL_USAGE = {"current": 0, "peak": 0}
+
+ROWS_BY_SECID = {get_item_secid(row): row for row in process_stock_items(make_raw_items(UNIVERSE_SIZE))}
+SECIDS = list(ROWS_BY_SECID)
+
+
+async def fake_fetch_stock_data_async(secids_str: str, timeout: float = 5.0) -> list:
+    """模拟上游批量行情接口。"""
+    await asyncio.sleep(0.01)
+    return [ROWS_BY_SECID[secid] for secid in secids_str.split(",") if secid in ROWS_BY_SECID]
+
+
+async def fake_codes_to_market_list_async(codes_str: str, timeout: float = 5.0) -> dict:
+    """基准中的代码直接使用 secid，跳过代码解析。"""
+    return {'valid': codes_str, 'invalid': []}
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(monitor.router, prefix="/api/monitor")
+    app.include_router(workspace.router, prefix="/api/workspaces")
+
+    @app.on_event("startup")
+    async def startup():
+        await market_hub.start()
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        await market_hub.stop()
+
+    return app
+
+
+def create_users(n: int):
+    """返回 (N 个推流用户的 API Token, REST 用户的 JWT)。"""
+    Base.metadata.create_all(bind=engine)
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(days=30)
+    tag = int(time.time())
+    with SessionLocal() as db:
+        users = [models.User(email=f"bench{tag}_{i}@example.com", username=f"bench{tag}_{i}", hashed_password="x",
+                             plan="pro", expires_at=expires_at, api_token=f"bench-{tag}-{i}") for i in range(n + 1)]
+        db.add_all(users)
+        db.commit()
+        return [user.api_token for user in users[:n]], create_access_token({"user_id": users[n].id})
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(samples: list) -> str:
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+    return (f"p50 {statistics.median(samples) * 1000:7.2f} ms | p95 {pick(0.95):7.2f} ms | "
+            f"p99 {pick(0.99):7.2f} ms | max {samples[-1] * 1000:7.2f} ms")
+
+
+async def measure_rest(client: httpx.AsyncClient, jwt: str, n: int) -> list:
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        response = await client.get("/api/workspaces/", headers={"Authorization": f"Bearer {jwt}"})
+        samples.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.text
+    return samples
+
+
+async def hold_stream(client: httpx.AsyncClient, token: str, codes: str, ready: asyncio.Event, results: dict):
+    params = {"codes": codes, "interval": STREAM_INTERVAL, "token": token}
+    try:
+        async with client.stream("GET", "/api/monitor/sse/market-data", params=params) as response:
+            if response.status_code != 200:
+                results["rejected"] += 1
+                return
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    results["frames"] += 1
+                    if not ready.is_set():
+                        results["receiving"] += 1
+                        ready.set()
+    except httpx.HTTPError:
+        results["errors"] += 1
+
+
+async def run(n_streams: int, n_requests: int, base_url: str, tokens: list, jwt: str):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    timeout = httpx.Timeout(30.0, read=None)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as stream_client, \
+            httpx.AsyncClient(base_url=base_url, timeout=30.0) as rest_client:
+        await measure_rest(rest_client, jwt, 20)  # 预热
+        idle = await measure_rest(rest_client, jwt, n_requests)
+        print(f"REST 无长连接     : {percentiles(idle)}")
+
+        rng = random.Random(42)
+        results = {"receiving": 0, "rejected": 0, "errors": 0, "frames": 0}
+        readies = [asyncio.Event() for _ in range(n_streams)]
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(hold_stream(stream_client, token, ",".join(rng.sample(SECIDS, CODES_PER_STREAM)),
+                                                 ready, results))
+                 for token, ready in zip(tokens, readies)]
+        await asyncio.wait([asyncio.create_task(ready.wait()) for ready in readies], timeout=60)
+        print(f"建立 {results['receiving']}/{n_streams} 条推流连接耗时 {time.perf_counter() - started:.2f} s "
+              f"(拒绝 {results['rejected']}, 错误 {results['errors']})")
+
+        busy = await measure_rest(rest_client, jwt, n_requests)
+        print(f"REST {results['receiving']:>4} 条长连接 : {percentiles(busy)}")
+        print(f"推流期间共收到 {results['frames']} 帧, 数据库连接池当前占用 {POOL_USAGE['current']} 个连接")
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    n_streams = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    logger.setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    market_hub_module.fetch_stock_data_async = fake_fetch_stock_data_async
+    monitor.codes_to_market_list_async = fake_codes_to_market_list_async
+
+    def on_checkout(*_):
+        POOL_USAGE["current"] += 1
+        POOL_USAGE["peak"] = max(POOL_USAGE["peak"], POOL_USAGE["current"])
+
+    def on_checkin(*_):
+        POOL_USAGE["current"] -= 1
+
+    for pool_engine in (engine, async_engine.sync_engine):
+        event.listen(pool_engine, "checkout", on_checkout)
+        event.listen(pool_engine, "checkin", on_checkin)
+
+    tokens, jwt = create_users(n_streams)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(build_app(), host="127.0.0.1", port=port, log_level="warning",
+                                           backlog=max(2048, n_streams * 2)))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    try:
+        asyncio.run(run(n_streams, n_requests, f"http://127.0.0.1:{port}", tokens, jwt))
+    finally:
+        print(f"数据库连接池: 峰值占用 {POOL_USAGE['peak']} 个连接 (同步: {engine.pool.status()}; "
+              f"异步: {async_engine.pool.status()})")
+        server.should_exit = True
+        thread.join(timeout=10)
+
+
+if __name__ == "__main__":
+    main()